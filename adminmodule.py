@@ -1,6 +1,14 @@
 import asyncio
 import command
 import config
+import datetime
+import io
+import logging
+
+from profiling import MemoryTracer
+from profiling import Profiler
+
+logger = logging.getLogger(__name__)
 
 class Die(command.CommandType):
     def __init__(self, admin_module):
@@ -30,6 +38,111 @@ class Info(command.CommandType):
     def recognized_channel(self, channel):
         return channel.is_private or channel == self._am.necrobot.main_channel
 
+class LoopLag(command.CommandType):
+    MAX_STACK_LINES = 12
+    MAX_MESSAGE_LEN = 2000                  # discord refuses longer messages
+
+    def __init__(self, admin_module):
+        command.CommandType.__init__(self, 'looplag')
+        self.help_text = "Show how far behind the bot's event loop has been running, and where it was last blocked. Admin only."
+        self._am = admin_module
+
+    @asyncio.coroutine
+    def _do_execute(self, command):
+        if not self._am.necrobot.is_admin(command.author):
+            return
+
+        monitor = self._am.necrobot.loop_monitor
+        text = monitor.status_str
+        if monitor.stalls:
+            stall = monitor.stalls[-1]
+            stack = ''.join(stall.stack[-LoopLag.MAX_STACK_LINES:]).replace('`', "'")
+            text += ' Last stall: {0}, in:\n'.format(stall)
+            stack_len = LoopLag.MAX_MESSAGE_LEN - len(text) - len('```\n```')
+            if stack_len > 0:
+                text += '```\n{0}```'.format(stack[-stack_len:])
+        yield from self._am.client.send_message(command.channel, text)
+
+    def recognized_channel(self, channel):
+        return channel.is_private or channel == self._am.necrobot.admin_channel
+
+class Profile(command.CommandType):
+    DEFAULT_SECONDS = 60
+    MAX_SECONDS = 15*60
+
+    def __init__(self, admin_module):
+        command.CommandType.__init__(self, 'profile')
+        self.help_text = "Profile the bot for a while, and upload the report to the admin channel. `.profile [sample] [seconds]` " \
+                         "starts a run (with cProfile, or with the cheaper sampling profiler if `sample` is given; {0}s by default), " \
+                         "and `.profile stop` ends it early. Admin only.".format(Profile.DEFAULT_SECONDS)
+        self._am = admin_module
+
+    @asyncio.coroutine
+    def _do_execute(self, command):
+        if not self._am.necrobot.is_admin(command.author):
+            return
+
+        args = [arg.lower() for arg in command.args]
+        profiler = self._am.profiler
+        if args == ['stop']:
+            if profiler.running:
+                yield from self._am.stop_profile()
+            else:
+                yield from self._am.client.send_message(command.channel, 'The profiler isn\'t running.')
+            return
+
+        if profiler.running:
+            yield from self._am.client.send_message(command.channel, 'The profiler is already running ({0}, for {1:.0f}s so far). Use `.profile stop` to end it.'.format(
+                profiler.mode, profiler.elapsed))
+            return
+
+        mode = Profiler.CPROFILE
+        if args and args[0] == Profiler.SAMPLE:
+            mode = Profiler.SAMPLE
+            args.pop(0)
+        try:
+            seconds = int(args[0]) if args else Profile.DEFAULT_SECONDS
+        except ValueError:
+            yield from self._am.client.send_message(command.channel, 'Error: couldn\'t parse {0} as a number of seconds.'.format(args[0]))
+            return
+        if len(args) > 1 or seconds <= 0 or seconds > Profile.MAX_SECONDS:
+            yield from self._am.client.send_message(command.channel, 'Usage: `.profile [sample] [seconds]` (at most {0} seconds), or `.profile stop`.'.format(Profile.MAX_SECONDS))
+            return
+
+        self._am.start_profile(mode, seconds, command.channel)
+        yield from self._am.client.send_message(command.channel, 'Profiling ({0}) for {1}s.'.format(mode, seconds))
+
+    def recognized_channel(self, channel):
+        return channel.is_private or channel == self._am.necrobot.admin_channel
+
+class MemSnap(command.CommandType):
+    def __init__(self, admin_module):
+        command.CommandType.__init__(self, 'memsnap')
+        self.help_text = "Take a snapshot of the bot's memory allocations, and upload the top allocation sites (and the change " \
+                         "since the last snapshot) to the admin channel. The first `.memsnap` starts tracing allocations; " \
+                         "`.memsnap stop` stops it. Admin only."
+        self._am = admin_module
+
+    @asyncio.coroutine
+    def _do_execute(self, command):
+        if not self._am.necrobot.is_admin(command.author):
+            return
+
+        tracer = self._am.memory_tracer
+        if [arg.lower() for arg in command.args] == ['stop']:
+            tracer.stop()
+            yield from self._am.client.send_message(command.channel, 'Stopped tracing memory allocations.')
+        elif not tracer.tracing:
+            tracer.start()
+            yield from self._am.client.send_message(command.channel, 'Started tracing memory allocations; `.memsnap` again to see what was allocated since.')
+        else:
+            # the snapshot is slow to sort through, so it's done off the event loop
+            report = yield from asyncio.get_event_loop().run_in_executor(None, tracer.snapshot)
+            yield from self._am.upload_report('memsnap', 'Memory snapshot:', report, command.channel)
+
+    def recognized_channel(self, channel):
+        return channel.is_private or channel == self._am.necrobot.admin_channel
+
 ## TODO: this doesn't work yet.
 ## TODO: it'd be nice to have an "update" command that spawns a bootstrapping process to pull from github and then restart this process
 ##class Reboot(command.CommandType):
@@ -47,7 +160,46 @@ class AdminModule(command.Module):
     def __init__(self, necrobot):
         command.Module.__init__(self, necrobot)
         self.command_types = [Die(self),
-                              Info(self)]
+                              Info(self),
+                              LoopLag(self),
+                              Profile(self),
+                              MemSnap(self)]
+        self.profiler = Profiler()
+        self.memory_tracer = MemoryTracer()
+        self._profile_timer = None                 #Task that stops the profiler at the end of its run
+        self._profile_channel = None               #where the profile was asked for
+
+    # Start the profiler, and stop it (uploading its report) after the given number of seconds
+    def start_profile(self, mode, seconds, channel=None):
+        self.profiler.start(mode)
+        self._profile_channel = channel
+        # a plain future rather than a supervised task, so that it doesn't hold one of the supervisor's slots while it sleeps
+        self._profile_timer = asyncio.ensure_future(self._stop_profile_after(seconds))
+
+    @asyncio.coroutine
+    def _stop_profile_after(self, seconds):
+        yield from asyncio.sleep(seconds)
+        self._profile_timer = None
+        yield from self.stop_profile()
+
+    @asyncio.coroutine
+    def stop_profile(self):
+        if self._profile_timer:
+            self._profile_timer.cancel()
+            self._profile_timer = None
+        report = self.profiler.stop()
+        if report:
+            yield from self.upload_report('profile', 'Profile:', report, self._profile_channel)
+
+    # Upload the report as a text file to the admin channel (or to the given channel, if there's no admin channel)
+    @asyncio.coroutine
+    def upload_report(self, name, content, report, channel=None):
+        destination = self.necrobot.admin_channel if self.necrobot.admin_channel else channel
+        if not destination:
+            logger.info('%s\n%s', content, report)
+            return
+        filename = '{0}-{1}.txt'.format(name, datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S"))
+        yield from self.client.send_file(destination, io.BytesIO(report.encode('utf-8')), filename=filename, content=content)
 
     @property
     def infostr(self):
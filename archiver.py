@@ -0,0 +1,264 @@
+## Saves the history of a channel before it's deleted.
+## History is read a page at a time (newest first) and each page is written to an sqlite archive on a background
+## thread while the next page is being fetched, so memory use doesn't grow with the size of the channel and the
+## event loop never waits on disk. Once a channel is archived, its plain-text log (logs/<channel>.log, oldest first)
+## is written out from the archive.
+## The archive has a full-text index (sqlite FTS5) over message text, author, channel and week, which search() queries;
+## logs saved as text files before the archive existed can be added to it with ingest_log_dir() (see ingestlogs.py).
+
+import asyncio
+import codecs
+import collections
+import concurrent.futures
+import datetime
+import logging
+import os
+import re
+import sqlite3
+
+import condortimestr
+import outbound
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100                 # messages per logs_from call
+INGEST_BATCH_SIZE = 500         # messages per insert when ingesting text logs
+LOG_LINE_REGEX = re.compile(r'^(.*?) \((\d\d)/(\d\d) (\d\d):(\d\d):(\d\d)\): ?(.*)$')     # a line of a .log file; see _write_log_file
+
+SearchHit = collections.namedtuple('SearchHit', ['channel_name', 'week', 'author_name', 'timestamp', 'snippet'])
+
+class Archiver(object):
+    def __init__(self, client, db_filename, log_dir='logs'):
+        self._client = client
+        self._db_filename = db_filename
+        self._log_dir = log_dir
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._db_conn = None                                #only ever used from the executor's thread
+        self._has_index = False                             #False if this sqlite has no FTS5, so the archive can't be searched
+
+    # Archive every message in the channel; week is the week number of the channel's match, if any.
+    # Returns the number of messages archived.
+    @asyncio.coroutine
+    def archive_channel(self, channel, week=None):
+        loop = asyncio.get_event_loop()
+        num_archived = 0
+        pending_write = None
+        before = None
+        while True:
+            if before:
+                page = yield from self._client.logs_from(channel, PAGE_SIZE, before=before, priority=outbound.PRIORITY_BULK)
+            else:
+                page = yield from self._client.logs_from(channel, PAGE_SIZE, priority=outbound.PRIORITY_BULK)
+
+            rows = []
+            for message in page:
+                rows.append(Archiver._message_row(message, channel, week))
+                before = message
+            if pending_write:
+                yield from pending_write
+                pending_write = None
+            if not rows:
+                break
+
+            pending_write = loop.run_in_executor(self._executor, self._write_rows, rows)
+            num_archived += len(rows)
+            if len(rows) < PAGE_SIZE:
+                break
+
+        if pending_write:
+            yield from pending_write
+        yield from loop.run_in_executor(self._executor, self._write_log_file, int(channel.id), channel.name)
+        return num_archived
+
+    # Archive several channels at once (at most max_concurrent at a time).
+    # Returns a list with, for each channel, the number of messages archived, or the exception raised while archiving it.
+    @asyncio.coroutine
+    def archive_channels(self, channels, week=None, max_concurrent=4):
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        @asyncio.coroutine
+        def archive_one(channel):
+            yield from semaphore.acquire()
+            try:
+                return (yield from self.archive_channel(channel, week))
+            finally:
+                semaphore.release()
+
+        return (yield from asyncio.gather(*[archive_one(channel) for channel in channels], return_exceptions=True))
+
+    # Returns a list of up to limit SearchHits for the FTS5 query, best first; or None if the archive can't be searched
+    @asyncio.coroutine
+    def search(self, query, limit=10):
+        return (yield from asyncio.get_event_loop().run_in_executor(self._executor, self._search, query, limit))
+
+    @staticmethod
+    def _message_row(message, channel, week):
+        return (int(message.id), int(channel.id), channel.name, week, int(message.author.id), message.author.name,
+                condortimestr.to_epoch(message.timestamp), message.clean_content)
+
+    ##-Executor thread-------------------------------------------------
+
+    def _get_db_conn(self):
+        if not self._db_conn:
+            self._db_conn = sqlite3.connect(self._db_filename)
+            self._has_index = Archiver.make_tables(self._db_conn)
+        return self._db_conn
+
+    # Creates the archive tables and search index; safe to call on an existing archive.
+    # Returns False if the search index couldn't be made (sqlite built without FTS5).
+    @staticmethod
+    def make_tables(db_conn):
+        db_conn.execute("""CREATE TABLE IF NOT EXISTS archived_messages
+                        (message_id int,
+                        channel_id int,
+                        channel_name text,
+                        week_number int,
+                        author_id int,
+                        author_name text,
+                        timestamp real,
+                        content text,
+                        PRIMARY KEY (message_id) ON CONFLICT REPLACE)""")
+        # messages ingested from text logs (which don't record message ids) get negative ids; they used to get NULL
+        db_conn.execute("UPDATE archived_messages SET message_id=-rowid WHERE message_id IS NULL")
+        db_conn.execute("CREATE INDEX IF NOT EXISTS archived_messages_channel ON archived_messages (channel_id, timestamp)")
+        db_conn.execute("CREATE INDEX IF NOT EXISTS archived_messages_channel_name ON archived_messages (channel_name)")
+        db_conn.commit()
+
+        index_exists = False
+        for row in db_conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='archive_fts'"):
+            index_exists = True
+        if index_exists:
+            return True
+
+        try:
+            # the index holds no text of its own; it reads it from archived_messages, and triggers keep it in step
+            db_conn.execute("""CREATE VIRTUAL TABLE archive_fts USING fts5
+                            (content, author_name, channel_name, week_number, timestamp UNINDEXED,
+                            content='archived_messages', content_rowid='rowid')""")
+        except sqlite3.OperationalError as e:
+            logger.warning('Warning: couldn\'t make the archive search index (%s); the archive won\'t be searchable.', e)
+            return False
+        db_conn.execute("""CREATE TRIGGER archive_fts_insert AFTER INSERT ON archived_messages BEGIN
+                            INSERT INTO archive_fts (rowid, content, author_name, channel_name, week_number, timestamp)
+                            VALUES (new.rowid, new.content, new.author_name, new.channel_name, new.week_number, new.timestamp);
+                        END""")
+        db_conn.execute("""CREATE TRIGGER archive_fts_delete AFTER DELETE ON archived_messages BEGIN
+                            INSERT INTO archive_fts (archive_fts, rowid, content, author_name, channel_name, week_number, timestamp)
+                            VALUES ('delete', old.rowid, old.content, old.author_name, old.channel_name, old.week_number, old.timestamp);
+                        END""")
+        db_conn.execute("INSERT INTO archive_fts (archive_fts) VALUES ('rebuild')")       #index anything archived before the index existed
+        db_conn.commit()
+        return True
+
+    def _write_rows(self, rows):
+        db_conn = self._get_db_conn()
+        # OR IGNORE: a message archived twice (e.g. .closeweek run again after an error) is kept as first archived;
+        # replacing it would leave the search index out of step, since the delete trigger doesn't fire on REPLACE
+        db_conn.executemany("INSERT OR IGNORE INTO archived_messages (message_id, channel_id, channel_name, week_number, author_id, author_name, timestamp, content) VALUES (?,?,?,?,?,?,?,?)", rows)
+        db_conn.commit()
+
+    def _write_log_file(self, channel_id, channel_name):
+        db_conn = self._get_db_conn()
+        params = (channel_id,)
+        outfile = codecs.open(os.path.join(self._log_dir, '{0}.log'.format(channel_name)), 'w', 'utf-8')
+        try:
+            for row in db_conn.execute("SELECT timestamp,author_name,content FROM archived_messages WHERE channel_id=? ORDER BY timestamp ASC", params):
+                timestamp = datetime.datetime.utcfromtimestamp(row[0])
+                outfile.write('{1} ({0}): {2}\n'.format(timestamp.strftime("%m/%d %H:%M:%S"), row[1], row[2]))
+        finally:
+            outfile.close()
+
+    def _search(self, query, limit):
+        db_conn = self._get_db_conn()
+        if not self._has_index:
+            return None
+
+        sql = """SELECT m.channel_name, m.week_number, m.author_name, m.timestamp, snippet(archive_fts, 0, '**', '**', '...', 16)
+                 FROM archive_fts JOIN archived_messages m ON m.rowid = archive_fts.rowid
+                 WHERE archive_fts MATCH ?
+                 ORDER BY rank
+                 LIMIT ?"""
+        try:
+            rows = db_conn.execute(sql, (query, limit,)).fetchall()
+        except sqlite3.OperationalError:
+            # not valid FTS5 query syntax; search for the words as given
+            quoted_query = ' '.join('"{0}"'.format(word.replace('"', '""')) for word in query.split())
+            rows = db_conn.execute(sql, (quoted_query, limit,)).fetchall()
+        return [SearchHit(*row) for row in rows]
+
+    ##-Text log ingest (runs on the calling thread; meant for ingestlogs.py)----
+
+    # Adds every .log file in the directory to the archive, skipping channels already in it.
+    # Returns (number of files ingested, number of messages ingested).
+    def ingest_log_dir(self, dirname, week=None):
+        num_files = 0
+        num_messages = 0
+        for filename in sorted(os.listdir(dirname)):
+            if filename.endswith('.log'):
+                num_ingested = self.ingest_log_file(os.path.join(dirname, filename), week)
+                if num_ingested is not None:
+                    num_files += 1
+                    num_messages += num_ingested
+        return num_files, num_messages
+
+    # Adds the messages of a .log file to the archive. The logs don't record the year, so it's taken from the file's
+    # modification time. Returns the number of messages ingested, or None if that channel was already archived.
+    def ingest_log_file(self, filename, week=None):
+        db_conn = self._get_db_conn()
+        channel_name = os.path.splitext(os.path.basename(filename))[0]
+        params = (channel_name,)
+        for row in db_conn.execute("SELECT 1 FROM archived_messages WHERE channel_name=? LIMIT 1", params):
+            return None
+
+        # the logs don't record message ids, so the messages get ids counting down from below the lowest one taken
+        next_id = -1
+        for row in db_conn.execute("SELECT MIN(message_id) FROM archived_messages"):
+            if row[0] is not None and row[0] <= next_id:
+                next_id = row[0] - 1
+
+        modified = datetime.datetime.utcfromtimestamp(os.path.getmtime(filename))
+        year = None
+        last_month = None
+        num_ingested = 0
+        batch = []
+        last_row = None
+        infile = codecs.open(filename, 'r', 'utf-8', errors='replace')
+        try:
+            for line in infile:
+                line = line.rstrip('\n')
+                m = LOG_LINE_REGEX.match(line)
+                if not m:
+                    # a message with line breaks in it
+                    if last_row:
+                        last_row[7] += '\n' + line
+                    continue
+
+                month = int(m.group(2))
+                if year is None:
+                    year = modified.year if month <= modified.month else modified.year - 1
+                elif month < last_month:
+                    year += 1               #the log ran over new year's
+                last_month = month
+
+                try:
+                    timestamp = datetime.datetime(year, month, int(m.group(3)), int(m.group(4)), int(m.group(5)), int(m.group(6)))
+                except ValueError:
+                    continue
+                if last_row:
+                    batch.append(tuple(last_row))
+                last_row = [next_id, None, channel_name, week, None, m.group(1), condortimestr.to_epoch(timestamp), m.group(7)]
+                next_id -= 1
+
+                if len(batch) >= INGEST_BATCH_SIZE:
+                    self._write_rows(batch)
+                    num_ingested += len(batch)
+                    batch = []
+        finally:
+            infile.close()
+
+        if last_row:
+            batch.append(tuple(last_row))
+        if batch:
+            self._write_rows(batch)
+            num_ingested += len(batch)
+        return num_ingested
@@ -0,0 +1,293 @@
+## Times every public CondorDB method against a synthetic database of several seasons of CoNDOR, and writes the
+## timings to a JSON report, so that the DB layer can be compared between versions.
+## The database is made with the dbmake.py schema: the racers (user_data), every week's matches (match_data), three
+## races for each played match (race_data), and a race room for each match of the current week (channel_data).
+## The weeks of all the seasons are numbered in sequence in the one database, as they would be if the season's
+## database were never archived. Each racer plays in about half the weeks.
+## Each method is called with randomly chosen (but existing) racers and matches, CALLS_PER_METHOD times or for
+## TIME_PER_METHOD seconds, whichever comes first. Methods that write go last, and change the synthetic data only.
+## Usage: python benchdb.py [number of racers] [number of seasons] [report file] [baseline report to compare against]
+
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import config
+import dbmake
+
+from condordb import CondorDB
+from condormatch import CondorMatch
+from condormatch import CondorRacer
+from loopmonitor import percentile
+
+WEEKS_PER_SEASON = 10
+RACES_PER_MATCH = 3
+PLAYING_FRACTION = 0.5          # fraction of the racers with a match in any given week
+CALLS_PER_METHOD = 200
+TIME_PER_METHOD = 5.0           # seconds
+SEED = 1
+FIRST_DISCORD_ID = 100000000000000000
+FIRST_STEAM_ID = 76561190000000000
+TIMEZONES = ['America/New_York', 'America/Los_Angeles', 'Europe/London', 'Europe/Berlin', 'Australia/Sydney', 'UTC']
+
+def racer_row(i):
+    return (i + 1, FIRST_DISCORD_ID + i, 'Racer {0}'.format(i), 'racer{0}'.format(i), FIRST_STEAM_ID + i, TIMEZONES[i % len(TIMEZONES)])
+
+def make_racer(i):
+    row = racer_row(i)
+    racer = CondorRacer(row[3])
+    racer.discord_id = row[1]
+    racer.discord_name = row[2]
+    racer.steam_id = row[4]
+    racer.timezone = row[5]
+    return racer
+
+# Fills the (empty) database. Returns (the week's pairings (racer index, racer index), keyed by week, the current week,
+# the time of the current week's first match).
+def make_dataset(db_conn, num_racers, num_seasons, rng):
+    num_weeks = num_seasons*WEEKS_PER_SEASON
+    matches_per_week = max(1, int(num_racers*PLAYING_FRACTION) // 2)
+    confirmed = CondorMatch.FLAG_SCHEDULED | CondorMatch.FLAG_SCHEDULED_BY_R1 | CondorMatch.FLAG_CONFIRMED_BY_R1 | CondorMatch.FLAG_CONFIRMED_BY_R2
+    first_week_start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(weeks=num_weeks - 1, days=3)
+    offset = CondorMatch.OFFSET_DATETIME
+
+    db_conn.executemany("INSERT INTO user_data (racer_id, discord_id, discord_name, twitch_name, steam_id, timezone) VALUES (?,?,?,?,?,?)",
+                        (racer_row(i) for i in range(num_racers)))
+
+    pairings = {}
+    racer_indices = list(range(num_racers))
+    for week in range(1, num_weeks + 1):
+        rng.shuffle(racer_indices)
+        pairings[week] = [(racer_indices[2*i], racer_indices[2*i + 1]) for i in range(matches_per_week)]
+
+    def match_rows():
+        for week, week_pairings in pairings.items():
+            week_start = first_week_start + datetime.timedelta(weeks=week - 1)
+            played = week < num_weeks
+            for i, (r1, r2) in enumerate(week_pairings):
+                timestamp = int((week_start + datetime.timedelta(minutes=10*i) - offset).total_seconds())
+                if played:
+                    wins = rng.randint(0, RACES_PER_MATCH)
+                    cawmentator_id = FIRST_DISCORD_ID + rng.randrange(num_racers) if i % 10 == 0 else 0
+                    yield (r1 + 1, r2 + 1, week, timestamp, wins, RACES_PER_MATCH - wins, 0, 0, 0, confirmed | CondorMatch.FLAG_PLAYED, RACES_PER_MATCH, cawmentator_id)
+                elif i % 2 == 0:
+                    yield (r1 + 1, r2 + 1, week, timestamp, 0, 0, 0, RACES_PER_MATCH, 0, confirmed, RACES_PER_MATCH, 0)
+                else:
+                    yield (r1 + 1, r2 + 1, week, 0, 0, 0, 0, RACES_PER_MATCH, 0, 0, RACES_PER_MATCH, 0)
+
+    db_conn.executemany("""INSERT INTO match_data (racer_1_id, racer_2_id, week_number, timestamp, racer_1_wins, racer_2_wins, draws,
+                                                   noplays, cancels, flags, number_of_races, cawmentator_id)
+                           VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""", match_rows())
+
+    def race_rows():
+        for week in range(1, num_weeks):
+            for r1, r2 in pairings[week]:
+                for race_number in range(1, RACES_PER_MATCH + 1):
+                    times = (rng.randint(30000, 90000), rng.randint(30000, 90000))
+                    yield (r1 + 1, r2 + 1, week, race_number, 0, rng.randint(0, 10**7), times[0], times[1], 1 if times[0] < times[1] else 2, 0, 0)
+
+    db_conn.executemany("""INSERT INTO race_data (racer_1_id, racer_2_id, week_number, race_number, timestamp, seed, racer_1_time, racer_2_time,
+                                                  winner, contested, flags)
+                           VALUES (?,?,?,?,?,?,?,?,?,?,?)""", race_rows())
+
+    db_conn.executemany("INSERT INTO channel_data (channel_id, racer_1_id, racer_2_id, week_number) VALUES (?,?,?,?)",
+                        ((FIRST_DISCORD_ID + num_racers + i, r1 + 1, r2 + 1, num_weeks) for i, (r1, r2) in enumerate(pairings[num_weeks])))
+    db_conn.commit()
+
+    return pairings, num_weeks, first_week_start + datetime.timedelta(weeks=num_weeks - 1)
+
+class Bench(object):
+    def __init__(self, db_conn, num_racers, pairings, current_week, current_week_start, rng):
+        self.db = CondorDB(db_conn)
+        self.num_racers = num_racers
+        self.pairings = pairings
+        self.current_week = current_week
+        self.current_week_start = current_week_start
+        self.rng = rng
+        self.racers = {}                        #racer index -> CondorRacer, made as needed
+        self.channel_ids = [FIRST_DISCORD_ID + num_racers + i for i in range(len(pairings[current_week]))]
+        self.new_channel_ids = []               #channels registered by the benchmark
+        self._new_ids = iter(range(FIRST_DISCORD_ID + 2*num_racers, FIRST_DISCORD_ID + 3*num_racers + 10**6))
+        self.results = {}
+
+    def racer(self, i=None):
+        i = self.rng.randrange(self.num_racers) if i is None else i
+        if i not in self.racers:
+            self.racers[i] = make_racer(i)
+        return self.racers[i]
+
+    # A random match; a played one unless current is set
+    def match(self, current=False):
+        week = self.current_week if current else self.rng.randint(1, self.current_week - 1)
+        r1, r2 = self.rng.choice(self.pairings[week])
+        return CondorMatch(self.racer(r1), self.racer(r2), week)
+
+    def new_racer(self):
+        new_id = next(self._new_ids)
+        racer = CondorRacer('newracer{0}'.format(new_id))
+        racer.discord_id = new_id
+        racer.discord_name = 'New Racer {0}'.format(new_id)
+        racer.timezone = 'UTC'
+        return racer
+
+    # A match between two racers who aren't yet in the database, in the week after the current one
+    def new_match(self):
+        return CondorMatch(self.new_racer(), self.new_racer(), self.current_week + 1)
+
+    # Times calls of fn; args_fn makes the arguments of each call (its time isn't counted). What CondorDB prints (e.g.
+    # when a match has no cawmentator) is dropped.
+    def measure(self, name, fn, args_fn):
+        times = []
+        deadline = time.perf_counter() + TIME_PER_METHOD
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            while len(times) < CALLS_PER_METHOD and (not times or time.perf_counter() < deadline):
+                args = args_fn()
+                start = time.perf_counter()
+                fn(*args)
+                times.append(time.perf_counter() - start)
+        times.sort()
+        self.results[name] = {
+            'calls': len(times),
+            'mean_us': 1e6*sum(times)/len(times),
+            'p50_us': 1e6*percentile(times, 50),
+            'p95_us': 1e6*percentile(times, 95),
+            'p99_us': 1e6*percentile(times, 99),
+            'max_us': 1e6*times[-1],
+            }
+        print('{0:<32} {1:>6} {2:>12.1f} {3:>12.1f} {4:>12.1f}'.format(
+            name, len(times), self.results[name]['p50_us'], self.results[name]['p95_us'], self.results[name]['max_us']))
+
+    def run(self):
+        db = self.db
+        print('{0:<32} {1:>6} {2:>12} {3:>12} {4:>12}'.format('method', 'calls', 'p50 us', 'p95 us', 'max us'))
+
+        ## Reads
+        self.measure('get_from_discord_id', db.get_from_discord_id, lambda: (self.racer().discord_id,))
+        self.measure('get_from_discord_name', db.get_from_discord_name, lambda: (self.racer().discord_name,))
+        self.measure('get_from_twitch_name', db.get_from_twitch_name, lambda: (self.racer().twitch_name,))
+        self.measure('get_from_steam_id', db.get_from_steam_id, lambda: (self.racer().steam_id,))
+        self.measure('is_registered_user', db.is_registered_user, lambda: (self.racer().discord_id,))
+        self.measure('is_registered_channel', db.is_registered_channel, lambda: (self.rng.choice(self.channel_ids),))
+        self.measure('find_match_channel_id', db.find_match_channel_id, lambda: (self.match(current=True),))
+        self.measure('find_channel_ids_with', db.find_channel_ids_with, lambda: (self.racer(),))
+        self.measure('get_open_match_channel_info', db.get_open_match_channel_info, lambda: (self.current_week + 1,))
+        self.measure('get_all_race_channel_ids', db.get_all_race_channel_ids, lambda: ())
+        self.measure('get_race_channels_from_week', db.get_race_channels_from_week, lambda: (self.current_week,))
+        self.measure('get_match', db.get_match, lambda: (lambda m: (m.racer_1, m.racer_2, m.week))(self.match()))
+        self.measure('get_match (latest week)', db.get_match, lambda: (lambda m: (m.racer_1, m.racer_2))(self.match()))
+        self.measure('get_channel_id_from_match', db.get_channel_id_from_match, lambda: (self.match(current=True),))
+        self.measure('get_match_from_channel_id', db.get_match_from_channel_id, lambda: (self.rng.choice(self.channel_ids),))
+        self.measure('get_all_matches', db.get_all_matches, lambda: ())
+        self.measure('get_upcoming_matches', db.get_upcoming_matches, lambda: (self.current_week_start, 200,))
+        self.measure('get_schedule_message_ids', db.get_schedule_message_ids, lambda: (self.rng.choice(self.channel_ids),))
+        self.measure('get_cawmentator', db.get_cawmentator, lambda: (self.match(),))
+        self.measure('number_of_wins_of_leader', db.number_of_wins_of_leader, lambda: (self.match(),))
+        self.measure('number_of_finished_races', db.number_of_finished_races, lambda: (self.match(),))
+        self.measure('number_of_wins', db.number_of_wins, lambda: (lambda m: (m, m.racer_1, True))(self.match()))
+        self.measure('largest_recorded_race_number', db.largest_recorded_race_number, lambda: (self.match(),))
+        self.measure('finished_race_number', db.finished_race_number, lambda: (self.match(), RACES_PER_MATCH,))
+        self.measure('get_score', db.get_score, lambda: (self.match(),))
+        self.measure('get_race_flags', db.get_race_flags, lambda: (self.match(), self.rng.randint(1, RACES_PER_MATCH),))
+
+        ## Writes
+        def new_channel():
+            self.new_channel_ids.append(next(self._new_ids))
+            return self.new_match(), self.new_channel_ids[-1]
+        self.measure('register_channel', db.register_channel, new_channel)
+        self.measure('delete_channel', db.delete_channel, lambda: (self.new_channel_ids.pop() if self.new_channel_ids else next(self._new_ids),))
+        self.measure('register_racer', db.register_racer, lambda: (self.new_racer(),))
+        self.measure('transfer_racer_to', db.transfer_racer_to,
+                  lambda: (lambda r: (r.twitch_name, types.SimpleNamespace(id=r.discord_id, name=r.discord_name)))(self.racer()))
+        self.measure('register_timezone', db.register_timezone, lambda: (self.racer().discord_id, self.rng.choice(TIMEZONES),))
+        self.measure('update_match', db.update_match, lambda: (self.match(current=True),))
+        self.measure('set_schedule_message_id', db.set_schedule_message_id,
+                  lambda: (self.rng.choice(self.channel_ids), self.rng.randint(0, 3), next(self._new_ids),))
+        self.measure('delete_schedule_messages', db.delete_schedule_messages, lambda: (self.rng.choice(self.channel_ids), 2,))
+        self.measure('add_cawmentary', db.add_cawmentary, lambda: (self.match(), self.racer().discord_id,))
+        self.measure('remove_cawmentary', db.remove_cawmentary, lambda: (self.match(),))
+        self.measure('record_race', db.record_race, lambda: (self.match(current=True), 60000, 61000, 1, 12345, 0, False,))
+        self.measure('record_match', db.record_match, lambda: (self.match(current=True),))
+        self.measure('cancel_race', db.cancel_race, lambda: (self.match(), self.rng.randint(1, RACES_PER_MATCH),))
+        self.measure('change_winner', db.change_winner, lambda: (self.match(), self.rng.randint(1, RACES_PER_MATCH), self.rng.randint(1, 2),))
+        self.measure('set_contested', db.set_contested,
+                  lambda: (lambda m: (m, self.rng.randint(1, RACES_PER_MATCH), types.SimpleNamespace(id=m.racer_1.discord_id)))(self.match()))
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Prints the change in median time of each method against an earlier report
+def compare(results, baseline_filename):
+    with open(baseline_filename) as baseline_file:
+        baseline = json.load(baseline_file)
+    print('')
+    print('Against {0} (revision {1}, {2}):'.format(baseline_filename, baseline.get('revision'), baseline.get('created')))
+    if baseline.get('scale') != results['scale']:
+        print('  Warning: the baseline was run at a different scale ({0}).'.format(baseline.get('scale')))
+    print('{0:<32} {1:>12} {2:>12} {3:>9}'.format('method', 'then p50 us', 'now p50 us', 'change'))
+    for name, now in results['methods'].items():
+        then = baseline['methods'].get(name)
+        if then:
+            print('{0:<32} {1:>12.1f} {2:>12.1f} {3:>+9.0%}'.format(name, then['p50_us'], now['p50_us'], now['p50_us']/then['p50_us'] - 1))
+
+def main(args):
+    num_racers = int(args[0]) if len(args) > 0 else 1000
+    num_seasons = int(args[1]) if len(args) > 1 else 4
+    report_filename = args[2] if len(args) > 2 else 'benchdb-{0}x{1}.json'.format(num_racers, num_seasons)
+    baseline_filename = args[3] if len(args) > 3 else None
+
+    config.init('data/bot_config.txt')
+    rng = random.Random(SEED)
+    db_fd, db_filename = tempfile.mkstemp(prefix='condorbot-benchdb-', suffix='.db')
+    os.close(db_fd)
+    try:
+        db_conn = sqlite3.connect(db_filename)
+        dbmake.make_tables(db_conn)
+        start = time.perf_counter()
+        pairings, current_week, current_week_start = make_dataset(db_conn, num_racers, num_seasons, rng)
+        setup_time = time.perf_counter() - start
+        counts = dict((table, db_conn.execute("SELECT COUNT(*) FROM {0}".format(table)).fetchone()[0])
+                      for table in ('user_data', 'match_data', 'race_data', 'channel_data'))
+        print('{0} racers, {1} seasons ({2} weeks): {3}; made in {4:.1f}s.'.format(
+            num_racers, num_seasons, current_week, ', '.join('{0} {1}'.format(n, table) for table, n in counts.items()), setup_time))
+        print('')
+
+        bench = Bench(db_conn, num_racers, pairings, current_week, current_week_start, rng)
+        bench.run()
+        db_conn.close()
+    finally:
+        os.remove(db_filename)
+
+    results = {
+        'created': datetime.datetime.utcnow().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'scale': {'racers': num_racers, 'seasons': num_seasons, 'weeks_per_season': WEEKS_PER_SEASON, 'races_per_match': RACES_PER_MATCH},
+        'rows': counts,
+        'setup_seconds': setup_time,
+        'methods': bench.results,
+        }
+    with open(report_filename, 'w') as report_file:
+        json.dump(results, report_file, indent=2)
+    print('')
+    print('Report written to {0}.'.format(report_filename))
+
+    if baseline_filename:
+        compare(results, baseline_filename)
+
+##-------------------------
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
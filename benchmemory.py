@@ -0,0 +1,87 @@
+## Measures the memory used by the model objects (CondorRacer, CondorMatch, Racer, RaceInfo) when a full season of
+## matches is materialized, comparing the __slots__ classes against equivalent classes with a per-instance __dict__.
+## Usage: python benchmemory.py [number of racers] [number of weeks]
+
+import datetime
+import gc
+import sys
+import tracemalloc
+import types
+
+import config
+
+from condormatch import CondorMatch
+from condormatch import CondorRacer
+from raceinfo import RaceInfo
+from racer import Racer
+
+config.init('data/bot_config.txt')
+
+# Returns a copy of the class that keeps its attributes in a __dict__ instead of __slots__
+def unslotted(cls):
+    namespace = dict((k, v) for k, v in cls.__dict__.items() if k not in cls.__slots__ and k not in ('__slots__', '__dict__', '__weakref__'))
+    return type(cls.__name__, cls.__bases__, namespace)
+
+# Makes every racer, and a match for every pairing in every week (as a schedule refresh or .closeweek would)
+def make_season(racer_cls, match_cls, num_racers, num_weeks):
+    racers = []
+    for i in range(num_racers):
+        racer = racer_cls('racer{0}'.format(i))
+        racer.discord_id = str(100000000000000000 + i)
+        racer.discord_name = 'Racer {0}'.format(i)
+        racer.steam_id = 76561190000000000 + i
+        racer.timezone = 'America/New_York'
+        racers.append(racer)
+
+    start = datetime.datetime(year=2016, month=9, day=1, tzinfo=CondorMatch.OFFSET_DATETIME.tzinfo)
+    matches = []
+    for week in range(1, num_weeks + 1):
+        for i in range(0, num_racers - 1, 2):
+            match = match_cls(racers[i], racers[i + 1], week)
+            match.schedule(start + datetime.timedelta(days=7*week, minutes=i), racers[i])
+            match.confirm(racers[i])
+            matches.append(match)
+    return racers, matches
+
+# Makes a Racer (for each of the given members) and a RaceInfo per match
+def make_races(racer_cls, raceinfo_cls, members):
+    objects = []
+    for member in members:
+        objects.append(racer_cls(member))
+        objects.append(raceinfo_cls())
+    return objects
+
+# Returns (bytes allocated, number of objects) by the call
+def measure(fn, *args):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn(*args)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    num_objects = sum(len(x) for x in result) if isinstance(result, tuple) else len(result)
+    return after - before, num_objects, result
+
+def run(num_racers, num_weeks):
+    print('A season of {0} racers over {1} weeks:'.format(num_racers, num_weeks))
+    print('{0:<28} {1:>12} {2:>12} {3:>10}'.format('', '__dict__', '__slots__', 'saved'))
+
+    dict_bytes, num_objects, dict_result = measure(make_season, unslotted(CondorRacer), unslotted(CondorMatch), num_racers, num_weeks)
+    slot_bytes, num_objects, slot_result = measure(make_season, CondorRacer, CondorMatch, num_racers, num_weeks)
+    report('racers + matches', dict_bytes, slot_bytes, num_objects)
+    num_matches = len(slot_result[1])
+    del dict_result, slot_result
+
+    members = [types.SimpleNamespace(id=str(i), name='member{0}'.format(i)) for i in range(num_matches)]
+    dict_bytes, num_objects, dict_result = measure(make_races, unslotted(Racer), unslotted(RaceInfo), members)
+    slot_bytes, num_objects, slot_result = measure(make_races, Racer, RaceInfo, members)
+    report('race racers + race infos', dict_bytes, slot_bytes, num_objects)
+
+def report(name, dict_bytes, slot_bytes, num_objects):
+    print('{0:<28} {1:>12,} {2:>12,} {3:>9.0%}'.format(name, dict_bytes, slot_bytes, 1 - slot_bytes/dict_bytes))
+    print('{0:<28} {1:>12.0f} {2:>12.0f}'.format('  bytes per object', dict_bytes/num_objects, slot_bytes/num_objects))
+
+##-------------------------
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 128, int(sys.argv[2]) if len(sys.argv) > 2 else 12)
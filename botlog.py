@@ -0,0 +1,116 @@
+## Logging for the bot. A record is put on a queue by the thread that logs it (usually the event loop's), and a
+## listener thread writes it out, so that a slow disk never holds up a race countdown.
+## The log file has one JSON object per line, with the match, channel and command the record is about where known
+## (log with extra=botlog.context(...)). It's rotated when it gets too big or too old, and on each start of the bot.
+## Records at INFO and above are also written to the console, as plain text.
+## Until init() is called (e.g. in the benchmark and load test scripts), warnings and errors go to stderr as usual.
+
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+
+CONSOLE_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+_listener = None
+
+# Returns a dict to pass as extra= when logging, to record what the message is about. channel may be a Channel or
+# a channel id, match a CondorMatch, and command a Command or a command name; anything else is recorded as given.
+def context(channel=None, match=None, command=None, **fields):
+    ctx = {}
+    if channel is not None:
+        ctx['channel_id'] = str(getattr(channel, 'id', channel))
+        if getattr(channel, 'name', None):
+            ctx['channel'] = channel.name
+    if match is not None:
+        ctx['match'] = match.channel_name
+        ctx['week'] = match.week
+    if command is not None:
+        ctx['command'] = getattr(command, 'command', command)
+        if getattr(command, 'author', None):
+            ctx['author_id'] = command.author.id
+    ctx.update(fields)
+    return {'context': ctx}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': datetime.datetime.utcfromtimestamp(record.created).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': record.getMessage()}
+        entry.update(getattr(record, 'context', {}))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, sort_keys=True, default=str)
+
+# Puts records on the queue with their message and traceback already rendered (so nothing the record refers to can
+# change before the listener gets to it), but unformatted, so that each handler can still format them its own way
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+# A log file that's rotated when it would go over max_bytes, or when it's been written to for interval seconds
+# (the old files are renamed .1, .2, etc., and the oldest deleted)
+class RotatingLogHandler(logging.handlers.RotatingFileHandler):
+    def __init__(self, filename, max_bytes, interval, backup_count):
+        logging.handlers.RotatingFileHandler.__init__(self, filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self._interval = interval
+        self._rollover_at = time.time() + interval
+
+    def shouldRollover(self, record):
+        if time.time() >= self._rollover_at:
+            return 1
+        return logging.handlers.RotatingFileHandler.shouldRollover(self, record)
+
+    def doRollover(self):
+        logging.handlers.RotatingFileHandler.doRollover(self)
+        self._rollover_at = time.time() + self._interval
+
+# Start logging to the given file (and the console). discord.py's own logging is kept to discord_level and above.
+def init(filename, level=logging.INFO, max_bytes=20*1024*1024, interval=24*60*60, backup_count=30, discord_level=logging.WARNING):
+    global _listener
+    if _listener:
+        return
+
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    file_handler = RotatingLogHandler(filename, max_bytes, interval, backup_count)
+    file_handler.setFormatter(JsonFormatter())
+    if os.path.exists(filename) and os.path.getsize(filename) > 0:
+        file_handler.doRollover()               # each run of the bot starts a new file
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+
+    log_queue = queue.Queue()
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_QueueHandler(log_queue))
+    logging.getLogger('discord').setLevel(discord_level)
+
+# Write out whatever's still on the queue, and stop the listener thread
+def shutdown():
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
@@ -3,7 +3,10 @@
 import asyncio
 import clparse
 import config
+import logging
 import shlex
+
+logger = logging.getLogger(__name__)
    
 # Represents a full user command input (e.g. `.make -c Cadence -seed 12345 -custom 4-shrine`)
 class Command(object):
@@ -11,6 +14,7 @@ class Command(object):
         self.command = None
         self.args = []      
         self.message = None
+        self.handled = False                # set once some CommandType has taken the command
 
         if message.content.startswith(config.BOT_COMMAND_PREFIX):
             try:
@@ -62,6 +66,7 @@ class CommandType(object):
     @asyncio.coroutine
     def execute(self, command):
         if command.command in self.command_name_list and self.recognized_channel(command.channel):
+            command.handled = True
             yield from self._do_execute(command)
 
     # Returns true if the command is "recognized" in the given channel
@@ -71,7 +76,7 @@ class CommandType(object):
     # Overwrite this to determine what this CommandType should do with a given Command
     @asyncio.coroutine
     def _do_execute(self, command):
-        print('Error: called CommandType._do_execute in the abstract base class.')
+        logger.error('Error: called CommandType._do_execute in the abstract base class.')
         pass
 
 class DefaultHelp(CommandType):
@@ -110,6 +115,19 @@ class Module(object):
     def initialize(self):
         pass
 
+    # Called instead of initialize when the bot reconnects to discord with this module already loaded; the server's
+    # channel objects have been replaced, so anything holding on to them should look them up again
+    # Base method does nothing; override for functionality
+    @asyncio.coroutine
+    def on_reconnect(self):
+        pass
+
+    # Returns what this module wants saved in the warm-start snapshot (see warmstart.py), as something JSON can
+    # store; it's given back to the module as necrobot.warm_snapshot_for(module) on the next start
+    # Base method saves nothing
+    def snapshot(self):
+        return None
+
     @property
     def client(self):
         return self.necrobot.client
@@ -130,6 +148,12 @@ class Module(object):
         for cmd_type in self.command_types:
             yield from cmd_type.execute(command)
 
+    # Called when a channel on the server is deleted
+    # Base method does nothing; override for functionality
+    @asyncio.coroutine
+    def on_channel_delete(self, channel):
+        pass
+
     # Called when a user updates their preferences with the given UserPrefs
     # Base method does nothing; override for functionality
     @asyncio.coroutine
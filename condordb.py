@@ -1,17 +1,34 @@
 import asyncio
 import datetime
+import logging
 import sqlite3
 
+import botlog
 import config
+import metrics
 from condormatch import CondorMatch
 from condormatch import CondorRacer
 
+logger = logging.getLogger(__name__)
+
 class CondorDB(object):
     RACE_CANCELLED_FLAG = int(1) << 0
     RACE_FORCE_RECORDED_FLAG = int(1) << 1
     
     def __init__(self, db_connection):
         self._db_conn = db_connection
+        CondorDB.make_schedule_tables(self._db_conn)
+
+    # Tables added after the original schema (also made by dbmake); safe to call on an existing database
+    @staticmethod
+    def make_schedule_tables(db_conn):
+        db_conn.execute("""CREATE TABLE IF NOT EXISTS schedule_messages
+                        (channel_id int,
+                        page int,
+                        message_id int,
+                        PRIMARY KEY (channel_id, page) ON CONFLICT REPLACE)""")
+        db_conn.execute("CREATE INDEX IF NOT EXISTS match_data_timestamp ON match_data (timestamp)")
+        db_conn.commit()
 
     def _get_racer_from_row(row):
         racer = CondorRacer(row[2])
@@ -37,21 +54,21 @@ class CondorDB(object):
         params = (racer_id,)
         for row in self._db_conn.execute("SELECT discord_id,discord_name,twitch_name,steam_id,timezone FROM user_data WHERE racer_id=?", params):
             return CondorDB._get_racer_from_row(row)
-        print('Couldn\'t find racer id <{}>.'.format(racer_id))
+        logger.info('Couldn\'t find racer id <%s>.', racer_id)
         return None            
 
     def get_from_discord_id(self, discord_id):
         params = (discord_id,)
         for row in self._db_conn.execute("SELECT discord_id,discord_name,twitch_name,steam_id,timezone FROM user_data WHERE discord_id=?", params):
             return CondorDB._get_racer_from_row(row)
-        print('Couldn\'t find discord id <{}>.'.format(discord_id))
+        logger.info('Couldn\'t find discord id <%s>.', discord_id)
         return None         
 
     def get_from_discord_name(self, discord_name):
         params = (discord_name.lower(),)
         for row in self._db_conn.execute("SELECT discord_id,discord_name,twitch_name,steam_id,timezone FROM user_data WHERE LOWER(discord_name)=?", params):
             return CondorDB._get_racer_from_row(row)
-        print('Couldn\'t find discord name <{}>.'.format(discord_name))
+        logger.info('Couldn\'t find discord name <%s>.', discord_name)
         return None        
 
     def get_from_twitch_name(self, twitch_name, register=False):
@@ -66,14 +83,14 @@ class CondorDB(object):
             for row in self._db_conn.execute("SELECT discord_id,discord_name,twitch_name,steam_id,timezone FROM user_data WHERE twitch_name=?", params):
                 return CondorDB._get_racer_from_row(row)
             
-        print('Couldn\'t find twitch name <{}>.'.format(twitch_name))
+        logger.info('Couldn\'t find twitch name <%s>.', twitch_name)
         return None
 
     def get_from_steam_id(self, steam_id):
         params = (steam_id,)
         for row in self._db_conn.execute("SELECT discord_id,discord_name,twitch_name,steam_id,timezone FROM user_data WHERE steam_id=?", params):
             return CondorDB._get_racer_from_row(row)
-        print('Couldn\'t find steam id <{}>.'.format(steam_id))
+        logger.info('Couldn\'t find steam id <%s>.', steam_id)
         return None        
 
     def is_registered_user(self, discord_id):
@@ -109,7 +126,7 @@ class CondorDB(object):
         params = (racer.twitch_name.lower(),)
         for row in self._db_conn.execute("SELECT discord_id,discord_name FROM user_data WHERE LOWER(twitch_name)=?", params):
             if row[0] and not int(row[0]) == int(racer.discord_id):
-                print('Error: User {0} tried to register twitch name {1}, but that name is already registered to {2}.'.format(racer.discord_name, racer.twitch_name, row[1]))
+                logger.warning('Error: User %s tried to register twitch name %s, but that name is already registered to %s.', racer.discord_name, racer.twitch_name, row[1])
                 return False
             else:
                 params = (racer.discord_id, racer.discord_name, racer.twitch_name, racer.steam_id, racer.timezone, racer.twitch_name.lower(),)
@@ -177,7 +194,7 @@ class CondorDB(object):
                 try:
                     week_number = int(row[0])
                 except ValueError:
-                    print('ValueError in parsing week number {}.'.format(row[0]))
+                    logger.error('ValueError in parsing week number %s.', row[0])
                     return None
 
                 return self.get_match(racer_1, racer_2, week_number)
@@ -212,39 +229,68 @@ class CondorDB(object):
             racer_1 = self._get_racer_from_id(row[0])
             racer_2 = self._get_racer_from_id(row[1])
             if not racer_1 or not racer_2:
-                print('Error: couldn\'t find racers in CondorDB.get_match_from_channel_id.')
+                logger.error('Error: couldn\'t find racers in CondorDB.get_match_from_channel_id.', extra=botlog.context(channel=channel_id))
                 return None
             return self.get_match(racer_1, racer_2, int(row[2]))
         return None
 
     def get_all_matches(self):
-        match_list = []
+        return [match for match, channel_id in self.get_all_match_channels()]
+
+    # Returns a list of (match, channel id) for every match that has a channel
+    def get_all_match_channels(self):
+        match_channels = []
         for row in self._db_conn.execute("SELECT channel_id FROM channel_data"):
-            match = self.get_match_from_channel_id(int(row[0]))
+            channel_id = int(row[0])
+            match = self.get_match_from_channel_id(channel_id)
             if match:
-                match_list.append(match)
-        return match_list
+                match_channels.append((match, channel_id))
+        return match_channels
             
     def update_match(self, match):
         params = (match.timestamp, match.flags, self._get_racer_id(match.racer_1), self._get_racer_id(match.racer_2), match.week,)
         self._db_conn.execute("UPDATE match_data SET timestamp=?,flags=? WHERE racer_1_id=? AND racer_2_id=? AND week_number=?", params)       
         self._db_conn.commit()
 
-    def get_upcoming_matches(self, time):
+    # Returns the confirmed, unplayed matches scheduled later than 30 minutes before the given time, soonest first
+    # (at most limit of them, if limit is given)
+    def get_upcoming_matches(self, time, limit=None):
+        confirmed_mask = CondorMatch.FLAG_CONFIRMED_BY_R1 | CondorMatch.FLAG_CONFIRMED_BY_R2
+        earliest = ((time - datetime.timedelta(minutes=30)) - CondorMatch.OFFSET_DATETIME).total_seconds()
+        params = (confirmed_mask | CondorMatch.FLAG_PLAYED, confirmed_mask, earliest, limit if limit is not None else -1,)
         matches = []
-        for row in self._db_conn.execute("SELECT racer_1_id,racer_2_id,week_number,timestamp,flags,number_of_races FROM match_data ORDER BY timestamp ASC"):
-            racer_1 = self._get_racer_from_id(row[0])
-            racer_2 = self._get_racer_from_id(row[1])
-            week = int(row[2])
-            match = CondorMatch(racer_1, racer_2, week)
-            match.flags = int(row[4])
-            match.set_number_of_races(int(row[5]))
-            if match.confirmed and not match.played:
-                match.set_from_timestamp(int(row[3]))
-                if match.time - time > datetime.timedelta(minutes=-30):
-                    matches.append(match)
+        for row in self._db_conn.execute("""SELECT u1.discord_id,u1.discord_name,u1.twitch_name,u1.steam_id,u1.timezone,
+                                                u2.discord_id,u2.discord_name,u2.twitch_name,u2.steam_id,u2.timezone,
+                                                m.week_number,m.timestamp,m.flags,m.number_of_races
+                                         FROM match_data m
+                                         JOIN user_data u1 ON u1.racer_id=m.racer_1_id
+                                         JOIN user_data u2 ON u2.racer_id=m.racer_2_id
+                                         WHERE (m.flags & ?)=? AND m.timestamp>?
+                                         ORDER BY m.timestamp ASC
+                                         LIMIT ?""", params):
+            match = CondorMatch(CondorDB._get_racer_from_row(row[0:5]), CondorDB._get_racer_from_row(row[5:10]), int(row[10]))
+            match.flags = int(row[12])
+            match.set_number_of_races(int(row[13]))
+            match.set_from_timestamp(int(row[11]))
+            matches.append(match)
         return matches
 
+    # Returns the ids of the schedule messages posted in the channel, in page order
+    def get_schedule_message_ids(self, channel_id):
+        params = (int(channel_id),)
+        return [int(row[0]) for row in self._db_conn.execute("SELECT message_id FROM schedule_messages WHERE channel_id=? ORDER BY page ASC", params)]
+
+    def set_schedule_message_id(self, channel_id, page, message_id):
+        params = (int(channel_id), page, int(message_id),)
+        self._db_conn.execute("INSERT INTO schedule_messages (channel_id, page, message_id) VALUES (?,?,?)", params)
+        self._db_conn.commit()
+
+    # Forgets the schedule messages in the channel from the given page on
+    def delete_schedule_messages(self, channel_id, from_page=0):
+        params = (int(channel_id), from_page,)
+        self._db_conn.execute("DELETE FROM schedule_messages WHERE channel_id=? AND page>=?", params)
+        self._db_conn.commit()
+
     def get_cawmentator(self, match):
         params = (self._get_racer_id(match.racer_1), self._get_racer_id(match.racer_2), match.week,)
         for row in self._db_conn.execute("SELECT cawmentator_id FROM match_data WHERE racer_1_id=? AND racer_2_id=? AND week_number=?", params):
@@ -263,7 +309,7 @@ class CondorDB(object):
             self._db_conn.execute("UPDATE match_data SET cawmentator_id=? WHERE racer_1_id=? AND racer_2_id=? AND week_number=?", params)
             self._db_conn.commit()
         else:
-            print('Error: tried to add cawmentary to an unscheduled match.')
+            logger.error('Error: tried to add cawmentary to an unscheduled match.', extra=botlog.context(match=match))
 
     def remove_cawmentary(self, match):
         params = (self._get_racer_id(match.racer_1), self._get_racer_id(match.racer_2), match.week,)
@@ -306,7 +352,8 @@ class CondorDB(object):
                     if not (int(row[0]) & CondorDB.RACE_CANCELLED_FLAG):
                         num_wins += 0.5
         else:
-            print('Error: called CondorDB.number_of_wins on a racer not in a match (racer {0}, match {1} v {2}).'.format(racer.twitch_name, match.racer_1.twitch_name, match.racer_2.twitch_name))
+            logger.error('Error: called CondorDB.number_of_wins on a racer not in a match (racer %s, match %s v %s).', racer.twitch_name, match.racer_1.twitch_name, match.racer_2.twitch_name,
+                         extra=botlog.context(match=match))
 
         return num_wins
 
@@ -363,7 +410,8 @@ class CondorDB(object):
                 draws = int(row[2])
                 return [r1wins, r2wins, draws]
             except ValueError:
-                print('Error parsing an argument in CondorDB.get_score with racer_1_id = <{0}>, racer_2_id = <{1}>, week_number = <{2}>.'.format(self._get_racer_id(match.racer_1), self._get_racer_id(match.racer_2), match.week))
+                logger.error('Error parsing an argument in CondorDB.get_score with racer_1_id = <%s>, racer_2_id = <%s>, week_number = <%s>.', self._get_racer_id(match.racer_1), self._get_racer_id(match.racer_2), match.week,
+                             extra=botlog.context(match=match))
                 return
                 
     def record_race(self, match, racer_1_time, racer_2_time, winner, seed, timestamp, cancelled, force_recorded=False):
@@ -442,7 +490,7 @@ class CondorDB(object):
             found = True
             contested = int(row[0])
         if not found:
-            print('Couldn\'t set a race contested, because I couldn\'t find it. Racers: {0} v {1}.'.format(match.racer_1.twitch_name, match.racer_2.twitch_name))
+            logger.warning('Couldn\'t set a race contested, because I couldn\'t find it. Racers: %s v %s.', match.racer_1.twitch_name, match.racer_2.twitch_name, extra=botlog.context(match=match))
             return
         
         if int(contesting_user.id) == int(match.racer_1.discord_id):
@@ -459,3 +507,6 @@ class CondorDB(object):
                   race_number,)
         self._db_conn.execute("UPDATE race_data SET contested=? WHERE racer_1_id=? AND racer_2_id=? AND week_number=? AND race_number=?", params)
         self._db_conn.commit()
+
+# Time (and count) every public method call
+metrics.time_methods(CondorDB, metrics.histogram('condorbot_db_call_seconds', 'Time taken by CondorDB calls, by method.', ['method']))
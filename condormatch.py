@@ -3,15 +3,47 @@ import pytz
 import re
 
 import condortimestr
+import condortz
 import config
 
+_gsheet_regexes = {}                #lowercased twitch name -> compiled regex matching a gsheet cell holding that name
+
+# Returns the (cached) compiled regex matching a gsheet cell containing exactly the given twitch name
+def gsheet_regex_for(twitch_name):
+    key = twitch_name.lower()
+    regex = _gsheet_regexes.get(key)
+    if regex is None:
+        regex = re.compile( r'(?i)^\s*' + re.escape(key) + r'\s*$' )
+        _gsheet_regexes[key] = regex
+    return regex
+
 class CondorRacer(object):
+    __slots__ = ('discord_id', 'discord_name', 'twitch_name', 'steam_id', '_timezone', '_tzinfo')
+
     def __init__(self, twitch_name):
         self.discord_id = None
         self.discord_name = None
         self.twitch_name = twitch_name
         self.steam_id = None
-        self.timezone = None
+        self._timezone = None
+        self._tzinfo = None             #resolved from _timezone the first time it's needed
+
+    @property
+    def timezone(self):
+        return self._timezone
+
+    @timezone.setter
+    def timezone(self, value):
+        if value != self._timezone:
+            self._timezone = value
+            self._tzinfo = None
+
+    # The pytz tzinfo for this racer's timezone, or None if they don't have a valid one
+    @property
+    def tzinfo(self):
+        if self._tzinfo is None and self._timezone:
+            self._tzinfo = condortz.get_timezone(self._timezone)
+        return self._tzinfo
 
     def __eq__(self, other):
         return self.twitch_name.lower() == other.twitch_name.lower()
@@ -22,7 +54,7 @@ class CondorRacer(object):
 
     @property
     def gsheet_regex(self):
-        return re.compile( r'(?i)^\s*' + re.escape(self.twitch_name) + r'\s*$' )
+        return gsheet_regex_for(self.twitch_name)
 
     @property
     def escaped_twitch_name(self):
@@ -32,19 +64,19 @@ class CondorRacer(object):
         return escaped_name
 
     def utc_to_local(self, utc_dt):
-        if not self.timezone in pytz.all_timezones:
+        local_tz = self.tzinfo
+        if local_tz is None:
             return None
-        local_tz = pytz.timezone(self.timezone)
 
         if utc_dt.tzinfo is not None and utc_dt.tzinfo.utcoffset(utc_dt) is not None:
             return local_tz.normalize(utc_dt.astimezone(local_tz))
         else:
-            return local_tz.normalize(pytz.utc.localize(utc_td))
+            return local_tz.normalize(pytz.utc.localize(utc_dt))
 
     def local_to_utc(self, local_dt):
-        if not self.timezone in pytz.all_timezones:
+        local_tz = self.tzinfo
+        if local_tz is None:
             return None
-        local_tz = pytz.timezone(self.timezone)
 
         if local_dt.tzinfo is not None and local_dt.tzinfo.utcoffset(local_dt) is not None:
             return pytz.utc.normalize(local_dt.astimezone(pytz.utc))
@@ -52,6 +84,8 @@ class CondorRacer(object):
             return pytz.utc.normalize(local_tz.localize(local_dt))
 
 class CondorMatch(object):
+    __slots__ = ('_racer_1', '_racer_2', '_week', '_time', '_number_of_races', 'flags')
+
     OFFSET_DATETIME = datetime.datetime(year=2016,month=1,day=1,tzinfo=pytz.utc)
     
     FLAG_SCHEDULED = int(1) << 0
@@ -65,9 +99,20 @@ class CondorMatch(object):
     FLAG_UNCONFIRMED_BY_R2 = int(1) << 8
     FLAG_BEST_OF = int(1) << 9
 
+    FULL_FLAG = (int(1) << 10) - 1
+
+    # masks that clear the given flags (use with &)
+    MASK_NOT_BEST_OF = FULL_FLAG ^ FLAG_BEST_OF
+    MASK_NOT_SCHEDULED_BY_R1 = FULL_FLAG ^ FLAG_SCHEDULED_BY_R1
+    MASK_NOT_SCHEDULED_BY_R2 = FULL_FLAG ^ FLAG_SCHEDULED_BY_R2
+    MASK_NOT_CONFIRMED = FULL_FLAG ^ (FLAG_CONFIRMED_BY_R1 | FLAG_CONFIRMED_BY_R2)
+    MASK_NOT_CONFIRMED_BY_R1 = FULL_FLAG ^ FLAG_CONFIRMED_BY_R1
+    MASK_NOT_CONFIRMED_BY_R2 = FULL_FLAG ^ FLAG_CONFIRMED_BY_R2
+    MASK_NOT_UNCONFIRMED_BY_R1 = FULL_FLAG ^ FLAG_UNCONFIRMED_BY_R1
+    MASK_NOT_UNCONFIRMED_BY_R2 = FULL_FLAG ^ FLAG_UNCONFIRMED_BY_R2
+
     def notflag(flag):
-        FULL_FLAG = (int(1) << 10) - 1
-        return FULL_FLAG - flag
+        return CondorMatch.FULL_FLAG ^ flag
 
     def __init__(self, racer_1, racer_2, week):
         self._racer_1 = racer_1
@@ -130,7 +175,7 @@ class CondorMatch(object):
         self._number_of_races = out_of_n
 
     def set_repeat(self, number_of_races):
-        self.flags = self.flags & CondorMatch.notflag(CondorMatch.FLAG_BEST_OF)
+        self.flags = self.flags & CondorMatch.MASK_NOT_BEST_OF
         self._number_of_races = number_of_races
 
     def set_number_of_races(self, number_of_races):
@@ -233,22 +278,22 @@ class CondorMatch(object):
     def schedule(self, time, racer, unconfirm=True):
         self.flags = self.flags | CondorMatch.FLAG_SCHEDULED
         if racer and racer.twitch_name == self.racer_1.twitch_name:
-            self.flags = (self.flags | CondorMatch.FLAG_SCHEDULED_BY_R1) & (CondorMatch.notflag(CondorMatch.FLAG_SCHEDULED_BY_R2)) 
+            self.flags = (self.flags | CondorMatch.FLAG_SCHEDULED_BY_R1) & CondorMatch.MASK_NOT_SCHEDULED_BY_R2
         elif racer and racer.twitch_name == self.racer_2.twitch_name:
-            self.flags = (self.flags | CondorMatch.FLAG_SCHEDULED_BY_R2) & (CondorMatch.notflag(CondorMatch.FLAG_SCHEDULED_BY_R1)) 
+            self.flags = (self.flags | CondorMatch.FLAG_SCHEDULED_BY_R2) & CondorMatch.MASK_NOT_SCHEDULED_BY_R1
 
         if time.tzinfo is not None and time.tzinfo.utcoffset(time) is not None:
             self._time = time.astimezone(pytz.utc)
         else:
             self._time = pytz.utc.localize(time)
 
-        self.flags = self.flags & CondorMatch.notflag(CondorMatch.FLAG_CONFIRMED_BY_R1) & CondorMatch.notflag(CondorMatch.FLAG_CONFIRMED_BY_R2)
+        self.flags = self.flags & CondorMatch.MASK_NOT_CONFIRMED
 
     def confirm(self, racer):
         if racer.twitch_name == self.racer_1.twitch_name:
-            self.flags = (self.flags | CondorMatch.FLAG_CONFIRMED_BY_R1) & CondorMatch.notflag(CondorMatch.FLAG_UNCONFIRMED_BY_R1)
+            self.flags = (self.flags | CondorMatch.FLAG_CONFIRMED_BY_R1) & CondorMatch.MASK_NOT_UNCONFIRMED_BY_R1
         elif racer.twitch_name == self.racer_2.twitch_name:
-            self.flags = (self.flags | CondorMatch.FLAG_CONFIRMED_BY_R2) & CondorMatch.notflag(CondorMatch.FLAG_UNCONFIRMED_BY_R2)        
+            self.flags = (self.flags | CondorMatch.FLAG_CONFIRMED_BY_R2) & CondorMatch.MASK_NOT_UNCONFIRMED_BY_R2        
 
     def unconfirm(self, racer):
         if self.played:
@@ -257,11 +302,11 @@ class CondorMatch(object):
         if racer.twitch_name == self.racer_1.twitch_name:
             self.flags = self.flags | CondorMatch.FLAG_UNCONFIRMED_BY_R1
             if not self.confirmed:
-                self.flags = self.flags & CondorMatch.notflag(CondorMatch.FLAG_CONFIRMED_BY_R1)
+                self.flags = self.flags & CondorMatch.MASK_NOT_CONFIRMED_BY_R1
         elif racer.twitch_name == self.racer_2.twitch_name:
             self.flags = self.flags | CondorMatch.FLAG_UNCONFIRMED_BY_R2
             if not self.confirmed:
-                self.flags = self.flags & CondorMatch.notflag(CondorMatch.FLAG_CONFIRMED_BY_R2)
+                self.flags = self.flags & CondorMatch.MASK_NOT_CONFIRMED_BY_R2
                 
         if self.flags & CondorMatch.FLAG_UNCONFIRMED_BY_R1 and self.flags & CondorMatch.FLAG_UNCONFIRMED_BY_R2:
             self.flags = 0
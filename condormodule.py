@@ -1,22 +1,44 @@
 import asyncio
-import codecs
 import datetime
 import discord
+import functools
+import logging
+import time
 
 import calendar
 from pytz import timezone
 import pytz
 
+import botlog
 import clparse
 import command
 import condortimestr
+import condortz
 import config
+import metrics
+import outbound
 
+from archiver import Archiver
 from condordb import CondorDB
 from condormatch import CondorMatch
 from condormatch import CondorRacer
+import condorraceroom
 from condorraceroom import RaceRoom
 from condorsheet import CondorSheet
+from racejournal import RaceJournal
+from roomregistry import RoomRegistry
+from scheduleboard import ScheduleBoard
+
+logger = logging.getLogger(__name__)
+
+JOB_MATCH_ALERT = 'match_alert'                 #scheduler job that opens a match's race room shortly before the match
+SCHEDULE_FRESH_SEC = 15*60                      #on a restart, the schedule channel isn't refreshed if it was this recently
+ROOM_IDLE_SEC = 60*60                           #a race room whose match is over is closed after this long without commands
+ROOM_SWEEP_SEC = 10*60                          #how often to look for race rooms to close
+REMIND_MAX_CONCURRENT = 10                      #reminders .remind sends at once
+REMIND_MAX_LISTED = 20                          #failed reminders named in .remind's report (to keep it to one message)
+
+REMINDERS = metrics.counter('condorbot_reminders_total', 'Schedule reminders, by whether they were sent or failed.', ['result'])
 
 def _escaped(discord_str):
     escaped_str = discord_str
@@ -103,7 +125,7 @@ class Cawmentate(command.CommandType):
     @asyncio.coroutine
     def _do_execute(self, command):
         if len(command.args) != 2:
-            print('Error in cawmentate: wrong command arg length.')
+            logger.warning('Error in cawmentate: wrong command arg length.', extra=botlog.context(channel=command.channel, command=command))
         else:
             #find the match
             racer_1 = self._cm.condordb.get_from_twitch_name(command.args[0])
@@ -208,7 +230,7 @@ class MakeWeek(command.CommandType):
     @asyncio.coroutine
     def _do_execute(self, command):
         if len(command.args) != 1:
-            print('Error in makeweek: wrong command arg length.')
+            logger.warning('Error in makeweek: wrong command arg length.', extra=botlog.context(channel=command.channel, command=command))
         else:
             week = -1
             try:
@@ -225,9 +247,7 @@ class MakeWeek(command.CommandType):
                     if matches:
                         matches = sorted(matches, key=lambda m: m.channel_name)
                         for match in matches:
-                            success = yield from self._cm.make_match_channel(match)
-                            if success:
-                                yield from asyncio.sleep(0.5)
+                            yield from self._cm.make_match_channel(match)
                     yield from self._cm.necrobot.client.send_message(command.channel, 'All matches made.')
                 except Exception as e:
                     yield from self._cm.necrobot.client.send_message(command.channel, 'An error occurred. Please call `.makeweek` again.')
@@ -245,7 +265,7 @@ class CloseWeek(command.CommandType):
     @asyncio.coroutine
     def _do_execute(self, command):
         if len(command.args) != 1:
-            print('Error in closeweek: wrong command arg length.')
+            logger.warning('Error in closeweek: wrong command arg length.', extra=botlog.context(channel=command.channel, command=command))
         else:
             week = -1
             try:
@@ -258,18 +278,50 @@ class CloseWeek(command.CommandType):
             if week != -1:
                 yield from self._cm.necrobot.client.send_message(command.channel, 'Closing race rooms for week {0}...'.format(week))
                 try:
-                    channel_ids = self._cm.condordb.get_race_channels_from_week(week)
-                    if channel_ids:
-                        for channel_id in channel_ids:
-                            channel = self._cm.necrobot.find_channel_with_id(channel_id)
-                            if channel:
-                                yield from self._cm.save_and_delete(channel)
-                                yield from asyncio.sleep(0.5)
+                    channels = []
+                    for channel_id in self._cm.condordb.get_race_channels_from_week(week):
+                        channel = self._cm.necrobot.find_channel_with_id(channel_id)
+                        if channel:
+                            channels.append(channel)
+                    yield from self._cm.save_and_delete_all(channels, week)
                     yield from self._cm.necrobot.client.send_message(command.channel, 'All racerooms closed.')
                 except Exception as e:
                     yield from self._cm.necrobot.client.send_message(command.channel, 'An error occurred. Please call `.closeweek` again.')
                     raise e        
 
+class SearchLogs(command.CommandType):
+    MAX_HITS = 10
+    MAX_LENGTH = 1990                   #stay under discord's message length limit
+
+    def __init__(self, condor_module):
+        command.CommandType.__init__(self, 'searchlogs')
+        self.help_text = 'Search the logs of closed race rooms. Usage is `.searchlogs <words>`. Search one field with e.g. ' \
+                         '`author_name:incnone`, `channel_name:incnone` or `week_number:3`; use quotes for a phrase, and ' \
+                         '`AND`/`OR`/`NOT` to combine terms.'
+        self._cm = condor_module
+
+    def recognized_channel(self, channel):
+        return channel == self._cm.admin_channel
+
+    @asyncio.coroutine
+    def _do_execute(self, command):
+        if not command.args:
+            yield from self._cm.necrobot.client.send_message(command.channel, '{0}: Please give something to search for.'.format(command.author.mention))
+            return
+
+        hits = yield from self._cm.archiver.search(' '.join(command.args), SearchLogs.MAX_HITS)
+        if hits is None:
+            yield from self._cm.necrobot.client.send_message(command.channel, '{0}: Sorry, the archive can\'t be searched on this machine.'.format(command.author.mention))
+        elif not hits:
+            yield from self._cm.necrobot.client.send_message(command.channel, '{0}: No messages found.'.format(command.author.mention))
+        else:
+            hit_lines = []
+            for hit in hits:
+                week_str = ' (week {0})'.format(hit.week) if hit.week is not None else ''
+                time_str = datetime.datetime.utcfromtimestamp(hit.timestamp).strftime("%Y/%m/%d %H:%M:%S")
+                hit_lines.append('`{0}`{1}, {2}, {3}: {4}'.format(hit.channel_name, week_str, time_str, _escaped(hit.author_name), hit.snippet.replace('\n', ' ')))
+            yield from self._cm.necrobot.client.send_message(command.channel, '\n'.join(hit_lines)[:SearchLogs.MAX_LENGTH])
+
 class Staff(command.CommandType):
     def __init__(self, condor_module):
         command.CommandType.__init__(self, 'staff')
@@ -429,9 +481,8 @@ class Suggest(command.CommandType):
             for racer in racers:
                 member = self._cm.necrobot.find_member_with_id(racer.discord_id)
                 if member:
-                    if racer.timezone:
-                        r_tz = pytz.timezone(racer.timezone)
-                        r_dt = r_tz.normalize(utc_dt.astimezone(pytz.utc))
+                    r_dt = racer.utc_to_local(utc_dt)
+                    if r_dt:
                         yield from self._cm.necrobot.client.send_message(command.channel,
                             '{0}: This match is suggested to be scheduled for {1}. Please confirm with `.confirm`.'.format(member.mention, condortimestr.get_time_str(r_dt)))
                     else:
@@ -457,7 +508,7 @@ class Timezone(command.CommandType):
             yield from self._cm.necrobot.client.send_message(command.channel, '{0}: I was unable to parse your timezone because you gave too many arguments. See {1} for a list of timezones.'.format(command.author.mention, self.timezone_loc))
         else:
             tz_name = command.args[0]
-            if tz_name in pytz.all_timezones:
+            if condortz.is_timezone(tz_name):
                 self._cm.condordb.register_timezone(command.author.id, tz_name)
                 yield from self._cm.necrobot.client.send_message(command.channel, '{0}: Timezone set as {1}.'.format(command.author.mention, tz_name))
             else:
@@ -629,9 +680,15 @@ class Remind(command.CommandType):
         if self._cm.necrobot.is_admin(command.author):
             if command.channel == self._cm.admin_channel:
                 text = command.content if command.content else None
-                yield from self._cm.remind_all(text, lambda m: not m.confirmed)
-                yield from self._cm.necrobot.client.send_message(command.channel,
-                    'Reminders sent.')
+                start = time.perf_counter()
+                failures, num_sent = yield from self._cm.remind_all(text, lambda m: not m.confirmed)
+                report = 'Reminders sent to {0} matches in {1:.1f}s.'.format(num_sent, time.perf_counter() - start)
+                if failures:
+                    report += ' Couldn\'t remind {0}: {1}'.format(len(failures),
+                        ', '.join('`{0}` ({1})'.format(match.channel_name, reason) for match, reason in failures[:REMIND_MAX_LISTED]))
+                    report += ', and {0} more.'.format(len(failures) - REMIND_MAX_LISTED) if len(failures) > REMIND_MAX_LISTED else '.'
+                logger.info('%s', report, extra=botlog.context(command=command, sent=num_sent, failed=len(failures)))
+                yield from self._cm.necrobot.client.send_message(command.channel, report)
                                                                        
 class ForceBeginMatch(command.CommandType):
     def __init__(self, condor_module):
@@ -786,9 +843,8 @@ class ForceRescheduleUTC(command.CommandType):
                 for racer in racers:
                     member = self._cm.necrobot.find_member_with_id(racer.discord_id)
                     if member:
-                        if racer.timezone:
-                            r_tz = pytz.timezone(racer.timezone)
-                            r_dt = r_tz.normalize(utc_dt.astimezone(pytz.utc))
+                        r_dt = racer.utc_to_local(utc_dt)
+                        if r_dt:
                             yield from self._cm.necrobot.client.send_message(command.channel,
                                 '{0}: This match is suggested to be scheduled for {1}. Please confirm with `.confirm`.'.format(member.mention, condortimestr.get_time_str(r_dt)))
                         else:
@@ -902,12 +958,24 @@ class ForceTransferAccount(command.CommandType):
             yield from self._cm.client.send_message(command.channel, '{0}: Transfered racer account {1} to member {2}.'.format(command.author.mention, from_racer.escaped_twitch_name, to_member.mention))
 
 class CondorModule(command.Module):
-    def __init__(self, necrobot, db_connection):
+    # condorsheet replaces the GSheet connection, if given (e.g. by loadtest.py, which has no GSheet)
+    def __init__(self, necrobot, db_connection, condorsheet=None):
         command.Module.__init__(self, necrobot)
         self.condordb = CondorDB(db_connection)
-        self.condorsheet = CondorSheet(self.condordb)
-        self._racerooms = []
-        self._alerted_channels = []
+        self.condorsheet = condorsheet if condorsheet else CondorSheet(self.condordb)
+        self.race_journal = RaceJournal(db_connection)
+        self._racerooms = RoomRegistry(ROOM_IDLE_SEC)
+        self._schedule_updated_at = None            #time.time() of the last refresh of the schedule channel
+        metrics.gauge('condorbot_race_rooms', 'Race rooms open.', fn=lambda: len(self._racerooms))
+        metrics.gauge('condorbot_race_room_tasks', 'Topic updates and race timers pending in the open race rooms.', fn=lambda: self._racerooms.num_tasks)
+        self._schedule_board = ScheduleBoard(necrobot, self.condordb, config.SCHEDULE_MAX_MATCHES)
+        self.archiver = Archiver(necrobot.client, config.ARCHIVE_DB_FILENAME)
+
+        self.necrobot.scheduler.register(JOB_MATCH_ALERT, self._on_match_alert)
+        for job_type in condorraceroom.JOB_TYPES:
+            self.necrobot.scheduler.register(job_type, functools.partial(self._on_room_job, job_type),
+                                             persistent=(job_type != condorraceroom.JOB_TOPIC_REFRESH),
+                                             keep_until_complete=(job_type == condorraceroom.JOB_MATCH_START))
 
         self.command_types = [command.DefaultHelp(self),
                               Cawmentate(self),
@@ -923,6 +991,7 @@ class CondorModule(command.Module):
                               UserInfo(self),
                               #CloseAllRaceChannels(self),
                               Remind(self),
+                              SearchLogs(self),
                               ForceBeginMatch(self),
                               ForceConfirm(self),
                               ForceReboot(self),
@@ -934,9 +1003,105 @@ class CondorModule(command.Module):
 
     @asyncio.coroutine
     def initialize(self):
-        yield from self.run_channel_alerts()
-        yield from self.update_schedule_channel()
+        yield from self.restore_races()
+        warm_snapshot = self.necrobot.warm_snapshot_for(self)
+        if warm_snapshot:
+            self.reopen_race_rooms(warm_snapshot.get('race_rooms', []))
+        # the rest isn't needed to take commands, so the bot is ready without waiting for it
+        self.necrobot.supervisor.spawn(self._initialize_in_background(warm_snapshot), name='CondorModule startup')
+
+    # Opens the GSheet, and rebuilds the alerts and the schedule channel; then prints the startup report
+    # If we were restarted recently (warm_snapshot is what the last run saved), the schedule channel is only
+    # refreshed if it's out of date, and the race rooms are checked against the server instead
+    @asyncio.coroutine
+    def _initialize_in_background(self, warm_snapshot=None):
+        startup = self.necrobot.startup
+        sheet_opened = asyncio.ensure_future(startup.time('sheet', self.condorsheet.open()))
+        # alerts are saved with the scheduler's jobs, so they only need to be rebuilt if there weren't any saved yet
+        if self.necrobot.scheduler.job_store_is_new:
+            yield from startup.time('alerts', self.run_channel_alerts())
+        if warm_snapshot:
+            self._schedule_updated_at = warm_snapshot.get('schedule_updated_at')
+            yield from startup.time('reconcile', self.reconcile())
+        if not self._schedule_updated_at or time.time() - self._schedule_updated_at > SCHEDULE_FRESH_SEC:
+            yield from startup.time('schedule channel', self.update_schedule_channel())
         asyncio.ensure_future(self.schedule_channel_auto_updater())
+        asyncio.ensure_future(self.race_room_sweeper())
+
+        try:
+            yield from sheet_opened
+        except Exception as e:
+            logger.error('Error: couldn\'t open the GSheet (%r); will try again when it\'s next needed.', e)
+        logger.info(startup.report_str)
+
+    # The server's channel objects are new after a reconnect: point the race rooms at them, and drop the rooms whose
+    # channel is gone. Then bring the schedule channel up to date, in case we missed anything while disconnected.
+    # Overrides
+    @asyncio.coroutine
+    def on_reconnect(self):
+        for room in list(self._racerooms):
+            channel = self.necrobot.find_channel_with_id(room.channel.id)
+            if channel:
+                room.channel = channel
+            else:
+                self.close_race_room(room.channel.id)
+        self.necrobot.supervisor.spawn(self.update_schedule_channel(), name='CondorModule reconnect')
+
+    # Overrides
+    def snapshot(self):
+        return {'race_rooms': self._racerooms.channel_ids,
+                'schedule_updated_at': self._schedule_updated_at}
+
+    # Reopen the race rooms for the given channels (e.g. the rooms that were open when the bot was restarted), so
+    # that they take commands straight away instead of when their next job fires
+    def reopen_race_rooms(self, channel_ids):
+        for channel_id in channel_ids:
+            match = self.condordb.get_match_from_channel_id(channel_id)
+            if match and match.confirmed and self.necrobot.find_channel_with_id(channel_id):
+                self.necrobot.supervisor.spawn(self.make_race_room(match, resuming=True), name='reopen race room ({0})'.format(channel_id))
+
+    # Check what we picked up from the warm-start snapshot against the server and the database: drop the rooms
+    # whose channel or match is gone, and rebuild the alerts if the race channels have none
+    @asyncio.coroutine
+    def reconcile(self):
+        for room in list(self._racerooms):
+            match = self.condordb.get_match_from_channel_id(room.channel.id)
+            if not match or not match.confirmed or not self.necrobot.find_channel_with_id(room.channel.id):
+                self.close_race_room(room.channel.id)
+
+        if not self.necrobot.scheduler.num_jobs and self.condordb.get_all_race_channel_ids():
+            yield from self.run_channel_alerts()
+        self.necrobot.save_snapshot()
+
+    # Close the channel's race room, if it has one, and cancel the channel's scheduled jobs
+    def close_race_room(self, channel_id):
+        self._racerooms.remove(channel_id)
+        self.necrobot.scheduler.cancel_channel(channel_id)
+        self.necrobot.save_snapshot()
+
+    # Called by a race room once its match has been recorded: nothing more is scheduled for it, and the room is
+    # closed once it's been idle for a while (see race_room_sweeper)
+    def on_match_recorded(self, room):
+        self.necrobot.scheduler.cancel_channel(room.channel.id)
+        self._racerooms.touch(room.channel.id)
+
+    # Every so often, close the race rooms whose match is over and that haven't been used for a while, and those
+    # whose channel has gone
+    @asyncio.coroutine
+    def race_room_sweeper(self):
+        while True:
+            yield from asyncio.sleep(ROOM_SWEEP_SEC)
+            for channel_id in self._racerooms.idle_channel_ids():
+                self.close_race_room(channel_id)
+            for channel_id in self._racerooms.channel_ids:
+                if not self.necrobot.find_channel_with_id(channel_id):
+                    self.close_race_room(channel_id)
+
+    # Overrides
+    @asyncio.coroutine
+    def on_channel_delete(self, channel):
+        if channel.id in self._racerooms:
+            self.close_race_room(channel.id)
 
     @property
     def infostr(self):
@@ -956,9 +1121,10 @@ class CondorModule(command.Module):
     def execute(self, command):
         for cmd_type in self.command_types:
             yield from cmd_type.execute(command)
-        for room in self._racerooms:
-            if command.channel == room.channel:
-                yield from room.execute(command)
+        room = self._racerooms.get(command.channel.id)
+        if room:
+            self._racerooms.touch(command.channel.id)
+            yield from room.execute(command)
 
     def get_match_channel_name(self, match):
         return match.channel_name
@@ -988,14 +1154,12 @@ class CondorModule(command.Module):
                 
         # if there was no open channel, make one
 ##        if not open_match_info:
-        print('Making channel on {0} with name {1}'.format(str(self.necrobot.server), self.get_match_channel_name(match)))
+        logger.info('Making channel on %s with name %s', self.necrobot.server, self.get_match_channel_name(match), extra=botlog.context(match=match))
         channel = yield from self.client.create_channel(self.necrobot.server, self.get_match_channel_name(match))
-        channel_id = channel.id
 
         read_permit = discord.Permissions.none()
         read_permit.read_messages = True
         yield from self.client.edit_channel_permissions(channel, self.necrobot.server.default_role, deny=read_permit)
-        asyncio.ensure_future(self.channel_alert(channel_id))
             
 ##        # otherwise, change the name of the channel we got, and remove permissions from it
 ##        else:
@@ -1035,46 +1199,67 @@ class CondorModule(command.Module):
         return True
 
     @asyncio.coroutine
-    def save_and_delete(self, channel):
-        logs = yield from self.client.logs_from(channel, 5000)
-        messages = []
-        for message in logs:
-            messages.insert(0, message)
-
-        outfile = codecs.open('logs/{0}.log'.format(channel.name), 'w', 'utf-8')
-        for message in messages:
-            try:
-                outfile.write('{1} ({0}): {2}\n'.format(message.timestamp.strftime("%m/%d %H:%M:%S"), message.author.name, message.clean_content))
-            except UnicodeEncodeError:
-                try:
-                    outfile.write('{1} ({0}): {2}\n'.format(message.timestamp.strftime("%m/%d %H:%M:%S"), message.author.name, message.content))
-                except UnicodeEncodeError:
-                    pass
-
-        outfile.close()          
-
+    def save_and_delete(self, channel, week=None):
+        yield from self.archiver.archive_channel(channel, week)
         self.condordb.delete_channel(channel.id)
+        self.close_race_room(channel.id)
+        self.race_journal.prune(channel.id)
         yield from self.client.delete_channel(channel)
-            
+
+    # Archives and deletes the channels, several at a time. Channels that fail to archive are kept (and the first
+    # such error is raised once the rest are done).
+    @asyncio.coroutine
+    def save_and_delete_all(self, channels, week=None):
+        results = yield from self.archiver.archive_channels(channels, week, config.ARCHIVE_MAX_CONCURRENT)
+        error = None
+        for channel, result in zip(channels, results):
+            if isinstance(result, Exception):
+                error = error if error else result
+                continue
+            self.condordb.delete_channel(channel.id)
+            self.close_race_room(channel.id)
+            self.race_journal.prune(channel.id)
+            yield from self.client.delete_channel(channel)
+        if error:
+            raise error
+
     # makes a new "race room" in the match channel if not already made
+    # if resuming is True, the room is being reopened after a restart, and is initialized before this returns
+    # returns the room, or None if the match has no channel
     @asyncio.coroutine
-    def make_race_room(self, match):
+    def make_race_room(self, match, resuming=False):
         channel = self.necrobot.find_channel_with_id(self.condordb.find_match_channel_id(match))
         if channel:
-            #if we already have a room for this channel, return
-            for room in self._racerooms:
-                if int(room.channel.id) == int(channel.id):
-                    return  
+            #if we already have a room for this channel, return it
+            room = self._racerooms.get(channel.id)
+            if room:
+                return room
             room = RaceRoom(self, match, channel)
-            self._racerooms.append(room)
-            asyncio.ensure_future(room.initialize())
+            self._racerooms.add(room)
+            self.necrobot.save_snapshot()
+            if resuming:
+                yield from room.initialize(resuming=True)
+            else:
+                self.necrobot.supervisor.spawn(room.initialize(), name='room.initialize')
+            return room
+
+    # Reopen the rooms that had a race going when the bot went down (see racejournal.py)
+    @asyncio.coroutine
+    def restore_races(self):
+        for channel_id in self.race_journal.open_channel_ids():
+            match = self.condordb.get_match_from_channel_id(channel_id)
+            if match and match.confirmed and self.necrobot.find_channel_with_id(channel_id):
+                self.necrobot.supervisor.spawn(self.make_race_room(match, resuming=True), name='restore race ({0})'.format(channel_id))
+            else:
+                self.race_journal.prune(channel_id)
 
+    # Replace the channel's race room with a new one, which picks the race back up from the room's journal
     @asyncio.coroutine
     def reboot_race_room(self, match):
         channel = self.necrobot.find_channel_with_id(self.condordb.find_match_channel_id(match))
         if channel:
-            self._racerooms = [room for room in self._racerooms if int(room.channel.id) != int(channel.id)]
-            self.make_race_room(match)
+            self._racerooms.remove(channel.id)
+            yield from self.make_race_room(match, resuming=True)
 
     @asyncio.coroutine
     def update_match_channel(self, match):
@@ -1083,35 +1268,46 @@ class CondorModule(command.Module):
         else:
             channel = self.necrobot.find_channel_with_id(self.condordb.find_match_channel_id(match))
             if channel:
-                #if we have a RaceRoom attached to this channel, remove it
-                delete_raceroom_id = None
-                for room in self._racerooms:
-                    if int(room.channel.id) == int(channel.id):
-                        delete_raceroom_id = int(channel.id)
-                if delete_raceroom_id:
-                    self._racerooms = [r for r in self._racerooms if not (int(r.channel.id) == delete_raceroom_id)]
-
-                asyncio.ensure_future(self.channel_alert(channel.id))
+                #if we have a RaceRoom attached to this channel, remove it (along with its scheduled jobs)
+                if channel.id in self._racerooms:
+                    self.close_race_room(channel.id)
+
+                self.schedule_alert(channel.id, match)
                 yield from self.necrobot.client.edit_channel(channel, topic=match.topic_str)
 
-    @asyncio.coroutine
-    def channel_alert(self, channel_id):
-        if channel_id in self._alerted_channels:
-            return
-        self._alerted_channels.append(channel_id)
+    # Schedules (or reschedules, or cancels) the pre-match alert for the match in the given channel
+    def schedule_alert(self, channel_id, match):
+        if match and match.confirmed:
+            self.necrobot.scheduler.schedule(JOB_MATCH_ALERT, channel_id, match.time - datetime.timedelta(minutes=config.RACE_ALERT_AT_MINUTES))
+        else:
+            self.necrobot.scheduler.cancel(JOB_MATCH_ALERT, channel_id)
 
+    @asyncio.coroutine
+    def _on_match_alert(self, channel_id):
         match = self.condordb.get_match_from_channel_id(channel_id)
         if match and match.confirmed:
-            if match.time_until_alert.total_seconds() > 0:
-                yield from asyncio.sleep(match.time_until_alert.total_seconds())
-            yield from self.update_match_channel(self.condordb.get_match_from_channel_id(channel_id))
+            yield from self.update_match_channel(match)
+
+    @asyncio.coroutine
+    def _on_room_job(self, job_type, channel_id):
+        room = self._racerooms.get(channel_id)
+        if room:
+            yield from room.on_scheduled_job(job_type)
+            return
 
-        self._alerted_channels = [c for c in self._alerted_channels if c != channel_id]
+        # no room: we were restarted while this channel had one open, so reopen it and pick the match back up
+        match = self.condordb.get_match_from_channel_id(channel_id)
+        if not match or not match.confirmed:
+            self.necrobot.scheduler.cancel_channel(channel_id)
+            return
+        room = yield from self.make_race_room(match, resuming=True)
+        if room:
+            yield from room.on_scheduled_job(job_type)
 
     @asyncio.coroutine
     def run_channel_alerts(self):
         for channel_id in self.condordb.get_all_race_channel_ids():
-            asyncio.ensure_future(self.channel_alert(channel_id))
+            self.schedule_alert(channel_id, self.condordb.get_match_from_channel_id(channel_id))
 
     @asyncio.coroutine
     def send_channel_start_text(self, channel, match):
@@ -1123,9 +1319,9 @@ class CondorModule(command.Module):
             '\N{BULLET} You may alert CoNDOR staff at any time by calling `.staff`. (Please do use this command if ' \
             'you\'re having problems -- it keeps us organized!)')
 
-        if match.racer_1 and match.racer_2 and match.racer_1.timezone and match.racer_2.timezone:
-            r1tz = pytz.timezone(match.racer_1.timezone)
-            r2tz = pytz.timezone(match.racer_2.timezone)
+        if match.racer_1 and match.racer_2 and match.racer_1.tzinfo and match.racer_2.tzinfo:
+            r1tz = match.racer_1.tzinfo
+            r2tz = match.racer_2.tzinfo
 
             utcnow = pytz.utc.localize(datetime.datetime.utcnow())
             r1off = utcnow.astimezone(r1tz).utcoffset()
@@ -1178,39 +1374,10 @@ class CondorModule(command.Module):
 
     @asyncio.coroutine
     def update_schedule_channel(self):
-        schedule_text = '``` \nUpcoming matches: \n'
-        utcnow = pytz.utc.localize(datetime.datetime.utcnow())
-        max_matches = 20
-        num_matches = 0
-
-        upcoming_matches = self.condordb.get_upcoming_matches(utcnow)
-        max_r1_len = 0
-        max_r2_len = 0
-        for match in upcoming_matches:
-            max_r1_len = max(max_r1_len, len(match.racer_1.twitch_name))
-            max_r2_len = max(max_r2_len, len(match.racer_2.twitch_name))
-
-        for match in self.condordb.get_upcoming_matches(utcnow):
-            num_matches += 1
-            schedule_text += '{r1:>{w1}} v {r2:<{w2}} : '.format(r1=match.racer_1.twitch_name, w1=max_r1_len, r2=match.racer_2.twitch_name, w2=max_r2_len)
-            if match.time - utcnow < datetime.timedelta(minutes=0):
-                schedule_text += 'Right now!'
-            else:
-                schedule_text += condortimestr.get_24h_time_str(match.time)
-            schedule_text += '\n'
-            if num_matches >= max_matches:
-                break
-            
-        schedule_text += '```'
+        yield from self._schedule_board.update()
+        self._schedule_updated_at = time.time()
+        self.necrobot.save_snapshot()
 
-        msgs = yield from self.necrobot.client.logs_from(self.necrobot.schedule_channel)
-        for msg in msgs:
-            if msg.author.name == 'condorbot' and msg.content.startswith('```'): #hack for now
-                yield from self.necrobot.client.edit_message(msg, schedule_text)
-                return
-
-        yield from self.necrobot.client.send_message(self.necrobot.schedule_channel, schedule_text)
-            
     @asyncio.coroutine
     def post_match_alert(self, match):
         cawmentator = yield from self.condorsheet.get_cawmentary(match)
@@ -1223,43 +1390,72 @@ class CondorModule(command.Module):
         #alert_text += 'Multitwitch: http://www.multitwitch.tv/{0}/{1} \n'.format(match.racer_1.twitch_name, match.racer_2.twitch_name)
         yield from self.necrobot.client.send_message(self.necrobot.main_channel, alert_text)
 
+    # Reminds the racers in every match satisfying condition (other than showcase matches) to schedule, sending at most
+    # REMIND_MAX_CONCURRENT reminders at a time (outbound keeps them to discord's rate limits, behind everything else).
+    # Returns a list of (match, reason) for the matches that couldn't be reminded, and the number that were.
     @asyncio.coroutine
     def remind_all(self, text=None, condition=lambda m: True):
-        match_list = self.condordb.get_all_matches()
-        for match in match_list:
-            showcase = yield from self.condorsheet.is_showcase_match(match)
-            if condition(match) and not showcase:
-                yield from self._remind_match(match, text)
-            
-    @asyncio.coroutine
-    def _remind_match(self, match, text=None):
-        channel_id = self.condordb.get_channel_id_from_match(match)
-        if not channel_id:
-            print('Error: match {0} not found in database.'.format(match.channel_name))
-            return            
-        else:
-            channel = self.necrobot.find_channel_with_id(channel_id)
-            if not channel:
-                print('Error: Channel not found for match {0}, which has a registered channel id.'.format(match.channel_name))
-                return
-            
-            mention_str = ''
-            for racer in match.racers:
-                racer_member = self.necrobot.find_member_with_id(racer.discord_id)
-                if racer_member:
-                    mention_str += racer_member.mention + ', '                      
-
-            if mention_str:
-                mention_str = mention_str[:-2]
+        weeks = {}
+        for match, channel_id in self.condordb.get_all_match_channels():
+            if condition(match):
+                weeks.setdefault(match.week, []).append((match, channel_id))
+
+        failures = []
+        to_remind = []
+        for week, week_matches in weeks.items():
+            try:
+                showcase_flags = yield from self.condorsheet.get_showcase_flags(week, [match for match, channel_id in week_matches])
+            except Exception:
+                logger.exception('Couldn\'t read showcase matches for week %s; not reminding its matches.', week)
+                failures.extend((match, 'couldn\'t read the GSheet') for match, channel_id in week_matches)
+                continue
+            to_remind.extend(match_channel for match_channel, showcase in zip(week_matches, showcase_flags) if not showcase)
+
+        members = self.necrobot.member_index()
+        semaphore = asyncio.Semaphore(REMIND_MAX_CONCURRENT)
+
+        @asyncio.coroutine
+        def remind_one(match, channel_id):
+            yield from semaphore.acquire()
+            try:
+                return (yield from self._remind_match(match, channel_id, members, text))
+            finally:
+                semaphore.release()
+
+        results = yield from asyncio.gather(*[remind_one(match, channel_id) for match, channel_id in to_remind], return_exceptions=True)
+        num_sent = 0
+        for (match, channel_id), result in zip(to_remind, results):
+            if isinstance(result, Exception):
+                logger.error('Error sending reminder for match %s.', match.channel_name, exc_info=result, extra=botlog.context(channel=channel_id, match=match))
+                failures.append((match, 'couldn\'t send the message'))
+            elif result:
+                failures.append((match, result))
             else:
-                print('Error: couldn\'t find discord user accounts for the racers in match {0}.'.format(match.channel_name))
-                return
+                num_sent += 1
+        REMINDERS.labels('sent').inc(num_sent)
+        REMINDERS.labels('failed').inc(len(failures))
+        return failures, num_sent
 
-            if text:
-                yield from self.necrobot.client.send_message(channel,
-                    '{0}: {1}'.format(mention_str, text))
-            else:
-                yield from self.necrobot.client.send_message(channel,
-                    '{0}: Please remember to schedule your races!'.format(mention_str))
+    # Sends the reminder for the match; members is a Necrobot.member_index(). Returns None if it was sent, or why not.
+    @asyncio.coroutine
+    def _remind_match(self, match, channel_id, members, text=None):
+        channel = self.necrobot.find_channel_with_id(channel_id)
+        if not channel:
+            logger.error('Error: Channel not found for match %s, which has a registered channel id.', match.channel_name, extra=botlog.context(channel=channel_id, match=match))
+            return 'channel not found'
+
+        mentions = [members[int(racer.discord_id)].mention for racer in match.racers if racer.discord_id and int(racer.discord_id) in members]
+        if not mentions:
+            logger.warning('Error: couldn\'t find discord user accounts for the racers in match %s.', match.channel_name, extra=botlog.context(channel=channel, match=match))
+            return 'racers not on the server'
+
+        mention_str = ', '.join(mentions)
+        if text:
+            yield from self.necrobot.client.send_message(channel,
+                '{0}: {1}'.format(mention_str, text), priority=outbound.PRIORITY_BACKGROUND)
+        else:
+            yield from self.necrobot.client.send_message(channel,
+                '{0}: Please remember to schedule your races!'.format(mention_str), priority=outbound.PRIORITY_BACKGROUND)
+        return None
 
 
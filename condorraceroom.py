@@ -7,6 +7,7 @@ import config
 import datetime
 import discord
 import level
+import outbound
 import racetime
 import seedgen
 import textwrap
@@ -16,6 +17,20 @@ from condormatch import CondorMatch
 from race import Race
 from racer import Racer
 from raceinfo import RaceInfo
+from topicupdater import TopicUpdater
+
+# Jobs each room runs through the scheduler before its match begins
+JOB_PM_WARNING = 'room_pm_warning'
+JOB_FIRST_WARNING = 'room_first_warning'
+JOB_STAFF_WARNING = 'room_staff_warning'
+JOB_MATCH_START = 'room_match_start'
+JOB_TOPIC_REFRESH = 'room_topic_refresh'
+JOB_TYPES = [JOB_PM_WARNING, JOB_FIRST_WARNING, JOB_STAFF_WARNING, JOB_MATCH_START, JOB_TOPIC_REFRESH]
+
+PM_WARNING = datetime.timedelta(minutes=30)
+FIRST_WARNING = datetime.timedelta(minutes=15)
+ALERT_STAFF_WARNING = datetime.timedelta(minutes=5)
+TOPIC_REFRESH_SEC = 30
 
 SUFFIXES = {1: 'st', 2: 'nd', 3: 'rd'}
 def ordinal(num):
@@ -95,7 +110,7 @@ class Done(command.CommandType):
 
         racer = self._room.race.get_racer(command.author)
         if racer:
-            success = yield from self._room.race.finish_racer(racer) #success is true if the racer was racing and is now finished
+            success = yield from self._room.race.finish_racer(racer, command.message.timestamp) #success is true if the racer was racing and is now finished
             if success:
                 num_finished = self._room.race.num_finished
                 yield from self._room.write('{0} has finished in {1} place with a time of {2}.'.format(command.author.mention, ordinal(num_finished), racer.time_str))
@@ -274,7 +289,7 @@ class ForceForfeit(command.CommandType):
             for name in command.args:
                 for racer in self._room.race.racers.values():
                     if racer.name.lower() == name.lower():
-                        asyncio.ensure_future(self._room.race.forfeit_racer(racer))
+                        yield from self._room.race.forfeit_racer(racer, command.message.timestamp)
 
 ##class ForceForfeitAll(command.CommandType):
 ##    def __init__(self, race_room):
@@ -485,6 +500,8 @@ class RaceRoom(command.Module):
         self.cancelling_racers = []                                 #Racers that have typed .cancel
 
         self._cm = condor_module           
+        self._journal = condor_module.race_journal.for_channel(race_channel.id)     #saves race events, to restore the race after a restart
+        self._topic = TopicUpdater(self.client, lambda: self.channel, self._leaderboard_topic)
 
         self.command_types = [command.DefaultHelp(self),
                               Here(self),
@@ -538,14 +555,32 @@ class RaceRoom(command.Module):
 
     # Set up the leaderboard etc. Should be called after creation; code not put into __init__ b/c coroutine
     @asyncio.coroutine
-    def initialize(self, users_to_mention=[]):
+    # resuming is True if the room is being reopened after the bot restarted
+    def initialize(self, users_to_mention=[], resuming=False):
         yield from self.update_leaderboard()
-        asyncio.ensure_future(self.countdown_to_match_start())
+        yield from self.countdown_to_match_start(resuming)
+
+    # Stop the room's pending topic update and race timers; called when the room is removed (see roomregistry.py)
+    def close(self):
+        self.is_closed = True
+        self._topic.cancel()
+        if self.race:
+            self.race.stop()
+
+    # Number of pending topic updates and race timers
+    @property
+    def num_tasks(self):
+        return (1 if self._topic.pending else 0) + (self.race.num_timers if self.race else 0)
+
+    # True if the match is over: all its races have been played, and none is going on
+    @property
+    def is_finished(self):
+        return (not self.race or self.race.complete or self.race.is_before_race) and self.played_all_races
 
     # Write text to the raceroom. Return a Message for the text written
     @asyncio.coroutine
-    def write(self, text):
-        return self.client.send_message(self.channel, text)
+    def write(self, text, priority=outbound.PRIORITY_NORMAL):
+        return self.client.send_message(self.channel, text, priority=priority)
 
     # Write text to the bot_notifications channel.
     @asyncio.coroutine
@@ -582,9 +617,17 @@ class RaceRoom(command.Module):
                 yield from self.update_leaderboard()                  
                 
 
+    # Updates the leaderboard soon. Bursts of requests are merged into a single topic edit.
+    def request_leaderboard_update(self):
+        self._topic.request()
+
     #Updates the leaderboard
     @asyncio.coroutine
     def update_leaderboard(self):
+        self.request_leaderboard_update()
+
+    # Returns the text of the channel topic
+    def _leaderboard_topic(self):
         if self.race or self.match.time_until_match.total_seconds() < 0:
             topic = '``` \n'
             topic += 'Necrodancer World Cup Match (Cadence Seeded)\n'
@@ -604,7 +647,7 @@ class RaceRoom(command.Module):
                     topic += self.race.leaderboard
 
             topic += '\n ```'
-            asyncio.ensure_future(self.client.edit_channel(self.channel, topic=topic))
+            return topic
         else:
             topic_str = '``` \n'
             minutes_until_match = int( (self.match.time_until_match.total_seconds() + 30) // 60 )
@@ -619,8 +662,7 @@ class RaceRoom(command.Module):
             topic_str += 'Still waiting for .here from: {0} \n'.format(waiting_str[:-2]) if waiting_str else 'Both racers are here!\n'
 
             topic_str += '```'
-                
-            asyncio.ensure_future(self.client.edit_channel(self.channel, topic=topic_str))
+            return topic_str
 
     @asyncio.coroutine
     def alert_racers(self, send_pm=False):
@@ -643,65 +685,93 @@ class RaceRoom(command.Module):
             if member_2:
                 yield from self.client.send_message(member_2, '{0}: Your match with {1} is scheduled to begin in {2} minutes.'.format(member_2.mention, self.match.racer_1.escaped_twitch_name, minutes_until_match))
 
+    # Schedules the pre-match warnings and the start of the first race (or picks the match back up if we're past its start)
     @asyncio.coroutine
-    def countdown_to_match_start(self):        
-        time_until_match = self.match.time_until_match
-        asyncio.ensure_future(self.constantly_update_leaderboard())
+    def countdown_to_match_start(self, resuming=False):
+        # a race in the journal is picked back up whatever the match time (it may have been started early with .forcebeginmatch)
+        if resuming and (yield from self.restore_race()):
+            return
 
+        time_until_match = self.match.time_until_match
         if time_until_match < datetime.timedelta(seconds=0):
             if not self.played_all_races:
-                yield from self.write('I believe that I was just restarted; an error may have occurred. I am beginning a new race and attempting to pick up this ' \
-                                      'match where we left off. If this is an error, or if there are unrecorded races, please contact CoNDOR Staff (`.staff`).')
+                self.before_races = False                   #so that scheduled jobs firing meanwhile don't also start a race
+                if resuming:
+                    yield from self.write('I was restarted during this match; an error may have occurred. I am beginning a new race and attempting to pick up this ' \
+                                          'match where we left off. If this is an error, or if there are unrecorded races, please contact CoNDOR Staff (`.staff`).')
                 yield from self.begin_new_race()
         else:
-            pm_warning = datetime.timedelta(minutes=30)
-            first_warning = datetime.timedelta(minutes=15)
-            alert_staff_warning = datetime.timedelta(minutes=5)
-
-            if time_until_match > pm_warning:
-                yield from asyncio.sleep( (time_until_match - pm_warning).total_seconds() )
-                if not self.race:
-                    yield from self.alert_racers(send_pm=True)                
-
-            time_until_match = self.match.time_until_match            
-            if time_until_match > first_warning:
-                yield from asyncio.sleep( (time_until_match - first_warning).total_seconds() )
-                if not self.race:
-                    yield from self.alert_racers()
-
-            time_until_match = self.match.time_until_match
-            if time_until_match > alert_staff_warning:
-                yield from asyncio.sleep( (time_until_match - alert_staff_warning).total_seconds() )
-
-            # this is done at the alert_staff_warning, unless this function was called after the alert_staff_warning, in which case do it immediately
-            if not self.race:
-                yield from self.alert_racers()            
-                for racer in self.match.racers:
-                    if racer not in self.entered_racers:
-                        discord_name = ''
-                        if racer.discord_name:
-                            discord_name = ' (Discord name: {0})'.format(racer.discord_name)
-                        minutes_until_race = int( (self.match.time_until_match.total_seconds() + 30) // 60)
-                        yield from self.alert_staff('Alert: {0}{1} has not yet shown up for their match, which is scheduled in {2} minutes.'.format(racer.escaped_twitch_name, discord_name, minutes_until_race))
-
-                yield from self._cm.post_match_alert(self.match)
-
-            yield from asyncio.sleep(self.match.time_until_match.total_seconds())
-
-            if not self.race:
-                yield from self.begin_new_race()
+            scheduler = self.necrobot.scheduler
+            if time_until_match > PM_WARNING:
+                scheduler.schedule(JOB_PM_WARNING, self.channel.id, self.match.time - PM_WARNING)
+            if time_until_match > FIRST_WARNING:
+                scheduler.schedule(JOB_FIRST_WARNING, self.channel.id, self.match.time - FIRST_WARNING)
+
+            # if we're already past the staff warning time, this fires immediately
+            scheduler.schedule(JOB_STAFF_WARNING, self.channel.id, self.match.time - ALERT_STAFF_WARNING)
+            scheduler.schedule(JOB_MATCH_START, self.channel.id, self.match.time)
+            scheduler.schedule_at(JOB_TOPIC_REFRESH, self.channel.id, time.time())
+
+    # Called by the scheduler when one of this room's jobs fires
+    @asyncio.coroutine
+    def on_scheduled_job(self, job_type):
+        if job_type == JOB_TOPIC_REFRESH:
+            self.request_leaderboard_update()
+            seconds_until_match = self.match.time_until_match.total_seconds()
+            if seconds_until_match > 0:
+                self.necrobot.scheduler.schedule_at(JOB_TOPIC_REFRESH, self.channel.id, time.time() + min(TOPIC_REFRESH_SEC, seconds_until_match))
+            return
 
+        # the remaining jobs only do anything before the first race has been made
+        if self.race or not self.before_races:
+            return
+
+        if job_type == JOB_PM_WARNING:
+            yield from self.alert_racers(send_pm=True)
+        elif job_type == JOB_FIRST_WARNING:
+            yield from self.alert_racers()
+        elif job_type == JOB_STAFF_WARNING:
+            yield from self.alert_racers()            
+            for racer in self.match.racers:
+                if racer not in self.entered_racers:
+                    discord_name = ''
+                    if racer.discord_name:
+                        discord_name = ' (Discord name: {0})'.format(racer.discord_name)
+                    minutes_until_race = int( (self.match.time_until_match.total_seconds() + 30) // 60)
+                    yield from self.alert_staff('Alert: {0}{1} has not yet shown up for their match, which is scheduled in {2} minutes.'.format(racer.escaped_twitch_name, discord_name, minutes_until_race))
+
+            yield from self._cm.post_match_alert(self.match)
+        elif job_type == JOB_MATCH_START:
+            self.before_races = False
+            yield from self.begin_new_race()
+
+    # Rebuild the race that was going on when the bot went down, from the room's journal.
+    # Returns False if there was no race to restore.
     @asyncio.coroutine
-    def constantly_update_leaderboard(self):
-        while self.match.time_until_match.total_seconds() > 0:
-            asyncio.ensure_future(self.update_leaderboard())
-            yield from asyncio.sleep(30)
+    def restore_race(self):
+        events = self._journal.events()
+        if not events:
+            return False
+
+        self.cancelling_racers = []
+        self.before_races = False
+        self.race = Race(self, RaceRoom.get_new_raceinfo(), self._journal)
+        self.race.replay(events, self._cm.necrobot.find_member_with_id)
+        self.recorded_race = False
+        self.request_leaderboard_update()
+
+        time_str = ' The race clock is at {0}.'.format(self.race.current_time_str) if self.race.current_time_str else ''
+        yield from self.write('I was restarted during this race, and have picked it back up where it was (seed: {0}).{1} '\
+                              'If anything looks wrong, please contact CoNDOR Staff (`.staff`).'.format(self.race.race_info.seed, time_str))
+        yield from self.race.resume()
+        return True
 
     @asyncio.coroutine
     def begin_new_race(self):
         self.cancelling_racers = []
         self.before_races = False
-        self.race = Race(self, RaceRoom.get_new_raceinfo())
+        self._journal.prune()
+        self.race = Race(self, RaceRoom.get_new_raceinfo(), self._journal)
         yield from self.race.initialize()
         self.recorded_race = False
         
@@ -811,6 +881,7 @@ class RaceRoom(command.Module):
                         self.match.racer_2.escaped_twitch_name, racetime.to_str(racer_2_time)))
 
             self._cm.condordb.record_race(self.match, racer_1_time, racer_2_time, winner, self.race.race_info.seed, self.race.start_time.timestamp(), cancelled)
+            self._journal.prune()
 
             if not cancelled:
                 racer_1_member = self.necrobot.find_member_with_id(self.match.racer_1.discord_id)
@@ -833,6 +904,8 @@ class RaceRoom(command.Module):
     @asyncio.coroutine
     def record_match(self):
         self._cm.condordb.record_match(self.match)
+        self.necrobot.scheduler.complete(JOB_MATCH_START, self.channel.id)
         yield from self._cm.condorsheet.record_match(self.match)
         yield from self.write('Match results recorded.')      
         yield from self.update_leaderboard()
+        self._cm.on_match_recorded(self)
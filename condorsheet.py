@@ -1,36 +1,106 @@
 import asyncio
 import calendar
-import datetime
-import gspread
 import json
+import logging
 import pytz
 import re
-import xml
-import traceback
+import time
+import xml.etree.ElementTree
 
 from itertools import zip_longest
-from oauth2client.client import SignedJwtAssertionCredentials
 
+import botlog
 import condortimestr
+import condortz
 import config
+import metrics
 
 from condordb import CondorDB
 from condormatch import CondorMatch
 
+logger = logging.getLogger(__name__)
+
+SHEET_CALL_SECONDS = metrics.histogram('condorbot_sheet_call_seconds', 'Time taken by GSheet calls (once the sheet lock is held), by call.', ['call'])
+SHEET_LOCK_WAIT_SECONDS = metrics.histogram('condorbot_sheet_lock_wait_seconds', 'Time GSheet calls waited for the sheet lock.')
+SHEET_ERRORS = metrics.counter('condorbot_sheet_errors_total', 'GSheet calls that raised an error, by call.', ['call'])
+
 def grouper(iterable, n, fillvalue=None):
     args = [iter(iterable)] * n
     return zip_longest(*args, fillvalue=fillvalue)
 
+# Finds the cells holding any of a set of racers' twitch names, with one regex over a snapshot of a worksheet
+# (the list of rows returned by get_all_values), rather than one search of the sheet per racer.
+class RacerMatcher(object):
+    def __init__(self, racers):
+        names = set(racer.twitch_name.lower() for racer in racers if racer)
+        self._regex = None
+        if names:
+            alternatives = '|'.join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+            self._regex = re.compile(r'(?i)^\s*(' + alternatives + r')\s*$')
+
+    # Returns a dict from each (lowercased) twitch name found to the list of (row, col) of its cells; rows and columns start at 1
+    def find_cells(self, values):
+        cells = {}
+        if not self._regex:
+            return cells
+        regex_match = self._regex.match
+        for row_num, row in enumerate(values, start=1):
+            for col_num, value in enumerate(row, start=1):
+                if value:
+                    m = regex_match(value)
+                    if m:
+                        cells.setdefault(m.group(1).lower(), []).append((row_num, col_num))
+        return cells
+
+    # Returns a list giving, for each match, the first row containing both racers (or None if there isn't one)
+    def find_rows(self, values, matches):
+        cells = self.find_cells(values)
+        rows = []
+        for match in matches:
+            racer_2_rows = set(row for row, col in cells.get(match.racer_2.twitch_name.lower(), []))
+            match_row = None
+            for row, col in cells.get(match.racer_1.twitch_name.lower(), []):
+                if row in racer_2_rows:
+                    match_row = row
+                    break
+            rows.append(match_row)
+        return rows
+
 class CondorSheet(object):
     def _get_match_str(utc_datetime):
-        gsheet_tz = pytz.timezone(config.GSHEET_TIMEZONE)
+        gsheet_tz = condortz.get_timezone(config.GSHEET_TIMEZONE)
         gsheet_dt = gsheet_tz.normalize(utc_datetime.replace(tzinfo=pytz.utc).astimezone(gsheet_tz))
         return condortimestr.get_gsheet_time_str(gsheet_dt)
     
+    # The sheet isn't opened here (that waits on Google); it's opened by open(), or by the first call that needs it
     def __init__(self, condor_db):
         self._lock = asyncio.Lock()
         self._db = condor_db
-        json_key = json.load(open(config.GSHEET_CREDENTIALS_FILENAME))
+        self._credentials = None
+        self._gsheet = None
+
+    # Open the sheet, if it isn't open yet. Authorizing and opening are done in an executor, off the event loop.
+    @asyncio.coroutine
+    def open(self):
+        yield from self._lock
+        try:
+            yield from self._ensure_open()
+        finally:
+            self._lock.release()
+
+    # Call with the lock held
+    @asyncio.coroutine
+    def _ensure_open(self):
+        if self._gsheet is None:
+            yield from asyncio.get_event_loop().run_in_executor(None, self._open_sheet)
+
+    # gspread and oauth2client are slow to import, so they're imported here, on the executor's thread
+    def _open_sheet(self):
+        import gspread
+        from oauth2client.client import SignedJwtAssertionCredentials
+
+        with open(config.GSHEET_CREDENTIALS_FILENAME) as credentials_file:
+            json_key = json.load(credentials_file)
         scope = ['https://spreadsheets.google.com/feeds']
         self._credentials = SignedJwtAssertionCredentials(json_key['client_email'], json_key['private_key'].encode(), scope)
         gc = gspread.authorize(self._credentials)
@@ -44,26 +114,23 @@ class CondorSheet(object):
         return self._gsheet.worksheet('Standings')
         
     def _get_row(self, match, wks):
-        racer_1_cells = []
-        racer_1_regex = match.racer_1.gsheet_regex
-        racer_2_cells = []
-        racer_2_regex = match.racer_2.gsheet_regex
         try:
-            racer_1_cells = wks.findall(racer_1_regex)
-            racer_2_cells = wks.findall(racer_2_regex)
-        except xml.etree.ElementTree.ParseError as e:
-            timestamp = datetime.datetime.utcnow()
-            print('{0}: XML parse error when looking up racer names in week sheet: {1}, {2}.'.format(timestamp.strftime("%Y/%m/%d %H:%M:%S"), match.racer_1.twitch_name, match.racer_2.twitch_name))
-            print(e)
-            traceback.print_exc()
+            values = wks.get_all_values()
+        except xml.etree.ElementTree.ParseError:
+            logger.exception('XML parse error when looking up racer names in week sheet: %s, %s.', match.racer_1.twitch_name, match.racer_2.twitch_name,
+                             extra=botlog.context(match=match))
             raise
-        
-        for cell_1 in racer_1_cells:
-            for cell_2 in racer_2_cells:
-                if cell_1.row == cell_2.row:
-                    return cell_1.row
+
+        return self._get_match_rows(values, [match])[0]
+
+    # Returns a list giving the row of each of the matches (None for those not found) in values, a snapshot of a week's
+    # worksheet (the list of rows returned by get_all_values), so that any number of matches can be found with one read
+    def _get_match_rows(self, values, matches):
+        racers = [racer for match in matches for racer in (match.racer_1, match.racer_2)]
+        return RacerMatcher(racers).find_rows(values, matches)
 
     def _reauthorize(self):
+        import gspread
         gc = gspread.authorize(self._credentials)
         self._gsheet = gc.open(config.GSHEET_DOC_NAME)
 
@@ -73,27 +140,37 @@ class CondorSheet(object):
                 bestof_num = int(bestof_str.lstrip('bo'))
                 match.set_best_of(bestof_num)
             except ValueError:
-                print('Error parsing <{}> as best-of-N information.'.format(bestof_str))            
+                logger.warning('Error parsing <%s> as best-of-N information.', bestof_str, extra=botlog.context(match=match))
         elif bestof_str.startswith('r'):
             try:
                 repeat_num = int(bestof_str.lstrip('r'))
                 match.set_repeat(repeat_num)
             except ValueError:
-                print('Error parsing <{}> as repeat-N information.'.format(bestof_str))
+                logger.warning('Error parsing <%s> as repeat-N information.', bestof_str, extra=botlog.context(match=match))
         elif not bestof_str == '':
-            print('Error parsing <{}> as best-of-N or repeat-N information.'.format(bestof_str))
+            logger.warning('Error parsing <%s> as best-of-N or repeat-N information.', bestof_str, extra=botlog.context(match=match))
 
     @asyncio.coroutine
     def _do_with_lock(self, function, *args, **kwargs):
+        call_name = function.__name__.lstrip('_')
+        start = time.perf_counter()
         yield from self._lock
+        SHEET_LOCK_WAIT_SECONDS.observe(time.perf_counter() - start)
+        start = time.perf_counter()
         try:
+            yield from self._ensure_open()
             to_return = yield from function(*args, **kwargs)
             return to_return
         except xml.etree.ElementTree.ParseError as e:
+            SHEET_ERRORS.labels(call_name).inc()
             self._reauthorize()
             to_return = yield from function(*args, **kwargs)
             return to_return
+        except Exception:
+            SHEET_ERRORS.labels(call_name).inc()
+            raise
         finally:
+            SHEET_CALL_SECONDS.labels(call_name).observe(time.perf_counter() - start)
             self._lock.release()
 
     @asyncio.coroutine
@@ -122,7 +199,7 @@ class CondorSheet(object):
 
             return matches
         else:
-            print('Couldn\'t find worksheet for week {}.'.week)
+            logger.warning('Couldn\'t find worksheet for week %s.', week)
 
     @asyncio.coroutine
     def unschedule_match(self, match):
@@ -130,6 +207,7 @@ class CondorSheet(object):
 
     @asyncio.coroutine
     def _unschedule_match(self, match):
+        import gspread
         week = match.week
         wks = self._get_wks(week)
         if wks:
@@ -150,11 +228,11 @@ class CondorSheet(object):
                 if the_col:
                     wks.update_cell(match_row, the_col.col, '')
                 else:
-                    print('Couldn\'t find either the "Date:" or "Scheduled:" column on the GSheet.')
+                    logger.warning('Couldn\'t find either the "Date:" or "Scheduled:" column on the GSheet.', extra=botlog.context(match=match))
             else:
-                print('Couldn\'t find match between <{0}> and <{1}> on the GSheet.'.format(match.racer_1.twitch_name, match.racer_2.twitch_name))
+                logger.warning('Couldn\'t find match between <%s> and <%s> on the GSheet.', match.racer_1.twitch_name, match.racer_2.twitch_name, extra=botlog.context(match=match))
         else:
-            print('Couldn\'t find worksheet for week {}.'.week)
+            logger.warning('Couldn\'t find worksheet for week %s.', week, extra=botlog.context(match=match))
 
     @asyncio.coroutine
     def schedule_match(self, match):
@@ -162,6 +240,7 @@ class CondorSheet(object):
 
     @asyncio.coroutine
     def _schedule_match(self, match):
+        import gspread
         wks = self._get_wks(match.week)
         if wks:
             match_row = self._get_row(match, wks)
@@ -181,7 +260,7 @@ class CondorSheet(object):
                 if the_col:
                     wks.update_cell(match_row, the_col.col, CondorSheet._get_match_str(match.time))
                 else:
-                    print('Couldn\'t find either the "Date:" or "Scheduled:" column on the GSheet.')
+                    logger.warning('Couldn\'t find either the "Date:" or "Scheduled:" column on the GSheet.', extra=botlog.context(match=match))
 
 ##                time_col = wks.find('Time:')
 ##                if time_col:
@@ -189,9 +268,9 @@ class CondorSheet(object):
 ##                else:
 ##                    print('Couldn\'t find the "Time:" column on the GSheet.')
             else:
-                print('Couldn\'t find match between <{0}> and <{1}> on the GSheet.'.format(match.racer_1.twitch_name, match.racer_2.twitch_name))
+                logger.warning('Couldn\'t find match between <%s> and <%s> on the GSheet.', match.racer_1.twitch_name, match.racer_2.twitch_name, extra=botlog.context(match=match))
         else:
-            print('Couldn\'t find worksheet <{}>.'.worksheet_name)
+            logger.warning('Couldn\'t find worksheet for week %s.', match.week, extra=botlog.context(match=match))
 
     @asyncio.coroutine
     def record_match(self, match):
@@ -223,52 +302,49 @@ class CondorSheet(object):
                 if winner_column:
                     wks.update_cell(match_row, winner_column.col, winner)
                 else:
-                    print('Couldn\'t find the "Winner:" column on the GSheet.')
+                    logger.warning('Couldn\'t find the "Winner:" column on the GSheet.', extra=botlog.context(match=match))
                     return
 
                 score_column = wks.find('Game Score:')
                 if score_column:
                     wks.update_cell(match_row, score_column.col, score_str)
                 else:
-                    print('Couldn\'t find the "Game Score:" column on the GSheet.')
+                    logger.warning('Couldn\'t find the "Game Score:" column on the GSheet.', extra=botlog.context(match=match))
                     return
                 
                 self._update_standings(match, match_results);
             else:
-                print('Couldn\'t find match between <{0}> and <{1}> on the GSheet.'.format(match.racer_1.twitch_name, match.racer_2.twitch_name))
+                logger.warning('Couldn\'t find match between <%s> and <%s> on the GSheet.', match.racer_1.twitch_name, match.racer_2.twitch_name, extra=botlog.context(match=match))
         else:
-            print('Couldn\'t find worksheet <{}>.'.worksheet_name)        
+            logger.warning('Couldn\'t find worksheet for week %s.', match.week, extra=botlog.context(match=match))
 
 
     #@asyncio.coroutine
     def _update_standings(self, match, match_results):
         standings = self._get_standings()
         if standings:
-            racer_1_cells = []
-            racer_1_regex = match.racer_1.gsheet_regex
-            racer_2_cells = []
-            racer_2_regex = match.racer_2.gsheet_regex
             try:
-                racer_1_cells = standings.findall(racer_1_regex)
-                racer_2_cells = standings.findall(racer_2_regex)
-            except xml.etree.ElementTree.ParseError as e:
-                timestamp = datetime.datetime.utcnow()
-                print('{0}: XML parse error when looking up racer names in the standings: {1}, {2}.'.format(timestamp.strftime("%Y/%m/%d %H:%M:%S"), match.racer_1.twitch_name, match.racer_2.twitch_name))
-                print(e)
-                traceback.print_exc()
+                values = standings.get_all_values()
+            except xml.etree.ElementTree.ParseError:
+                logger.exception('XML parse error when looking up racer names in the standings: %s, %s.', match.racer_1.twitch_name, match.racer_2.twitch_name,
+                                 extra=botlog.context(match=match))
                 raise
-            
+
+            cells = RacerMatcher([match.racer_1, match.racer_2]).find_cells(values)
+            racer_1_cells = cells.get(match.racer_1.twitch_name.lower(), [])
+            racer_2_cells = cells.get(match.racer_2.twitch_name.lower(), [])
             self._set_score(standings, racer_1_cells, racer_2_cells, match_results[0])
             self._set_score(standings, racer_2_cells, racer_1_cells, match_results[1])
         else:
-            print('Couldn\'t find worksheet <standings>.')
-            
+            logger.warning('Couldn\'t find worksheet <standings>.', extra=botlog.context(match=match))
+
+    # racer_1_cells and racer_2_cells are lists of (row, col)
     def _set_score(self, standings, racer_1_cells, racer_2_cells, score):
-        for cell_1 in racer_1_cells:
-            if cell_1.col == 2:
-                for cell_2 in racer_2_cells:
-                    if cell_2.row == cell_1.row:
-                        standings.update_cell(cell_1.row, cell_2.col - 7, score)
+        for row_1, col_1 in racer_1_cells:
+            if col_1 == 2:
+                for row_2, col_2 in racer_2_cells:
+                    if row_2 == row_1:
+                        standings.update_cell(row_1, col_2 - 7, score)
                         return
 
     @asyncio.coroutine
@@ -290,9 +366,9 @@ class CondorSheet(object):
                     if args and args[0] == 'twitch.tv':
                         return args[len(args) - 1].rstrip(' ')
                 else:
-                    print('Couldn\'t find the Cawmentary: column.')
+                    logger.warning('Couldn\'t find the Cawmentary: column.', extra=botlog.context(match=match))
             else:
-                print('Couldn\'t find row for match.')
+                logger.warning('Couldn\'t find row for the match.', extra=botlog.context(match=match))
         return None
 
     @asyncio.coroutine
@@ -309,13 +385,13 @@ class CondorSheet(object):
                 if cawmentary_column:
                     cawmentary_cell = wks.cell(match_row, cawmentary_column.col)
                     if cawmentary_cell.value:
-                        print('Error: tried to add cawmentary to a match that already had it.')
+                        logger.error('Error: tried to add cawmentary to a match that already had it.', extra=botlog.context(match=match))
                     else:
                         wks.update_cell(match_row, cawmentary_column.col, 'twitch.tv/{}'.format(cawmentator_twitchname))
                 else:
-                    print('Couldn\'t find the Cawmentary: column.')
+                    logger.warning('Couldn\'t find the Cawmentary: column.', extra=botlog.context(match=match))
             else:
-                print('Couldn\'t find row for the match.')
+                logger.warning('Couldn\'t find row for the match.', extra=botlog.context(match=match))
 
     @asyncio.coroutine
     def remove_cawmentary(self, match):
@@ -331,27 +407,39 @@ class CondorSheet(object):
                 if cawmentary_column:
                     cawmentary_cell = wks.update_cell(match_row, cawmentary_column.col, '')
                 else:
-                    print('Couldn\'t find the Cawmentary: column.')
+                    logger.warning('Couldn\'t find the Cawmentary: column.', extra=botlog.context(match=match))
             else:
-                print('Couldn\'t find row for the match.')
+                logger.warning('Couldn\'t find row for the match.', extra=botlog.context(match=match))
 
+    # Returns a list giving, for each of the given matches of the week, whether it's a showcase match,
+    # reading the week's worksheet only once
     @asyncio.coroutine
-    def is_showcase_match(self, match):
-        return self._do_with_lock(self._is_showcase_match, match)        
+    def get_showcase_flags(self, week, matches):
+        return self._do_with_lock(self._get_showcase_flags, week, matches)
 
     @asyncio.coroutine
-    def _is_showcase_match(self, match):
-        wks = self._get_wks(match.week)
-        if wks:
-            match_row = self._get_row(match, wks)
+    def _get_showcase_flags(self, week, matches):
+        wks = self._get_wks(week)
+        if not wks:
+            logger.warning('Couldn\'t find worksheet for week %s.', week)
+            return [False for match in matches]
+
+        values = wks.get_all_values()
+        cawmentary_col = None
+        for row in values:
+            if 'Cawmentary:' in row:
+                cawmentary_col = row.index('Cawmentary:') + 1
+                break
+        if not cawmentary_col:
+            logger.warning('Couldn\'t find the "Cawmentary:" column on the GSheet for week %s.', week)
+            return [False for match in matches]
+
+        flags = []
+        for match, match_row in zip(matches, self._get_match_rows(values, matches)):
             if match_row:
-                cawmentary_column = wks.find('Cawmentary:')
-                if cawmentary_column:
-                    sched_cell = wks.cell(match_row, cawmentary_column.col)
-                    if sched_cell and sched_cell.value.lower().startswith("showcase"):
-                        return True            
-                else:
-                    print('Couldn\'t find either the "Date:" or "Scheduled:" column on the GSheet.')
+                row = values[match_row - 1]
+                flags.append(len(row) >= cawmentary_col and row[cawmentary_col - 1].lower().startswith('showcase'))
             else:
-                print('Couldn\'t find row for the match.')
-        return False
+                logger.warning('Couldn\'t find row for the match.', extra=botlog.context(match=match))
+                flags.append(False)
+        return flags
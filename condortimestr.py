@@ -1,6 +1,14 @@
 import calendar
 import datetime
 
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Seconds since the epoch of a datetime; a naive one (as discord gives message timestamps) is taken to be UTC
+def to_epoch(dt):
+    if dt.tzinfo is not None:
+        return dt.timestamp()
+    return (dt - EPOCH).total_seconds()
+
 def get_time_str(dt):
     if not dt:
         return ''
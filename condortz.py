@@ -0,0 +1,18 @@
+## Timezone lookups. The names pytz knows are kept in a frozenset, so that checking a name is a hash lookup rather
+## than a scan of pytz.all_timezones, and each timezone is only resolved by pytz once.
+
+import pytz
+
+TIMEZONE_NAMES = frozenset(pytz.all_timezones)
+_tzinfos = {}                       #timezone name -> pytz tzinfo
+
+def is_timezone(name):
+    return name in TIMEZONE_NAMES
+
+# Returns the pytz tzinfo for the given name, or None if it isn't a known timezone
+def get_timezone(name):
+    tz = _tzinfos.get(name)
+    if tz is None and name in TIMEZONE_NAMES:
+        tz = pytz.timezone(name)
+        _tzinfos[name] = tz
+    return tz
@@ -1,3 +1,5 @@
+import logging
+
 def init(config_filename):
     global BOT_COMMAND_PREFIX
     global BOT_VERSION
@@ -11,6 +13,7 @@ def init(config_filename):
     global MAIN_CHANNEL_NAME
     global ADMIN_CHANNEL_NAME
     global SCHEDULE_CHANNEL_NAME
+    global SCHEDULE_MAX_MATCHES                 #maximum number of upcoming matches listed in the schedule channel
     global NOTIFICATIONS_CHANNEL_NAME
 
     #prerace
@@ -23,8 +26,28 @@ def init(config_filename):
     global INCREMENTAL_COUNTDOWN_START             #number of seconds at which to start counting down each second in chat
     global FINALIZE_TIME_SEC                       #seconds after race end to finalize+record race
 
+    #tasks
+    global TASK_MAX_CONCURRENT                     #maximum number of bot tasks running at once
+    global TASK_CHANNEL_QUEUE_SIZE                 #maximum number of commands waiting to be handled in a single channel
+    global LOOP_LAG_INTERVAL                       #seconds between samples of the event loop's lag
+    global LOOP_STALL_THRESHOLD                    #seconds the event loop can be blocked before its stack is printed
+
+    #metrics
+    global METRICS_HOST                            #address the metrics listener binds to
+    global METRICS_PORT                            #port to serve metrics on (0 for no metrics listener)
+
+    #logging
+    global LOG_FILENAME                            #the bot's log (JSON, one record per line); old logs are kept as .1, .2, etc.
+    global LOG_LEVEL
+    global LOG_MAX_BYTES                           #size at which the log is rotated
+    global LOG_ROTATE_INTERVAL                     #seconds after which the log is rotated
+    global LOG_BACKUP_COUNT                        #number of old logs kept
+
     #database
     global DB_FILENAME
+    global ARCHIVE_DB_FILENAME                     #where the messages of closed race rooms are saved
+    global ARCHIVE_MAX_CONCURRENT                  #number of channels archived at once by .closeweek
+    global WARM_START_FILENAME                     #snapshot of the bot's channels and race rooms, for a fast restart (blank for none)
 
     #gsheets
     global GSHEET_CREDENTIALS_FILENAME
@@ -39,13 +62,28 @@ def init(config_filename):
         'channel_admin':'adminchat',
         'channel_schedule':'schedule',
         'channel_notifications':'bot_notifications',
+        'schedule_max_matches':'60',
         'race_number_of_races':'3',
         'race_alert_at_minutes':'30',
         'race_countdown_time_seconds':'10',
         'race_begin_counting_down_at':'5',
         'race_end_after_first_done_seconds':'15',
         'race_notify_if_times_within_seconds':'5',
+        'task_max_concurrent':'32',
+        'task_channel_queue_size':'16',
+        'loop_lag_interval_ms':'100',
+        'loop_stall_threshold_ms':'250',
+        'metrics_host':'127.0.0.1',
+        'metrics_port':'0',
+        'log_filename':'logging/condorbot.log',
+        'log_level':'INFO',
+        'log_max_mb':'20',
+        'log_rotate_hours':'24',
+        'log_backup_count':'30',
         'db_filename':'data/ndwc.db',
+        'archive_db_filename':'data/archive.db',
+        'archive_max_concurrent':'4',
+        'warm_start_filename':'data/warm_start.json',
         'gsheet_credentials_filename':'data/gsheet_credentials.json',
         'gsheet_doc_name':'CoNDOR Season 4',
         'gsheet_timezone':'US/Eastern',
@@ -65,7 +103,7 @@ def init(config_filename):
                     for arg in arglist:
                         admin_roles.append(arg)
                 else:
-                    print("Error in {0}: variable {1} isn't recognized.".format(config_filename, args[0]))
+                    logging.getLogger(__name__).warning("Error in %s: variable %s isn't recognized.", config_filename, args[0])
 
     BOT_COMMAND_PREFIX = defaults['bot_command_prefix']
     BOT_VERSION = defaults['bot_version']
@@ -76,6 +114,7 @@ def init(config_filename):
     ADMIN_CHANNEL_NAME = defaults['channel_admin']
     SCHEDULE_CHANNEL_NAME = defaults['channel_schedule']
     NOTIFICATIONS_CHANNEL_NAME = defaults['channel_notifications']
+    SCHEDULE_MAX_MATCHES = int(defaults['schedule_max_matches'])
 
     ADMIN_ROLE_NAMES = admin_roles
 
@@ -86,7 +125,24 @@ def init(config_filename):
     INCREMENTAL_COUNTDOWN_START = int(defaults['race_begin_counting_down_at'])
     FINALIZE_TIME_SEC = int(defaults['race_end_after_first_done_seconds'])
 
+    TASK_MAX_CONCURRENT = int(defaults['task_max_concurrent'])
+    TASK_CHANNEL_QUEUE_SIZE = int(defaults['task_channel_queue_size'])
+    LOOP_LAG_INTERVAL = int(defaults['loop_lag_interval_ms'])/1000
+    LOOP_STALL_THRESHOLD = int(defaults['loop_stall_threshold_ms'])/1000
+
+    METRICS_HOST = defaults['metrics_host']
+    METRICS_PORT = int(defaults['metrics_port'])
+
+    LOG_FILENAME = defaults['log_filename']
+    LOG_LEVEL = defaults['log_level'].upper()
+    LOG_MAX_BYTES = int(float(defaults['log_max_mb'])*1024*1024)
+    LOG_ROTATE_INTERVAL = int(float(defaults['log_rotate_hours'])*60*60)
+    LOG_BACKUP_COUNT = int(defaults['log_backup_count'])
+
     DB_FILENAME = defaults['db_filename']
+    ARCHIVE_DB_FILENAME = defaults['archive_db_filename']
+    ARCHIVE_MAX_CONCURRENT = int(defaults['archive_max_concurrent'])
+    WARM_START_FILENAME = defaults['warm_start_filename']
     GSHEET_CREDENTIALS_FILENAME = defaults['gsheet_credentials_filename']
     GSHEET_DOC_NAME = defaults['gsheet_doc_name']
     GSHEET_TIMEZONE = defaults['gsheet_timezone']
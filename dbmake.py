@@ -2,11 +2,18 @@ import codecs
 import config
 import sqlite3
 
-config.init('data/bot_config.txt')
+from condordb import CondorDB
+from jobstore import JobStore
+from racejournal import RaceJournal
 
 ## Make the new master database, with tables set up as we want them
 def make_new_database():
     db_conn = sqlite3.connect(config.DB_FILENAME)
+    make_tables(db_conn)
+    db_conn.close()
+
+## Make the tables in the given (empty) database; also used by the load test and db benchmark
+def make_tables(db_conn):
     db_conn.execute("""CREATE TABLE user_data
                     (racer_id integer,
                     discord_id bigint UNIQUE ON CONFLICT REPLACE,
@@ -50,9 +57,13 @@ def make_new_database():
                     flags int DEFAULT 0,
                     PRIMARY KEY (racer_1_id, racer_2_id, week_number, race_number) ON CONFLICT ABORT)
                     """)
+    CondorDB.make_schedule_tables(db_conn)
+    JobStore.make_table(db_conn)
+    RaceJournal.make_table(db_conn)
     db_conn.commit()
-    db_conn.close()
 
 ##-------------------------
 
-make_new_database()
+if __name__ == '__main__':
+    config.init('data/bot_config.txt')
+    make_new_database()
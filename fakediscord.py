@@ -0,0 +1,327 @@
+## Stand-ins for the parts of discord.py the bot uses (Client, Server, Channel, Member, Role and Message), so that it
+## can be run without a connection to Discord (see loadtest.py).
+## Each API call takes a random time between the client's min and max latency. Calls are also counted against
+## Discord-like per-route rate limits (ROUTE_LIMITS); going over one raises a 429 discord.HTTPException with a
+## Retry-After header, as the real API does, so the bot's own rate limiting (outbound.py) gets exercised too.
+
+import asyncio
+import collections
+import datetime
+import itertools
+import random
+
+import discord
+
+# (number of calls, per this many seconds) Discord allows for each route; each channel (or server) is its own route
+ROUTE_LIMITS = {
+    'send_message':             (5, 5.0),
+    'send_file':                (5, 5.0),
+    'edit_message':             (5, 5.0),
+    'delete_message':           (5, 5.0),
+    'get_message':              (5, 5.0),
+    'logs_from':                (5, 5.0),
+    'edit_channel':             (2, 10.0),
+    'edit_channel_permissions': (5, 5.0),
+    'delete_channel_permissions': (5, 5.0),
+    'create_channel':           (5, 5.0),
+    'delete_channel':           (5, 5.0),
+    }
+
+_ids = itertools.count(200000000000000000)
+
+def new_id():
+    return str(next(_ids))
+
+class FakeRole(object):
+    def __init__(self, name):
+        self.id = new_id()
+        self.name = name
+
+class FakeMember(object):
+    def __init__(self, name, server=None, roles=None):
+        self.id = new_id()
+        self.name = name
+        self.server = server
+        self.roles = list(roles) if roles else []
+        self.bot = False
+
+    @property
+    def mention(self):
+        return '<@{0}>'.format(self.id)
+
+    @property
+    def display_name(self):
+        return self.name
+
+    def __str__(self):
+        return self.name
+
+class FakeChannel(object):
+    def __init__(self, name, server):
+        self.id = new_id()
+        self.name = name
+        self.server = server
+        self.topic = ''
+        self.is_private = False
+        self.messages = []                      #oldest first
+        self.permissions = {}                   #target id -> (allow, deny)
+
+    @property
+    def mention(self):
+        return '<#{0}>'.format(self.id)
+
+    def __str__(self):
+        return self.name
+
+# Direct messages to a member
+class FakePrivateChannel(object):
+    def __init__(self, member):
+        self.id = new_id()
+        self.recipient = member
+        self.server = None
+        self.is_private = True
+        self.messages = []
+
+class FakeServer(object):
+    def __init__(self, name):
+        self.id = new_id()
+        self.name = name
+        self.channels = []
+        self.members = []
+        self.default_role = FakeRole('@everyone')
+        self.roles = [self.default_role]
+
+    def get_channel(self, channel_id):
+        for channel in self.channels:
+            if channel.id == channel_id:
+                return channel
+        return None
+
+    def __str__(self):
+        return self.name
+
+class FakeMessage(object):
+    def __init__(self, author, channel, content):
+        self.id = new_id()
+        self.author = author
+        self.channel = channel
+        self.server = channel.server
+        self.content = content if content else ''
+        self.timestamp = datetime.datetime.utcnow()
+        self.edited_timestamp = None
+        self.attachments = []
+
+    @property
+    def clean_content(self):
+        return self.content
+
+class FakeResponse(object):
+    def __init__(self, status, reason, headers=None):
+        self.status = status
+        self.reason = reason
+        self.headers = headers if headers else {}
+
+class FakeClient(object):
+    # latency is (min, max) seconds taken by each API call; rate_limits is ROUTE_LIMITS by default, or None for no limits
+    def __init__(self, latency=(0.0, 0.0), rate_limits=ROUTE_LIMITS, user_name='necrobot'):
+        self.latency = latency
+        self.rate_limits = rate_limits
+        self.user = FakeMember(user_name)
+        self.user.bot = True
+        self.servers = []
+        self.num_calls = collections.Counter()      #route name -> number of calls
+        self.num_rate_limited = 0                   #calls refused with a 429
+        self._route_calls = {}                      #(route name, id) -> deque of the loop times of recent calls
+        self._private_channels = {}                 #member id -> FakePrivateChannel
+        self._message_waiters = []                  #(check, Future) for wait_for_message
+
+    # Register an event handler, as discord.Client.event does
+    def event(self, coro):
+        setattr(self, coro.__name__, coro)
+        return coro
+
+    ##-Setting up---------------------------------------------------
+
+    # Make a server with the given text channels and roles; the bot's user is a member of it
+    def make_server(self, name, channel_names=[], role_names=[]):
+        server = FakeServer(name)
+        for channel_name in channel_names:
+            server.channels.append(FakeChannel(channel_name, server))
+        for role_name in role_names:
+            server.roles.append(FakeRole(role_name))
+        self.user.server = server
+        server.members.append(self.user)
+        self.servers.append(server)
+        return server
+
+    def add_member(self, server, name, role_names=[]):
+        member = FakeMember(name, server, [role for role in server.roles if role.name in role_names])
+        server.members.append(member)
+        return member
+
+    # A message from a user arriving in the channel. Returns the message; it's up to the caller to hand it to the bot.
+    def receive(self, author, channel, content):
+        return self._post(author, channel, content)
+
+    def private_channel(self, member):
+        channel = self._private_channels.get(member.id)
+        if channel is None:
+            channel = FakePrivateChannel(member)
+            self._private_channels[member.id] = channel
+        return channel
+
+    ##-discord.Client API---------------------------------------------
+
+    @asyncio.coroutine
+    def login(self, *args, **kwargs):
+        pass
+
+    @asyncio.coroutine
+    def connect(self):
+        pass
+
+    @asyncio.coroutine
+    def logout(self):
+        pass
+
+    @asyncio.coroutine
+    def close(self):
+        pass
+
+    @asyncio.coroutine
+    def send_message(self, destination, content=None, *, tts=False, embed=None):
+        channel = self._channel_for(destination)
+        yield from self._api_call('send_message', channel.id)
+        return self._post(self.user, channel, content)
+
+    @asyncio.coroutine
+    def send_file(self, destination, fp, *, filename=None, content=None, tts=False):
+        channel = self._channel_for(destination)
+        yield from self._api_call('send_file', channel.id)
+        message = self._post(self.user, channel, content)
+        message.attachments.append({'filename': filename if filename else getattr(fp, 'name', 'file')})
+        return message
+
+    @asyncio.coroutine
+    def edit_message(self, message, new_content=None, *, embed=None):
+        yield from self._api_call('edit_message', message.channel.id)
+        if message not in message.channel.messages:
+            raise discord.NotFound(FakeResponse(404, 'Not Found'), 'Unknown Message')
+        message.content = new_content if new_content else ''
+        message.edited_timestamp = datetime.datetime.utcnow()
+        return message
+
+    @asyncio.coroutine
+    def delete_message(self, message):
+        yield from self._api_call('delete_message', message.channel.id)
+        if message not in message.channel.messages:
+            raise discord.NotFound(FakeResponse(404, 'Not Found'), 'Unknown Message')
+        message.channel.messages.remove(message)
+
+    @asyncio.coroutine
+    def get_message(self, channel, id):
+        yield from self._api_call('get_message', channel.id)
+        for message in channel.messages:
+            if message.id == id:
+                return message
+        raise discord.NotFound(FakeResponse(404, 'Not Found'), 'Unknown Message')
+
+    # Returns a list of up to limit messages, newest first (before: a message or datetime, to page back through history)
+    @asyncio.coroutine
+    def logs_from(self, channel, limit=100, *, before=None, after=None, around=None, reverse=False):
+        yield from self._api_call('logs_from', channel.id)
+        messages = channel.messages
+        if before is not None:
+            if isinstance(before, datetime.datetime):
+                messages = [m for m in messages if m.timestamp < before]
+            else:
+                messages = [m for m in messages if int(m.id) < int(before.id)]
+        page = list(reversed(messages))[:limit]
+        return list(reversed(page)) if reverse else page
+
+    @asyncio.coroutine
+    def edit_channel(self, channel, **options):
+        yield from self._api_call('edit_channel', channel.id)
+        for key in ('name', 'topic', 'position'):
+            if key in options:
+                setattr(channel, key, options[key])
+
+    @asyncio.coroutine
+    def edit_channel_permissions(self, channel, target, overwrite=None, *, allow=None, deny=None):
+        yield from self._api_call('edit_channel_permissions', channel.id)
+        channel.permissions[target.id] = (allow, deny)
+
+    @asyncio.coroutine
+    def delete_channel_permissions(self, channel, target):
+        yield from self._api_call('delete_channel_permissions', channel.id)
+        channel.permissions.pop(target.id, None)
+
+    @asyncio.coroutine
+    def create_channel(self, server, name, *overwrites, type=None):
+        yield from self._api_call('create_channel', server.id)
+        channel = FakeChannel(name, server)
+        server.channels.append(channel)
+        return channel
+
+    @asyncio.coroutine
+    def delete_channel(self, channel):
+        yield from self._api_call('delete_channel', channel.id)
+        if channel in channel.server.channels:
+            channel.server.channels.remove(channel)
+
+    # Waits for the next message (from anyone, the bot included) passing the given tests; returns None on timeout
+    @asyncio.coroutine
+    def wait_for_message(self, timeout=None, *, author=None, channel=None, content=None, check=None):
+        def matches(message):
+            return ((author is None or message.author.id == author.id) and
+                    (channel is None or message.channel.id == channel.id) and
+                    (content is None or message.content == content) and
+                    (check is None or check(message)))
+
+        future = asyncio.Future()
+        waiter = (matches, future)
+        self._message_waiters.append(waiter)
+        try:
+            return (yield from asyncio.wait_for(future, timeout))
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if waiter in self._message_waiters:
+                self._message_waiters.remove(waiter)
+
+    ##-Internals----------------------------------------------------
+
+    def _channel_for(self, destination):
+        if isinstance(destination, FakeMember):
+            return self.private_channel(destination)
+        return destination
+
+    def _post(self, author, channel, content):
+        message = FakeMessage(author, channel, content)
+        channel.messages.append(message)
+        for matches, future in list(self._message_waiters):
+            if not future.done() and matches(message):
+                future.set_result(message)
+        return message
+
+    # Wait out the call's latency, then count it against its route's rate limit
+    @asyncio.coroutine
+    def _api_call(self, route_name, route_id):
+        self.num_calls[route_name] += 1
+        min_latency, max_latency = self.latency
+        if max_latency > 0:
+            yield from asyncio.sleep(random.uniform(min_latency, max_latency))
+
+        if not self.rate_limits or route_name not in self.rate_limits:
+            return
+        max_calls, period = self.rate_limits[route_name]
+        now = asyncio.get_event_loop().time()
+        calls = self._route_calls.setdefault((route_name, route_id), collections.deque())
+        while calls and calls[0] <= now - period:
+            calls.popleft()
+        if len(calls) >= max_calls:
+            self.num_rate_limited += 1
+            retry_after = calls[0] + period - now
+            raise discord.HTTPException(FakeResponse(429, 'Too Many Requests', {'Retry-After': '{0:.3f}'.format(retry_after + 0.001)}),
+                                        {'message': 'You are being rate limited.', 'retry_after': round(retry_after + 0.001, 3)})
+        calls.append(now)
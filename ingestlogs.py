@@ -0,0 +1,19 @@
+## Adds the .log files of closed race rooms (from before the searchable archive existed) to the archive.
+## Usage: python ingestlogs.py [log directory] [week number]
+
+import sys
+
+import config
+
+from archiver import Archiver
+
+config.init('data/bot_config.txt')
+
+def ingest_logs(dirname, week=None):
+    archiver = Archiver(None, config.ARCHIVE_DB_FILENAME, dirname)
+    num_files, num_messages = archiver.ingest_log_dir(dirname, week)
+    print('Ingested {0} messages from {1} log files in {2}.'.format(num_messages, num_files, dirname))
+
+##-------------------------
+
+ingest_logs(sys.argv[1] if len(sys.argv) > 1 else 'logs', int(sys.argv[2]) if len(sys.argv) > 2 else None)
@@ -0,0 +1,64 @@
+## Keeps the scheduler's pending jobs in the database, so that they survive a restart.
+## Jobs are stored by (job type, channel id) with their fire time in seconds since the epoch; the scheduler only
+## reads back the jobs that are due soon, so startup doesn't depend on how many channels or matches there are.
+
+class JobStore(object):
+    def __init__(self, db_connection):
+        self._db_conn = db_connection
+        self.is_new = not self._table_exists()          #True if there was no job table (e.g. first run after an upgrade)
+        if self.is_new:
+            JobStore.make_table(self._db_conn)
+
+    # Creates the job table (also called from dbmake)
+    @staticmethod
+    def make_table(db_conn):
+        db_conn.execute("""CREATE TABLE IF NOT EXISTS scheduled_jobs
+                        (job_type text,
+                        channel_id int,
+                        fire_time real,
+                        PRIMARY KEY (job_type, channel_id) ON CONFLICT REPLACE)""")
+        db_conn.execute("CREATE INDEX IF NOT EXISTS scheduled_jobs_fire_time ON scheduled_jobs (fire_time)")
+        db_conn.commit()
+
+    def _table_exists(self):
+        for row in self._db_conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='scheduled_jobs'"):
+            return True
+        return False
+
+    def save(self, job_type, channel_id, fire_time):
+        params = (job_type, int(channel_id), fire_time,)
+        self._db_conn.execute("INSERT INTO scheduled_jobs (job_type, channel_id, fire_time) VALUES (?,?,?)", params)
+        self._db_conn.commit()
+
+    # Deletes the job; if fire_time is given, only deletes it if it hasn't since been moved to a different time
+    def delete(self, job_type, channel_id, fire_time=None):
+        if fire_time is None:
+            params = (job_type, int(channel_id),)
+            self._db_conn.execute("DELETE FROM scheduled_jobs WHERE job_type=? AND channel_id=?", params)
+        else:
+            params = (job_type, int(channel_id), fire_time,)
+            self._db_conn.execute("DELETE FROM scheduled_jobs WHERE job_type=? AND channel_id=? AND fire_time=?", params)
+        self._db_conn.commit()
+
+    def delete_channel(self, channel_id):
+        params = (int(channel_id),)
+        self._db_conn.execute("DELETE FROM scheduled_jobs WHERE channel_id=?", params)
+        self._db_conn.commit()
+
+    # Returns a list of (job_type, channel_id, fire_time) for the jobs due no later than until (and later than after, if given)
+    def load(self, until, after=None):
+        jobs = []
+        if after is None:
+            params = (until,)
+            rows = self._db_conn.execute("SELECT job_type,channel_id,fire_time FROM scheduled_jobs WHERE fire_time<=? ORDER BY fire_time ASC", params)
+        else:
+            params = (after, until,)
+            rows = self._db_conn.execute("SELECT job_type,channel_id,fire_time FROM scheduled_jobs WHERE fire_time>? AND fire_time<=? ORDER BY fire_time ASC", params)
+        for row in rows:
+            jobs.append((row[0], int(row[1]), float(row[2])))
+        return jobs
+
+    def count(self):
+        for row in self._db_conn.execute("SELECT COUNT(*) FROM scheduled_jobs"):
+            return int(row[0])
+        return 0
@@ -0,0 +1,249 @@
+## Runs the bot against fakediscord for a scripted week of CoNDOR, and reports how fast it handled its commands.
+## The week: the racers register (.stream, .timezone), the week's race rooms are made (.makeweek), every match is
+## suggested and confirmed, every match is started at once (.forcebeginmatch) and raced to the end by its two racers,
+## and the week is closed (.closeweek).
+## Runs in a temporary directory, with a fresh database; the GSheet is replaced by ScriptedSheet.
+## Usage: python loadtest.py [number of matches] [API latency in ms] [nolimits]
+
+import asyncio
+import datetime
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import command
+import config
+import dbmake
+import fakediscord
+
+from condordb import CondorDB
+from condormatch import CondorMatch
+from condormodule import CondorModule
+from loopmonitor import percentile
+from necrobot import Necrobot
+
+WEEK = 1
+COUNTDOWN_LENGTH = 3            # seconds; shorter than in the real config, so that the races don't take all day
+FINALIZE_TIME_SEC = 1
+RACE_TIME = (0.5, 3.0)          # range of seconds a racer takes to .done
+WAIT_TIMEOUT = 120              # seconds to wait for an expected reply before calling the match stuck
+
+# Stands in for CondorSheet: the week's matchups are given up front, and writes to the sheet are only counted
+class ScriptedSheet(object):
+    def __init__(self, condor_db, pairings, latency=0.0):
+        self._db = condor_db
+        self._pairings = pairings               #list of (twitch name, twitch name)
+        self._latency = latency
+        self.num_writes = 0
+
+    @asyncio.coroutine
+    def open(self):
+        yield from asyncio.sleep(self._latency)
+
+    @asyncio.coroutine
+    def get_matches(self, week):
+        yield from asyncio.sleep(self._latency)
+        return [CondorMatch(self._db.get_from_twitch_name(name_1, register=True), self._db.get_from_twitch_name(name_2, register=True), week)
+                for name_1, name_2 in self._pairings]
+
+    @asyncio.coroutine
+    def get_cawmentary(self, match):
+        yield from asyncio.sleep(self._latency)
+        return None
+
+    @asyncio.coroutine
+    def get_showcase_flags(self, week, matches):
+        yield from asyncio.sleep(self._latency)
+        return [False for match in matches]
+
+    @asyncio.coroutine
+    def _write(self, *args):
+        yield from asyncio.sleep(self._latency)
+        self.num_writes += 1
+
+    schedule_match = _write
+    unschedule_match = _write
+    record_match = _write
+    add_cawmentary = _write
+    remove_cawmentary = _write
+
+class LoadTest(object):
+    def __init__(self, num_matches, latency, rate_limits):
+        self.num_matches = num_matches
+        self.client = fakediscord.FakeClient(latency=latency, rate_limits=rate_limits)
+        self.server = self.client.make_server('CoNDOR', [config.MAIN_CHANNEL_NAME, config.ADMIN_CHANNEL_NAME, config.SCHEDULE_CHANNEL_NAME, config.NOTIFICATIONS_CHANNEL_NAME],
+                                              config.ADMIN_ROLE_NAMES)
+        self.admin = self.client.add_member(self.server, 'staff', config.ADMIN_ROLE_NAMES)
+        self.racers = [self.client.add_member(self.server, 'racer{0}'.format(i)) for i in range(2*num_matches)]
+
+        self.db_conn = sqlite3.connect(config.DB_FILENAME)
+        dbmake.make_tables(self.db_conn)
+        pairings = [(self.racers[2*i].name, self.racers[2*i + 1].name) for i in range(num_matches)]
+        self.sheet = ScriptedSheet(CondorDB(self.db_conn), pairings, latency[1])
+
+        self.necrobot = Necrobot(self.client, self.db_conn)
+        self.necrobot.post_login_init(self.server.id)
+        self.condor_module = CondorModule(self.necrobot, self.db_conn, condorsheet=self.sheet)
+        self.necrobot.load_module(self.condor_module)
+
+        self.latencies = {}                     #command name -> list of seconds from the message arriving to it being handled
+        self.phases = []                        #(phase name, seconds)
+        self.num_stuck = 0                      #matches that stopped getting the replies they expected
+
+    def channel(self, name):
+        return self.necrobot.find_channel(name)
+
+    # Sends a command as the given member, and waits until the bot has handled it
+    @asyncio.coroutine
+    def command(self, author, channel, content):
+        start = time.monotonic()
+        cmd = command.Command(self.client.receive(author, channel, content))
+        done = yield from self.necrobot.execute(cmd)
+        if done:
+            yield from asyncio.wait([done])
+        self.latencies.setdefault(cmd.command, []).append(time.monotonic() - start)
+
+    # Waits for a message from the bot in the channel containing any of the given texts, looking first through the
+    # messages from index start on. Returns (message, index of the next message), or (None, None) after WAIT_TIMEOUT.
+    @asyncio.coroutine
+    def wait_for_bot(self, channel, texts, start):
+        def check(message):
+            return message.author.id == self.client.user.id and any(text in message.content for text in texts)
+
+        for index in range(start, len(channel.messages)):
+            if check(channel.messages[index]):
+                return channel.messages[index], index + 1
+        message = yield from self.client.wait_for_message(WAIT_TIMEOUT, channel=channel, check=check)
+        if message is None:
+            return None, None
+        return message, channel.messages.index(message) + 1
+
+    @asyncio.coroutine
+    def phase(self, name, coro):
+        start = time.monotonic()
+        yield from coro
+        self.phases.append((name, time.monotonic() - start))
+        print('{0}: {1:.1f}s'.format(name, self.phases[-1][1]))
+
+    @asyncio.coroutine
+    def run(self):
+        yield from self.necrobot.init_modules()
+        start = time.monotonic()
+        yield from self.phase('register', self.register())
+        yield from self.phase('makeweek', self.command(self.admin, self.channel(config.ADMIN_CHANNEL_NAME), '.makeweek {0}'.format(WEEK)))
+        match_channels = [channel for channel in self.server.channels if self.condor_module.condordb.is_registered_channel(channel.id)]
+        yield from self.phase('schedule', asyncio.gather(*[self.schedule(channel) for channel in match_channels]))
+        yield from self.phase('races', asyncio.gather(*[self.play_match(channel) for channel in match_channels]))
+        yield from self.phase('closeweek', self.command(self.admin, self.channel(config.ADMIN_CHANNEL_NAME), '.closeweek {0}'.format(WEEK)))
+        self.total_time = time.monotonic() - start
+        self.num_match_channels = len(match_channels)
+        self.necrobot.scheduler.stop()
+        self.necrobot.loop_monitor.stop()
+
+    @asyncio.coroutine
+    def register(self):
+        main_channel = self.channel(config.MAIN_CHANNEL_NAME)
+
+        @asyncio.coroutine
+        def register_one(racer):
+            yield from self.command(racer, main_channel, '.stream {0}'.format(racer.name))
+            yield from self.command(racer, main_channel, '.timezone UTC')
+
+        yield from asyncio.gather(*[register_one(racer) for racer in self.racers])
+
+    @asyncio.coroutine
+    def schedule(self, channel):
+        match = self.condor_module.condordb.get_match_from_channel_id(channel.id)
+        racer_1 = self.necrobot.find_member_with_id(int(match.racer_1.discord_id))
+        racer_2 = self.necrobot.find_member_with_id(int(match.racer_2.discord_id))
+        match_time = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        yield from self.command(racer_1, channel, '.suggest {0} {1} {2}:{3:02}'.format(match_time.strftime('%B'), match_time.day, match_time.hour, match_time.minute))
+        yield from self.command(racer_1, channel, '.confirm')
+        yield from self.command(racer_2, channel, '.confirm')
+
+    # Start the match and race it until the bot records it
+    @asyncio.coroutine
+    def play_match(self, channel):
+        match = self.condor_module.condordb.get_match_from_channel_id(channel.id)
+        racers = [self.necrobot.find_member_with_id(int(racer.discord_id)) for racer in match.racers]
+        index = len(channel.messages)
+        yield from self.command(self.admin, channel, '.forcebeginmatch')
+        while True:
+            message, index = yield from self.wait_for_bot(channel, ['Please input the seed', 'Match results recorded.'], index)
+            if message is None:
+                self.num_stuck += 1
+                return
+            if 'Match results recorded.' in message.content:
+                return
+
+            yield from asyncio.gather(*[self.command(racer, channel, '.ready') for racer in racers])
+            message, index = yield from self.wait_for_bot(channel, ['GO!'], index)
+            if message is None:
+                self.num_stuck += 1
+                return
+
+            finish_times = sorted((random.uniform(*RACE_TIME), racer) for racer in racers)
+            race_start = time.monotonic()
+            for finish_time, racer in finish_times:
+                yield from asyncio.sleep(max(0.0, race_start + finish_time - time.monotonic()))
+                yield from self.command(racer, channel, '.done')
+            message, index = yield from self.wait_for_bot(channel, ['has been recorded', 'Race cancelled.'], index)
+            if message is None:
+                self.num_stuck += 1
+                return
+
+    def report(self):
+        all_latencies = sorted(latency for latencies in self.latencies.values() for latency in latencies)
+        print('')
+        print('{0} matches ({1} rooms made) in {2:.1f}s; {3} commands ({4:.1f}/s); {5} matches stuck.'.format(
+            self.num_matches, self.num_match_channels, self.total_time, len(all_latencies), len(all_latencies)/self.total_time, self.num_stuck))
+        print('{0:<18} {1:>6} {2:>9} {3:>9} {4:>9} {5:>9}'.format('command', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+        for name in sorted(self.latencies) + ['(all)']:
+            latencies = sorted(self.latencies[name]) if name in self.latencies else all_latencies
+            print('{0:<18} {1:>6} {2:>9.1f} {3:>9.1f} {4:>9.1f} {5:>9.1f}'.format(
+                name, len(latencies), 1000*percentile(latencies, 50), 1000*percentile(latencies, 95), 1000*percentile(latencies, 99), 1000*latencies[-1]))
+
+        print('')
+        print('API calls: {0} ({1}); {2} answered with a 429 (the bot retried {3}).'.format(
+            sum(self.client.num_calls.values()), ', '.join('{0} {1}'.format(n, route) for route, n in self.client.num_calls.most_common()),
+            self.client.num_rate_limited, self.necrobot.client.scheduler.num_rate_limited))
+        print('GSheet writes: {0}. {1}'.format(self.sheet.num_writes, self.necrobot.supervisor.status_str))
+        for failure in self.necrobot.supervisor.failures:
+            print('  Failed: {0}'.format(failure))
+
+def main(args):
+    num_matches = int(args[0]) if len(args) > 0 else 64
+    latency_ms = float(args[1]) if len(args) > 1 else 50.0
+    rate_limits = None if len(args) > 2 and args[2] == 'nolimits' else fakediscord.ROUTE_LIMITS
+
+    config.init('data/bot_config.txt')
+    config.COUNTDOWN_LENGTH = COUNTDOWN_LENGTH
+    config.INCREMENTAL_COUNTDOWN_START = COUNTDOWN_LENGTH
+    config.FINALIZE_TIME_SEC = FINALIZE_TIME_SEC
+    config.SEASON_YEAR = (datetime.datetime.utcnow() + datetime.timedelta(days=1)).year
+
+    workdir = tempfile.mkdtemp(prefix='condorbot-loadtest-')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        os.mkdir('logs')
+        os.mkdir('data')
+        config.DB_FILENAME = 'data/loadtest.db'
+        config.ARCHIVE_DB_FILENAME = 'data/archive.db'
+
+        loop = asyncio.get_event_loop()
+        load_test = LoadTest(num_matches, (latency_ms/2000, 3*latency_ms/2000), rate_limits)
+        loop.run_until_complete(load_test.run())
+        load_test.report()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+##-------------------------
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,129 @@
+## Watches the event loop for stalls. Everything the bot does (sqlite, gspread, file writes, and the race countdown)
+## runs on the one asyncio loop, so anything that blocks it holds up everything else.
+## A sampler task sleeps for a fixed interval and records how late it wakes up (the loop's scheduling lag). A
+## watchdog thread checks that the sampler keeps ticking; if the loop goes longer than the stall threshold without
+## a tick, the watchdog takes the stack of the loop's thread at that moment (which shows what is blocking it) and
+## prints it. The last few stalls and a window of recent lag samples are kept, for the .looplag admin command.
+
+import asyncio
+import collections
+import datetime
+import logging
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SEC = 5*60               # lag percentiles are over this many seconds of samples
+
+# Returns the given percentile (0-100) of a sorted list
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct/100.0*(len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class Stall(object):
+    def __init__(self, stack):
+        self.time = datetime.datetime.utcnow()
+        self.stack = stack                          #list of formatted stack lines, innermost last
+        self.duration = None                        #seconds; set once the loop gets going again
+
+    def __str__(self):
+        duration = '{0:.0f}ms'.format(1000*self.duration) if self.duration is not None else 'ongoing'
+        return '{0} ({1})'.format(self.time.strftime("%m/%d %H:%M:%S"), duration)
+
+class LoopMonitor(object):
+    MAX_STALLS_KEPT = 20
+
+    # interval and stall_threshold are in seconds
+    def __init__(self, interval, stall_threshold):
+        self._interval = interval
+        self._stall_threshold = stall_threshold
+        self._samples = collections.deque(maxlen=max(1, int(WINDOW_SEC/interval)))     #lag, in seconds
+        self._max_lag = 0.0
+        self._num_stalls = 0
+        self._lock = threading.Lock()               #guards the stalls, which the watchdog thread adds to
+        self.stalls = collections.deque(maxlen=LoopMonitor.MAX_STALLS_KEPT)
+        self._pending_stall = None                  #the stall the loop is in (or just came out of)
+        self._last_tick = time.monotonic()
+        self._tick = 0
+        self._loop_thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    @property
+    def num_stalls(self):
+        return self._num_stalls
+
+    @property
+    def max_lag(self):
+        return self._max_lag
+
+    # (p50, p95, p99, max) of the lag over the window, in seconds
+    @property
+    def lag_percentiles(self):
+        samples = sorted(self._samples)
+        return (percentile(samples, 50), percentile(samples, 95), percentile(samples, 99), samples[-1] if samples else 0.0)
+
+    @property
+    def status_str(self):
+        p50, p95, p99, window_max = self.lag_percentiles
+        return 'Loop lag (last {0} samples): p50 {1:.1f}ms, p95 {2:.1f}ms, p99 {3:.1f}ms, max {4:.1f}ms ({5:.1f}ms since start). {6} stalls over {7:.0f}ms.'.format(
+            len(self._samples), 1000*p50, 1000*p95, 1000*p99, 1000*window_max, 1000*self._max_lag, self._num_stalls, 1000*self._stall_threshold)
+
+    # Start sampling, and the watchdog thread. Call from the loop's thread. Safe to call more than once.
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        if not self._task or self._task.done():
+            self._task = asyncio.ensure_future(self._sample())
+        if not self._watchdog or not self._watchdog.is_alive():
+            self._stopped.clear()
+            self._watchdog = threading.Thread(target=self._watch, name='loop watchdog', daemon=True)
+            self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    @asyncio.coroutine
+    def _sample(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            expected = loop.time() + self._interval
+            yield from asyncio.sleep(self._interval)
+            lag = max(0.0, loop.time() - expected)
+            self._samples.append(lag)
+            self._max_lag = max(self._max_lag, lag)
+            self._last_tick = time.monotonic()
+            self._tick += 1
+            with self._lock:
+                stall, self._pending_stall = self._pending_stall, None
+            if stall:
+                stall.duration = lag
+                logger.warning('Event loop was blocked for %.0fms.', 1000*stall.duration)
+
+    # The watchdog thread: reports the loop's stack once per stall
+    def _watch(self):
+        reported_tick = None
+        while not self._stopped.wait(self._stall_threshold/2):
+            tick = self._tick
+            if tick == reported_tick or time.monotonic() - self._last_tick < self._stall_threshold + self._interval:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stall = Stall(traceback.format_stack(frame))
+            del frame
+            reported_tick = tick
+            with self._lock:
+                self._num_stalls += 1
+                self._pending_stall = stall
+                self.stalls.append(stall)
+            logger.warning('Event loop blocked for over %.0fms, in:\n%s', 1000*self._stall_threshold, ''.join(stall.stack))
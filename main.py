@@ -1,54 +1,36 @@
+import time
+_process_start = time.perf_counter()                                            # for the startup report (see startuptimer.py)
+
 import asyncio
 import discord
 import logging
 import sqlite3
 
+import botlog
 import command
 import config
-import datetime
-import os
+import metrics
 import seedgen
 
 from necrobot import Necrobot
 from condormodule import CondorModule
+from startuptimer import StartupTimer
+
+startup = StartupTimer(_process_start)
+startup.mark('imports')
+
+logger = logging.getLogger(__name__)
 
 class LoginData(object):
     token = ''
     admin_id = None
     server_id = None
 
-##-Logging-------------------------------
-LOG_LEVEL = logging.WARNING
-
-file_format_str = '%b%d'
-utc_today = datetime.datetime.utcnow().date()
-utc_yesterday = utc_today - datetime.timedelta(days=1)
-utc_today_str = utc_today.strftime(file_format_str)
-utc_yesterday_str = utc_yesterday.strftime(file_format_str)
-
-filenames_in_dir = os.listdir('logging')
-
-## get log output filename
-filename_rider = 0
-while True:
-    filename_rider += 1
-    log_output_filename = '{0}-{1}.log'.format(utc_today_str, filename_rider)
-    if not (log_output_filename in filenames_in_dir):
-        break
-log_output_filename = 'logging/{0}'.format(log_output_filename)
-
-## set up logger
-logger = logging.getLogger('discord')
-logger.setLevel(LOG_LEVEL)
-handler = logging.FileHandler(filename=log_output_filename, encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
-##--------------------------------------
-
 #-General init----------------------------------------------------
 config.init('data/bot_config.txt')
+botlog.init(config.LOG_FILENAME, config.LOG_LEVEL, config.LOG_MAX_BYTES, config.LOG_ROTATE_INTERVAL, config.LOG_BACKUP_COUNT)
 client = discord.Client()                                                       # the client for discord
-necrobot = Necrobot(client, sqlite3.connect(config.DB_FILENAME))
+necrobot = Necrobot(client, sqlite3.connect(config.DB_FILENAME), startup)
 seedgen.init_seed()
 
 #-Get login data from file----------------------------------------
@@ -58,23 +40,30 @@ login_data.token = login_info.readline().rstrip('\n')
 login_data.admin_id = login_info.readline().rstrip('\n')
 login_data.server_id = login_info.readline().rstrip('\n')
 login_info.close()
+startup.mark('config')
      
 # Define client events
 @client.event
 @asyncio.coroutine
 def on_ready():
-    print('-Logged in---------------')
-    print('User name: {0}'.format(client.user.name))
-    print('User id  : {0}'.format(client.user.id))
-    print('-------------------------')
-    print(' ')
+    if not necrobot.initialized:
+        startup.mark('connect')
+    logger.info('Logged in as %s (user id %s).', client.user.name, client.user.id)
+
+    # discord calls on_ready again when it reconnects us; the modules are already loaded, so just pick up where we were
+    if necrobot.initialized:
+        yield from necrobot.reconnect()
+        logger.info('...reconnected.')
+        return
+
     necrobot.post_login_init(login_data.server_id, login_data.admin_id)
 
     necrobot.load_module(CondorModule(necrobot, sqlite3.connect(config.DB_FILENAME)))
 
     yield from necrobot.init_modules()
+    startup.mark_ready('modules')
 
-    print('...done.')
+    logger.info('...done.')
 
 @client.event
 @asyncio.coroutine
@@ -87,14 +76,23 @@ def on_message(message):
 def on_member_join(member):
     yield from necrobot.on_member_join(member)
 
+@client.event
+@asyncio.coroutine
+def on_channel_delete(channel):
+    yield from necrobot.on_channel_delete(channel)
+
 #-Run client-------------------------------------------------------
 try:
     loop = asyncio.get_event_loop()
+    if config.METRICS_PORT:
+        loop.run_until_complete(metrics.start_server(config.METRICS_HOST, config.METRICS_PORT))
     loop.run_until_complete(client.login(login_data.token))
+    startup.mark('login')
     loop.run_until_complete(client.connect())
 except Exception as e:
-    print('Exception: {}'.format(e))
+    logger.exception('Exception: %s', e)
     loop.run_until_complete(client.close())
 finally:
     loop.close()
+    botlog.shutdown()
 
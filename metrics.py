@@ -0,0 +1,256 @@
+## Counters, gauges and histograms for the bot process, served in the Prometheus text format (version 0.0.4) from
+## a small HTTP listener, so that the bot can be scraped and graphed from outside.
+## Metrics are kept in one registry for the process. Getting a metric that already exists (e.g. when a second
+## CondorDB is made) returns the existing one. A gauge can be given a function, which is called for its value on
+## each scrape; use this for values the bot already keeps (e.g. the number of race rooms).
+## The listener is off unless metrics_port is set in the config (see main.py); it binds to localhost by default.
+
+import asyncio
+import bisect
+import collections
+import functools
+import inspect
+import logging
+import math
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+REQUEST_TIMEOUT_SEC = 5
+
+logger = logging.getLogger(__name__)
+
+_registry = collections.OrderedDict()       #name -> metric, in the order they were made
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _labels_str(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+class _Metric(object):
+    TYPE = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._children = {}                 #label values -> child
+
+    # The metric for the given label values (in the order the label names were given)
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError('{0} takes labels {1}, but was given {2}.'.format(self.name, self.label_names, values))
+            child = self._new_child()
+            self._children[values] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def _samples(self):
+        raise NotImplementedError()
+
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.help_text.replace('\\', '\\\\').replace('\n', '\\n')),
+                 '# TYPE {0} {1}'.format(self.name, self.TYPE)]
+        for suffix, label_values, extra, value in self._samples():
+            lines.append('{0}{1}{2} {3}'.format(self.name, suffix, _labels_str(self.label_names, label_values, extra), _format_value(value)))
+        return '\n'.join(lines)
+
+class _Value(object):
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+class Counter(_Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _new_child(self):
+        return _Value()
+
+    def _samples(self):
+        for values, child in self._children.items():
+            yield '', values, (), child.value
+
+class Gauge(_Metric):
+    TYPE = 'gauge'
+
+    # fn, if given, is called on each scrape; it returns the value, or (for a gauge with labels) a dict of
+    # label values -> value
+    def __init__(self, name, help_text, labels=(), fn=None):
+        _Metric.__init__(self, name, help_text, labels)
+        self.fn = fn
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def _new_child(self):
+        return _Value()
+
+    def _samples(self):
+        if self.fn is None:
+            for values, child in self._children.items():
+                yield '', values, (), child.value
+            return
+
+        try:
+            result = self.fn()
+        except Exception as e:
+            logger.error('Error reading the gauge %s: %r', self.name, e)
+            return
+        if isinstance(result, dict):
+            for values, value in result.items():
+                yield '', values if isinstance(values, tuple) else (values,), (), value
+        elif result is not None:
+            yield '', (), (), result
+
+class _HistogramValue(object):
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self.counts = [0]*(len(buckets) + 1)    #per bucket, not cumulative; the last is for values over every bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Histogram(_Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        _Metric.__init__(self, name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _samples(self):
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                yield '_bucket', values, (('le', _format_value(bound)),), cumulative
+            yield '_sum', values, (), child.sum
+            yield '_count', values, (), child.count
+
+def _get_or_make(cls, name, *args, **kwargs):
+    metric = _registry.get(name)
+    if metric is None:
+        metric = cls(name, *args, **kwargs)
+        _registry[name] = metric
+    elif not isinstance(metric, cls):
+        raise ValueError('Metric {0} already exists, as a {1}.'.format(name, metric.TYPE))
+    return metric
+
+def counter(name, help_text, labels=()):
+    return _get_or_make(Counter, name, help_text, labels)
+
+# If the gauge already exists, and fn is given, fn replaces its function (so the newest object is the one reported)
+def gauge(name, help_text, labels=(), fn=None):
+    metric = _get_or_make(Gauge, name, help_text, labels, fn)
+    if fn is not None:
+        metric.fn = fn
+    return metric
+
+def histogram(name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+    return _get_or_make(Histogram, name, help_text, labels, buckets)
+
+# Every metric, in the Prometheus text format
+def render():
+    return '\n'.join(metric.render() for metric in _registry.values()) + '\n'
+
+# Time every call of each public method of the class in the histogram, labelled with the method's name.
+# (Calls that a method makes to other public methods are counted too.) Works with coroutine methods.
+def time_methods(cls, histogram):
+    for name, method in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.isfunction(method):
+            continue
+        setattr(cls, name, _timed(method, histogram.labels(name)))
+
+def _timed(method, child):
+    if inspect.isgeneratorfunction(method) or asyncio.iscoroutinefunction(method):
+        @functools.wraps(method)
+        @asyncio.coroutine
+        def timed_coroutine(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return (yield from method(*args, **kwargs))
+            finally:
+                child.observe(time.perf_counter() - start)
+        return timed_coroutine
+
+    @functools.wraps(method)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            child.observe(time.perf_counter() - start)
+    return timed
+
+##-HTTP listener-----------------------------------------------------
+
+# Start serving the metrics at http://host:port/metrics. Returns the asyncio Server.
+@asyncio.coroutine
+def start_server(host, port):
+    server = yield from asyncio.start_server(_handle_request, host, port)
+    logger.info('Serving metrics on http://%s:%s/metrics.', host, port)
+    return server
+
+@asyncio.coroutine
+def _handle_request(reader, writer):
+    try:
+        request_line = yield from asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT_SEC)
+        while True:
+            header = yield from asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT_SEC)
+            if header in (b'\r\n', b'\n', b''):
+                break
+
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] in ('GET', 'HEAD') and parts[1].split('?')[0] in ('/metrics', '/'):
+            status, content_type, body = '200 OK', CONTENT_TYPE, render().encode('utf-8')
+        else:
+            status, content_type, body = '404 Not Found', 'text/plain; charset=utf-8', b'Not found; try /metrics.\n'
+        head = 'HTTP/1.0 {0}\r\nContent-Type: {1}\r\nContent-Length: {2}\r\nConnection: close\r\n\r\n'.format(status, content_type, len(body))
+        writer.write(head.encode('latin-1'))
+        if parts and parts[0] != 'HEAD':
+            writer.write(body)
+        yield from writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
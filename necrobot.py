@@ -1,19 +1,36 @@
 import asyncio
 import discord
+import logging
 import seedgen
 import sqlite3
 import textwrap
+import time
 
 import config
 import command
+import metrics
 
 from adminmodule import AdminModule
+from jobstore import JobStore
+from loopmonitor import LoopMonitor
+from outbound import ScheduledClient
+from scheduler import Scheduler
+from startuptimer import StartupTimer
+from tasksupervisor import TaskSupervisor
+from warmstart import WarmStart
+
+logger = logging.getLogger(__name__)
+
+MESSAGES = metrics.counter('condorbot_messages_total', 'Messages seen by the bot.')
+COMMANDS = metrics.counter('condorbot_commands_total', 'Commands received, by name (unhandled for those no module took).', ['command'])
+COMMAND_SECONDS = metrics.histogram('condorbot_command_seconds', 'Time taken to handle commands (after waiting their turn in the channel), by name.', ['command'])
 
 class Necrobot(object):
 
     ## Barebones constructor
-    def __init__(self, client, db_conn):
-        self.client = client
+    ## startup_timer times the phases of startup (main.py starts it before its imports); one is made if not given
+    def __init__(self, client, db_conn, startup_timer=None):
+        self.client = ScheduledClient(client)                   #all outgoing API calls are rate-limited through this
         self.server = None
         self.prefs = None
         self.modules = []
@@ -22,41 +39,123 @@ class Necrobot(object):
         self._main_channel = None
         self._notifications_channel = None
         self._schedule_channel = None
+        self._admin_channel = None
         self._wants_to_quit = False
+        self._server_id = None
+        self.initialized = False                                #True once the modules have been loaded and initialized
+        self.warm_start = WarmStart(config.WARM_START_FILENAME) if config.WARM_START_FILENAME else None
+        self.warm_snapshot = self.warm_start.load() if self.warm_start else None     #what was saved by the last run, if recent
+        self.startup = startup_timer if startup_timer else StartupTimer()
+        self.supervisor = TaskSupervisor(config.TASK_MAX_CONCURRENT, config.TASK_CHANNEL_QUEUE_SIZE)
+        self.scheduler = Scheduler(self.supervisor, JobStore(db_conn))     #timed jobs (alerts, race starts, etc.), saved to the db
+        self.loop_monitor = LoopMonitor(config.LOOP_LAG_INTERVAL, config.LOOP_STALL_THRESHOLD)
+
+        metrics.gauge('condorbot_scheduled_jobs', 'Timed jobs (alerts, race starts, etc.) waiting to fire.', fn=lambda: self.scheduler.num_jobs)
+        metrics.gauge('condorbot_tasks', 'Bot tasks, by state.', ['state'],
+                      fn=lambda: {'running': self.supervisor.num_running, 'pending': self.supervisor.num_pending})
+        metrics.gauge('condorbot_tasks_failed', 'Bot tasks that raised an error since the bot started.', fn=lambda: self.supervisor.num_failed)
+        metrics.gauge('condorbot_event_loop_lag_seconds', 'Event loop scheduling lag over the last few minutes, by quantile.', ['quantile'],
+                      fn=lambda: dict(zip(('0.5', '0.95', '0.99', '1'), self.loop_monitor.lag_percentiles)))
+        metrics.gauge('condorbot_event_loop_stalls', 'Times the event loop was blocked for longer than the stall threshold since the bot started.',
+                      fn=lambda: self.loop_monitor.num_stalls)
 
     ## Initializes object; call after client has been logged in to discord
     def post_login_init(self, server_id, admin_id=0):
         self.admin_id = admin_id if admin_id else None
-       
+        self._server_id = server_id
+        self._resolve_server()
+        self.load_module(AdminModule(self))
+
+    @asyncio.coroutine
+    def init_modules(self):
+        self.scheduler.start()
+        self.loop_monitor.start()
+        for module in self.modules:
+            yield from module.initialize()
+        self.initialized = True
+        self.save_snapshot()
+
+    ## Pick up where we left off after discord reconnects us (on_ready is called again); the modules are already
+    ## loaded and initialized, so only the server and channel objects need looking up again
+    @asyncio.coroutine
+    def reconnect(self):
+        self._resolve_server()
+        self.scheduler.start()
+        self.loop_monitor.start()
+        for module in self.modules:
+            yield from module.on_reconnect()
+        self.save_snapshot()
+
+    # Finds the server and our channels on it. The ids in the warm-start snapshot are tried first, so that we don't
+    # have to search every channel by name; the names are checked, in case a channel was renamed or replaced.
+    def _resolve_server(self):
         #set up server
         id_is_int = False
         try:
-            server_id_int = int(server_id)
+            server_id_int = int(self._server_id)
             id_is_int = True
         except ValueError:
             id_is_int = False
-            
+
+        self.server = None
         if self.client.servers:
             for s in self.client.servers:
-                if id_is_int and s.id == server_id:
-                    print("Server id: {}".format(s.id))
+                if id_is_int and s.id == self._server_id:
                     self.server = s
-                elif s.name == server_id:
-                    print("Server id: {}".format(s.id))
+                elif s.name == self._server_id:
                     self.server = s
-        else:
-            print('Error: Could not find the server.')
+        if not self.server:
+            logger.critical('Error: Could not find the server.')
             exit(1)
+        logger.info('Server id: %s', self.server.id)
 
-        self._main_channel = self.find_channel(config.MAIN_CHANNEL_NAME)
-        self._notifications_channel = self.find_channel(config.NOTIFICATIONS_CHANNEL_NAME)
-        self._schedule_channel = self.find_channel(config.SCHEDULE_CHANNEL_NAME)
-        self.load_module(AdminModule(self))
+        channel_ids = {}
+        if self.warm_snapshot and self.warm_snapshot.get('server_id') == self.server.id:
+            channel_ids = self.warm_snapshot.get('channels', {})
+        self._main_channel = self._resolve_channel(channel_ids.get('main'), config.MAIN_CHANNEL_NAME)
+        self._notifications_channel = self._resolve_channel(channel_ids.get('notifications'), config.NOTIFICATIONS_CHANNEL_NAME)
+        self._schedule_channel = self._resolve_channel(channel_ids.get('schedule'), config.SCHEDULE_CHANNEL_NAME)
+        self._admin_channel = self._resolve_channel(channel_ids.get('admin'), config.ADMIN_CHANNEL_NAME)
 
-    @asyncio.coroutine
-    def init_modules(self):
+    def _resolve_channel(self, channel_id, channel_name):
+        channel = self.find_channel_with_id(channel_id) if channel_id else None
+        if channel and channel.name == channel_name:
+            return channel
+        return self.find_channel(channel_name)
+
+    ## Warm start (see warmstart.py)
+
+    # The state to save in the warm-start snapshot: our server and channels, how many timed jobs are pending, and
+    # whatever each module wants saved (keyed by the module's class)
+    def snapshot(self):
+        def channel_id(channel):
+            return channel.id if channel else None
+
+        modules = {}
         for module in self.modules:
-            yield from module.initialize()
+            module_snapshot = module.snapshot()
+            if module_snapshot is not None:
+                modules[type(module).__name__] = module_snapshot
+
+        return {'server_id': self.server.id if self.server else None,
+                'channels': {'main': channel_id(self._main_channel),
+                             'notifications': channel_id(self._notifications_channel),
+                             'schedule': channel_id(self._schedule_channel),
+                             'admin': channel_id(self._admin_channel)},
+                'pending_jobs': self.scheduler.num_jobs,
+                'modules': modules}
+
+    # Returns what the module saved in the last run's snapshot, or None
+    def warm_snapshot_for(self, module):
+        if not self.warm_snapshot or self.warm_snapshot.get('server_id') != (self.server.id if self.server else None):
+            return None
+        return self.warm_snapshot.get('modules', {}).get(type(module).__name__)
+
+    # Save the warm-start snapshot; call when something in it changes. Does nothing until the modules are initialized
+    # (so that a start that fails partway doesn't overwrite a good snapshot).
+    def save_snapshot(self):
+        if self.warm_start and self.initialized:
+            self.warm_start.save(self.snapshot())
 
     # Causes the Necrobot to use the given module
     # Doesn't check for duplicates
@@ -83,6 +182,11 @@ class Necrobot(object):
     def schedule_channel(self):
         return self._schedule_channel
 
+    # Return the admin channel
+    @property
+    def admin_channel(self):
+        return self._admin_channel
+
     # Return a list of condor staff
     @property
     def condor_staff(self):
@@ -123,10 +227,9 @@ class Necrobot(object):
         return None
 
     def find_channel_with_id(self, channel_id):
-        for channel in self.server.channels:
-            if int(channel.id) == int(channel_id):
-                return channel
-        return None        
+        if channel_id is None:
+            return None
+        return self.server.get_channel(str(int(channel_id)))
 
     ## Returns a list of all members with a given username (capitalization ignored)
     def find_members(self, username):
@@ -142,20 +245,29 @@ class Necrobot(object):
                 return member
         return None
 
+    ## Returns a dict from (int) member id to member, for looking up many members at once; it's a snapshot, so get a
+    ## new one rather than holding on to it
+    def member_index(self):
+        return {int(member.id): member for member in self.server.members}
+
     ## Log out of discord
     @asyncio.coroutine
     def logout(self):
         self._wants_to_quit = True
+        self.save_snapshot()
         yield from self.client.logout()
 
     ## Reboot our login to discord (log out, but do not set quitting = true)
     @asyncio.coroutine
     def reboot(self):
         self._wants_to_quit = False
+        self.save_snapshot()
         yield from self.client.logout()
 
     @asyncio.coroutine
     def execute(self, cmd):
+        MESSAGES.inc()
+
         # don't care about bad commands
         if cmd.command == None:
             return
@@ -168,9 +280,30 @@ class Necrobot(object):
         if not cmd.is_private and cmd.server != self.server:
             return
 
-        # let each module attempt to handle the command in turn
+        # let each module attempt to handle the command in turn; commands in the same channel are handled
+        # one at a time, in the order received (waits here if that channel already has a full backlog)
+        # returns a Future that is done once the command has been handled
+        return (yield from self.supervisor.submit(cmd.channel.id, self._execute_modules(cmd), name=cmd.command))
+
+    @asyncio.coroutine
+    def _execute_modules(self, cmd):
+        start = time.perf_counter()
+        try:
+            for module in self.modules:
+                yield from module.execute(cmd)
+        finally:
+            # typos and commands in the wrong channel are lumped together, so they don't each get their own metric
+            name = cmd.command if cmd.handled else 'unhandled'
+            COMMANDS.labels(name).inc()
+            COMMAND_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+    ## Let the modules drop anything they had for a deleted channel
+    @asyncio.coroutine
+    def on_channel_delete(self, channel):
+        if channel.server != self.server:
+            return
         for module in self.modules:
-            asyncio.ensure_future(module.execute(cmd))
+            yield from module.on_channel_delete(channel)
 
     ## Send a DM when someone joins
     @asyncio.coroutine
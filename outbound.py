@@ -0,0 +1,246 @@
+## Central scheduler for outgoing Discord API calls.
+## Every call waits for a slot in the rate window for its route (e.g., messages to one channel) and in a global one, so
+## that we stay under Discord's rate limits instead of being told to back off. Waiting calls are released in priority
+## order, so that race countdowns and GO! are never stuck behind topic edits or reminders.
+## If Discord does answer with a 429 anyway, the route is blocked for the time given in the response and the call retried.
+
+import asyncio
+import discord
+import heapq
+import itertools
+import time
+
+import metrics
+
+PRIORITY_RACE = 0               # race countdowns, GO!
+PRIORITY_NORMAL = 1             # replies to user commands
+PRIORITY_BULK = 2               # admin operations on many channels (.makeweek, .closeweek)
+PRIORITY_BACKGROUND = 3         # topic edits, reminders, schedule updates
+
+# (number of calls, per this many seconds) for each kind of call; each channel (or server) gets its own window
+ROUTE_LIMITS = {
+    'send_message':             (5, 5.0),
+    'send_file':                (5, 5.0),
+    'edit_message':             (5, 5.0),
+    'delete_message':           (5, 5.0),
+    'get_message':              (5, 5.0),
+    'logs_from':                (5, 5.0),
+    'edit_channel':             (2, 10.0),
+    'edit_channel_permissions': (5, 5.0),
+    'create_channel':           (5, 5.0),
+    'delete_channel':           (5, 5.0),
+    }
+GLOBAL_LIMIT = (50, 1.0)
+MAX_RETRIES = 3
+
+API_CALLS = metrics.counter('condorbot_discord_api_calls_total', 'Discord API calls made, by route.', ['route'])
+API_CALL_SECONDS = metrics.histogram('condorbot_discord_api_call_seconds', 'Time taken by Discord API calls, by route.', ['route'])
+RATE_LIMIT_WAIT_SECONDS = metrics.histogram('condorbot_discord_rate_limit_wait_seconds', 'Time Discord API calls waited on our rate limits, by route.', ['route'])
+RATE_LIMITED = metrics.counter('condorbot_discord_rate_limited_total', 'Discord API calls answered with a 429, by route.', ['route'])
+
+# Returns the number of seconds a 429 response asks us to wait, or None if it can't be found
+def retry_after_from(http_exception):
+    response = getattr(http_exception, 'response', None)
+    headers = getattr(response, 'headers', None)
+    try:
+        if headers:
+            if 'X-RateLimit-Reset-After' in headers:
+                return float(headers['X-RateLimit-Reset-After'])
+            if 'Retry-After' in headers:
+                return float(headers['Retry-After'])                # seconds (since v6 of the API)
+        body = getattr(http_exception, 'text', None)
+        if isinstance(body, dict) and 'retry_after' in body:
+            return float(body['retry_after'])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+# Lets at most capacity calls go out in any period seconds. Discord counts calls in windows, so a call holds its
+# slot from when it's sent until period seconds after it's answered (by which time discord has surely counted it);
+# unlike a token bucket, this never lets a burst of capacity calls be followed by more in the same window.
+class RateWindow(object):
+    def __init__(self, capacity, period):
+        self._loop = asyncio.get_event_loop()
+        self.capacity = capacity
+        self.period = period
+        self._used = 0                          # slots held by calls in progress, or answered less than period ago
+        self._blocked_until = 0.0               # loop time before which no calls may go out (set by 429s)
+        self._waiters = []                      # heap of (priority, sequence number, Future)
+        self._sequence = itertools.count()
+        self._wakeup_handle = None
+
+    @property
+    def num_waiting(self):
+        return len(self._waiters)
+
+    # True if no slots are held and nobody is waiting (so it can be thrown away)
+    @property
+    def idle(self):
+        return not self._waiters and not self._used and self._loop.time() >= self._blocked_until
+
+    # Wait for a slot. Callers with a lower priority number go first; equal priorities go first-come first-served.
+    # Every acquire must be followed by a release.
+    @asyncio.coroutine
+    def acquire(self, priority):
+        if not self._waiters and self._can_release():
+            self._used += 1
+            return
+
+        future = asyncio.Future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._schedule_wakeup()
+        yield from future
+
+    # Give back a slot once its call has been answered; sent is False if the call never went out (so the slot is
+    # free straight away)
+    def release(self, sent=True):
+        if sent:
+            self._loop.call_later(self.period, self._free)
+        else:
+            self._free()
+
+    # Stop releasing slots for the given number of seconds
+    def block(self, seconds):
+        self._blocked_until = max(self._blocked_until, self._loop.time() + seconds)
+        self._schedule_wakeup()
+
+    def _free(self):
+        self._used -= 1
+        self._wakeup()
+
+    def _can_release(self):
+        return self._used < self.capacity and self._loop.time() >= self._blocked_until
+
+    # Slots coming free wake the waiters themselves; a timer is only needed to wait out a block
+    def _schedule_wakeup(self):
+        if self._wakeup_handle:
+            self._wakeup_handle.cancel()
+            self._wakeup_handle = None
+        if self._waiters and self._loop.time() < self._blocked_until:
+            self._wakeup_handle = self._loop.call_at(self._blocked_until, self._wakeup)
+
+    def _wakeup(self):
+        self._wakeup_handle = None
+        while self._waiters and self._can_release():
+            priority, seq, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._used += 1
+                future.set_result(None)
+        self._schedule_wakeup()
+
+class OutboundScheduler(object):
+    def __init__(self):
+        self._windows = {}
+        self._global_window = RateWindow(*GLOBAL_LIMIT)
+        self.num_calls = 0
+        self.num_rate_limited = 0
+        metrics.gauge('condorbot_discord_api_calls_waiting', 'Discord API calls waiting on our rate limits.', fn=lambda: self.num_waiting)
+
+    @property
+    def num_waiting(self):
+        return self._global_window.num_waiting + sum(w.num_waiting for w in self._windows.values())
+
+    # Make the API call func(*args, **kwargs) once the route's and the global rate limits allow it
+    @asyncio.coroutine
+    def call(self, route, priority, func, *args, **kwargs):
+        window = self._get_window(route)
+        retries = 0
+        while True:
+            start = time.perf_counter()
+            yield from window.acquire(priority)
+            try:
+                yield from self._global_window.acquire(priority)
+            except:
+                window.release(sent=False)
+                raise
+            RATE_LIMIT_WAIT_SECONDS.labels(route[0]).observe(time.perf_counter() - start)
+            self.num_calls += 1
+            API_CALLS.labels(route[0]).inc()
+            start = time.perf_counter()
+            try:
+                return (yield from func(*args, **kwargs))
+            except discord.HTTPException as e:
+                if getattr(e.response, 'status', None) != 429 or retries >= MAX_RETRIES:
+                    raise
+                RATE_LIMITED.labels(route[0]).inc()
+                retries += 1
+                self.num_rate_limited += 1
+                retry_after = retry_after_from(e)
+                window.block(retry_after if retry_after is not None else window.period)
+            finally:
+                API_CALL_SECONDS.labels(route[0]).observe(time.perf_counter() - start)
+                window.release()
+                self._global_window.release()
+
+    def _get_window(self, route):
+        window = self._windows.get(route)
+        if window is None:
+            if len(self._windows) > 1000:
+                self._windows = {key: w for key, w in self._windows.items() if not w.idle}
+            window = RateWindow(*ROUTE_LIMITS[route[0]])
+            self._windows[route] = window
+        return window
+
+# Wraps a discord.Client so that the calls the bot makes go through an OutboundScheduler.
+# Each wrapped method takes an extra keyword argument priority. Anything not wrapped is passed through to the client.
+class ScheduledClient(object):
+    def __init__(self, client, scheduler=None):
+        self._client = client
+        self.scheduler = scheduler if scheduler else OutboundScheduler()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    @property
+    def client(self):
+        return self._client
+
+    @asyncio.coroutine
+    def send_message(self, destination, content=None, *, priority=PRIORITY_NORMAL, **kwargs):
+        return (yield from self.scheduler.call(('send_message', destination.id), priority,
+                                               self._client.send_message, destination, content, **kwargs))
+
+    @asyncio.coroutine
+    def send_file(self, destination, fp, *, priority=PRIORITY_NORMAL, **kwargs):
+        return (yield from self.scheduler.call(('send_file', destination.id), priority,
+                                               self._client.send_file, destination, fp, **kwargs))
+
+    @asyncio.coroutine
+    def edit_message(self, message, new_content, *, priority=PRIORITY_BACKGROUND, **kwargs):
+        return (yield from self.scheduler.call(('edit_message', message.channel.id), priority,
+                                               self._client.edit_message, message, new_content, **kwargs))
+
+    @asyncio.coroutine
+    def delete_message(self, message, *, priority=PRIORITY_BACKGROUND):
+        return (yield from self.scheduler.call(('delete_message', message.channel.id), priority,
+                                               self._client.delete_message, message))
+
+    @asyncio.coroutine
+    def get_message(self, channel, message_id, *, priority=PRIORITY_BACKGROUND):
+        return (yield from self.scheduler.call(('get_message', channel.id), priority,
+                                               self._client.get_message, channel, message_id))
+
+    @asyncio.coroutine
+    def logs_from(self, channel, limit=100, *, priority=PRIORITY_BULK, **kwargs):
+        return (yield from self.scheduler.call(('logs_from', channel.id), priority,
+                                               self._client.logs_from, channel, limit, **kwargs))
+
+    @asyncio.coroutine
+    def edit_channel(self, channel, *, priority=PRIORITY_BACKGROUND, **options):
+        return (yield from self.scheduler.call(('edit_channel', channel.id), priority,
+                                               self._client.edit_channel, channel, **options))
+
+    @asyncio.coroutine
+    def edit_channel_permissions(self, channel, target, *, priority=PRIORITY_BULK, **kwargs):
+        return (yield from self.scheduler.call(('edit_channel_permissions', channel.id), priority,
+                                               self._client.edit_channel_permissions, channel, target, **kwargs))
+
+    @asyncio.coroutine
+    def create_channel(self, server, name, *args, priority=PRIORITY_BULK, **kwargs):
+        return (yield from self.scheduler.call(('create_channel', server.id), priority,
+                                               self._client.create_channel, server, name, *args, **kwargs))
+
+    @asyncio.coroutine
+    def delete_channel(self, channel, *, priority=PRIORITY_BULK):
+        return (yield from self.scheduler.call(('delete_channel', channel.id), priority,
+                                               self._client.delete_channel, channel))
@@ -0,0 +1,195 @@
+## Profiling the running bot, for the .profile and .memsnap admin commands (see adminmodule.py), so that a slow
+## match night can be looked into without restarting or redeploying the bot.
+## Profiler runs either cProfile (exact call counts and times, but it slows the bot down while it runs) or a
+## sampling profiler (a thread that looks at the stack of the event loop's thread every few milliseconds; cheap
+## enough to leave running for a while). MemoryTracer takes tracemalloc snapshots, and reports the top allocation
+## sites and what changed since the previous snapshot.
+## Both produce plain-text reports, which the admin commands upload as files.
+
+import cProfile
+import collections
+import datetime
+import io
+import linecache
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+
+TOP_N = 30                      # number of functions (or allocation sites) in each table of a report
+SAMPLE_INTERVAL_SEC = 0.005
+TRACEMALLOC_FRAMES = 10         # frames kept per allocation by tracemalloc
+
+# A function, as "file:line(name)", with the file relative to the bot's directory where possible
+def function_name(code):
+    filename = code.co_filename
+    if filename.startswith(os.getcwd()):
+        filename = os.path.relpath(filename)
+    return '{0}:{1}({2})'.format(filename, code.co_firstlineno, code.co_name)
+
+# Samples the stack of the given thread from a thread of its own
+class SamplingProfiler(object):
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL_SEC):
+        self._thread_id = thread_id
+        self._interval = interval
+        self._self_counts = collections.Counter()       #function -> samples with it at the top of the stack
+        self._total_counts = collections.Counter()      #function -> samples with it anywhere on the stack
+        self._num_samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            self._num_samples += 1
+            self._self_counts[function_name(frame.f_code)] += 1
+            on_stack = set()
+            while frame is not None:
+                on_stack.add(function_name(frame.f_code))
+                frame = frame.f_back
+            self._total_counts.update(on_stack)
+
+    def report(self):
+        out = io.StringIO()
+        out.write('{0} samples, every {1:.0f}ms. Time spent waiting in the event loop\'s select() is the bot being idle.\n'.format(
+            self._num_samples, 1000*self._interval))
+        for title, counts in (('Most samples at the top of the stack (self time)', self._self_counts),
+                              ('Most samples anywhere on the stack (cumulative time)', self._total_counts)):
+            out.write('\n{0}:\n'.format(title))
+            for name, count in counts.most_common(TOP_N):
+                out.write('{0:>7} {1:>6.1%}  {2}\n'.format(count, count/max(1, self._num_samples), name))
+        return out.getvalue()
+
+# Profiles the event loop's thread with cProfile or the sampling profiler, one run at a time
+class Profiler(object):
+    CPROFILE = 'cprofile'
+    SAMPLE = 'sample'
+
+    def __init__(self):
+        self._mode = None
+        self._cprofile = None
+        self._sampler = None
+        self._started = None
+
+    @property
+    def running(self):
+        return self._mode is not None
+
+    @property
+    def mode(self):
+        return self._mode
+
+    # Seconds since the run started
+    @property
+    def elapsed(self):
+        return (datetime.datetime.utcnow() - self._started).total_seconds() if self._started else 0.0
+
+    # Start a run; call from the event loop's thread (which is the one profiled)
+    def start(self, mode):
+        if self.running:
+            return
+        if mode == Profiler.CPROFILE:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        else:
+            self._sampler = SamplingProfiler(threading.get_ident())
+            self._sampler.start()
+        self._mode = mode
+        self._started = datetime.datetime.utcnow()
+
+    # Stop the run, and return its report
+    def stop(self):
+        if not self.running:
+            return None
+
+        header = 'Profile ({0}) of {1:.1f}s from {2} UTC.\n\n'.format(self._mode, self.elapsed, self._started.strftime("%Y-%m-%d %H:%M:%S"))
+        if self._cprofile:
+            self._cprofile.disable()
+            out = io.StringIO()
+            for sort_key in ('cumulative', 'tottime'):
+                out.write('Top {0} functions by {1}:\n'.format(TOP_N, sort_key))
+                pstats.Stats(self._cprofile, stream=out).strip_dirs().sort_stats(sort_key).print_stats(TOP_N)
+            report = out.getvalue()
+        else:
+            self._sampler.stop()
+            report = self._sampler.report()
+
+        self._mode = None
+        self._cprofile = None
+        self._sampler = None
+        self._started = None
+        return header + report
+
+# Allocation tracing with tracemalloc. Tracing has a cost, so it only runs between start() and stop().
+class MemoryTracer(object):
+    def __init__(self):
+        self._last_snapshot = None
+        self._last_snapshot_time = None
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self._last_snapshot = self._take_snapshot()
+        self._last_snapshot_time = datetime.datetime.utcnow()
+
+    def stop(self):
+        tracemalloc.stop()
+        self._last_snapshot = None
+        self._last_snapshot_time = None
+
+    # Take a snapshot, and return a report of its top allocation sites and the change since the previous snapshot
+    def snapshot(self):
+        snapshot = self._take_snapshot()
+        now = datetime.datetime.utcnow()
+        current, peak = tracemalloc.get_traced_memory()
+        out = io.StringIO()
+        out.write('Memory snapshot at {0} UTC: {1:,} bytes traced ({2:,} at peak), {3:,} bytes used by tracemalloc itself.\n'.format(
+            now.strftime("%Y-%m-%d %H:%M:%S"), current, peak, tracemalloc.get_tracemalloc_memory()))
+
+        out.write('\nTop {0} allocation sites:\n'.format(TOP_N))
+        for stat in snapshot.statistics('lineno')[:TOP_N]:
+            out.write('{0:>12,} bytes {1:>9,} blocks  {2}\n'.format(stat.size, stat.count, MemoryTracer._where(stat.traceback)))
+
+        if self._last_snapshot:
+            out.write('\nTop {0} changes since {1} UTC:\n'.format(TOP_N, self._last_snapshot_time.strftime("%Y-%m-%d %H:%M:%S")))
+            for stat in snapshot.compare_to(self._last_snapshot, 'lineno')[:TOP_N]:
+                out.write('{0:>+12,} bytes {1:>+9,} blocks  {2}\n'.format(stat.size_diff, stat.count_diff, MemoryTracer._where(stat.traceback)))
+
+        out.write('\nTop {0} allocation sites with their callers:\n'.format(min(TOP_N, 10)))
+        for stat in snapshot.statistics('traceback')[:min(TOP_N, 10)]:
+            out.write('\n{0:,} bytes in {1:,} blocks\n'.format(stat.size, stat.count))
+            for line in stat.traceback.format(most_recent_first=True):
+                out.write(line + '\n')
+
+        self._last_snapshot = snapshot
+        self._last_snapshot_time = now
+        return out.getvalue()
+
+    # Leaves out the allocations made by tracemalloc and the profilers themselves
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, __file__),
+            ))
+
+    @staticmethod
+    def _where(traceback):
+        frame = traceback[0]
+        filename = os.path.relpath(frame.filename) if frame.filename.startswith(os.getcwd()) else frame.filename
+        return '{0}:{1}'.format(filename, frame.lineno)
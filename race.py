@@ -1,19 +1,27 @@
-#TODO intelligent handling of rate limiting
 #TODO mod options for races (assist in cleanup)
 
 ## Handles bot actions for a single race room
 
 import asyncio
+import bisect
+import botlog
 import config
-import datetime
 import discord
+import itertools
+import logging
+import outbound
 import racetime
 import sqlite3
 import time
 import pytz
+import racejournal
 
+from raceclock import RaceClock
 from raceinfo import RaceInfo
 from racer import Racer
+from racer import RacerStatus
+
+logger = logging.getLogger(__name__)
 
 RaceStatus = {'uninitialized':0, 'entry_open':1, 'counting_down':2, 'racing':3, 'paused':4, 'completed':5, 'finalized':6, 'cancelled':7}
 StatusStrs = {'0':'Not initialized.', '1':'Waiting for racers to `.ready`.', '2':'Starting!', '3':'In progress!', '4':'Paused!', '5':'Complete.', '6':'Results Finalized.', '7':'Race Cancelled.'}
@@ -29,20 +37,27 @@ def status_str(race_status):
 
 class Race(object):
 
-    # NB: Call the coroutine initialize() to set up the room
-    def __init__(self, race_room, race_info):
+    # NB: Call the coroutine initialize() to set up the room (or replay() and then resume(), to rebuild it after a restart)
+    # journal is the room's racejournal.ChannelJournal, if its events should be saved
+    def __init__(self, race_room, race_info, journal=None):
         self.room = race_room
+        self._journal = journal
         self.race_info = race_info                  #Information on the type of race (e.g. seeded, seed, character) -- see RaceInfo for details
         self.racers = dict()                        #a dictionary of racers indexed by user id
+        self._num_ready = 0                         #number of racers in the 'ready' state
+        self._num_finished = 0                      #number of racers in the 'finished' state
+        self._finish_order = []                     #(time, entry number, racer id) for each finished racer, kept sorted
+        self._entry_numbers = dict()                #racer id -> order in which they entered, to break ties in the standings
+        self._entry_count = itertools.count()
+        self._leaderboard_text = None               #the rendered leaderboard, or None if something changed since
+        self._leaderboard_status = None             #the race status the leaderboard was rendered with
         self._status = RaceStatus['uninitialized']  #see RaceStatus
 
         self.no_entrants_time = None                #whenever there becomes zero entrance for the race, the time is stored here; used for cleanup code
         self._countdown = int(0)                    #the current countdown (TODO: is this the right implementation? unclear what is best)
-        self._start_time = float(0)                 #system clock time for the beginning of the race (but is modified by pause())
-        self._start_datetime = None                 #UTC time for the beginning of the race
-        self._pause_time = float(0)                 #system clock time for last time we called pause()
+        self.clock = RaceClock()                    #times the race (see raceclock.py)
 
-        self._countdown_future = None               #The Future object for the race countdown
+        self._countdown_handles = []                #TimerHandles for the countdown messages and the race start that haven't fired yet
         self._finalize_future = None                #The Future object for the finalization countdown
 
     # Sets up the leaderboard, etc., for the race
@@ -52,42 +67,89 @@ class Race(object):
             return
 
         self._status = RaceStatus['entry_open'] 
-        self.no_entrants_time = time.clock()
+        self.no_entrants_time = time.monotonic()
+        self._record(racejournal.NEW_RACE, value=self.race_info.seed)
 ##        yield from self.room.write('Enter the race with `.enter`, and type `.ready` when ready. Finish the race with `.done` or `.forfeit`. Use `.help` for a command list.')
 
+    def _record(self, event, racer_id=None, value=None):
+        if self._journal:
+            self._journal.record(event, racer_id, value)
+
+    # The room's channel and match, for log records (see botlog.py)
+    def _log_context(self):
+        return botlog.context(channel=self.room.channel, match=self.room.match)
+
     # Returns the race start datetime (UTC)
     @property
     def start_time(self):
-        if self._start_datetime:
-            return pytz.utc.localize(self._start_datetime)
+        start_datetime = self.clock.start_datetime
+        if start_datetime:
+            return pytz.utc.localize(start_datetime)
         else:
             return None
                     
-    # Returns a list of racers and their statuses.
+    # Returns a list of racers and their statuses. The text is kept until a racer or the race status changes.
     @property
     def leaderboard(self):
-        racer_list = []
+        if self._leaderboard_text is None or self._leaderboard_status != self._status:
+            self._leaderboard_text = self._render_leaderboard()
+            self._leaderboard_status = self._status
+        return self._leaderboard_text
+
+    def _render_leaderboard(self):
         max_name_len = 0
-        max_time = 0
-        for r_id in self.racers:
-            racer = self.racers[r_id]
+        for racer in self.racers.values():
             max_name_len = max(max_name_len, len(racer.name))
-            racer_list.append(racer)
-            if racer.is_finished:
-                max_time = max(racer.time, max_time)
-        max_time += 1
 
-        #Sort racers: (1) Finished racers, by time; (2) Forfeit racers; (3) Racers still racing
-        racer_list.sort(key=lambda r: r.time if r.is_finished else (max_time if r.is_forfeit else max_time+1))
+        #Racers in order: (1) Finished racers, by time; (2) Forfeit racers; (3) Racers still racing
+        racer_list = self._finished_racers()
+        racer_list.extend(racer for racer in self.racers.values() if racer.is_forfeit)
+        racer_list.extend(racer for racer in self.racers.values() if not racer.is_finished and not racer.is_forfeit)
 
-        text = self.race_info.seed_str() + '\n'
-        text += status_str(self._status) + '\n'
-        rank = int(0)
-        for racer in racer_list:
-            rank += 1
+        lines = [self.race_info.seed_str(), status_str(self._status)]
+        for rank, racer in enumerate(racer_list, 1):
             rank_str = '{0: >4} '.format(str(rank) + '.' if racer.is_finished else ' ')
-            text += (rank_str + racer.name + (' ' * (max_name_len - len(racer.name))) + ' --- ' + racer.status_str + '\n')
-        return text
+            lines.append(rank_str + racer.name + (' ' * (max_name_len - len(racer.name))) + ' --- ' + racer.status_str)
+        lines.append('')
+        return '\n'.join(lines)
+
+    # The finished racers, by time
+    def _finished_racers(self):
+        return [self.racers[racer_id] for finish_time, entry_number, racer_id in self._finish_order]
+
+    def _add_racer(self, racer_member):
+        racer = Racer(racer_member, self._on_racer_change)
+        self.racers[racer_member.id] = racer
+        self._entry_numbers[racer_member.id] = next(self._entry_count)
+        self._leaderboard_text = None
+        return racer
+
+    def _remove_racer(self, racer_id):
+        racer = self.racers.pop(racer_id, None)
+        if racer:
+            if racer.is_ready:
+                self._num_ready -= 1
+            if racer.is_finished:
+                self._num_finished -= 1
+                self._finish_order = [entry for entry in self._finish_order if entry[2] != racer_id]
+            del self._entry_numbers[racer_id]
+            self._leaderboard_text = None
+
+    # Called by our Racers whenever one of them changes (see racer.py)
+    def _on_racer_change(self, racer, old_state):
+        if old_state != racer.state:
+            if old_state == RacerStatus['ready']:
+                self._num_ready -= 1
+            elif racer.is_ready:
+                self._num_ready += 1
+
+            if old_state == RacerStatus['finished']:
+                self._num_finished -= 1
+                self._finish_order = [entry for entry in self._finish_order if entry[2] != racer.id]
+            elif racer.is_finished:
+                self._num_finished += 1
+                bisect.insort(self._finish_order, (racer.time, self._entry_numbers[racer.id], racer.id))
+        self._leaderboard_text = None
 
     # True if the given racer is entered in the race
     def has_racer(self, racer_usr):
@@ -103,30 +165,20 @@ class Race(object):
     # Returns the current time elapsed as a string "[m]m:ss.hh"
     @property
     def current_time_str(self):
-        if self._status == RaceStatus['paused']:
-            return racetime.to_str( int(100*(self._pause_time - self._start_time)) )
-        elif self._status == RaceStatus['racing']:
-            return racetime.to_str( int(100*(time.clock() - self._start_time)) )
+        if self._status == RaceStatus['paused'] or self._status == RaceStatus['racing']:
+            return racetime.to_str(self.clock.elapsed())
         else:
             return ''
 
     # Returns the number of racers not in the 'ready' state
     @property
     def num_not_ready(self):
-        num = 0
-        for r_name in self.racers:
-            if not self.racers[r_name].is_ready:
-                num += 1
-        return num
+        return len(self.racers) - self._num_ready
 
     # Return the number of racers in the 'finished' state
     @property
     def num_finished(self):
-        num = 0
-        for r_name in self.racers:
-            if self.racers[r_name].is_finished:
-                num += 1
-        return num        
+        return self._num_finished
 
     @property
     def entry_open(self):
@@ -147,16 +199,18 @@ class Race(object):
     def begin_race_countdown(self):
         if self._status == RaceStatus['entry_open']:
             self._status = RaceStatus['counting_down']
-            self._countdown_future = asyncio.ensure_future(self._race_countdown())
-            asyncio.ensure_future(self.room.update_leaderboard())
+            self._record(racejournal.COUNTDOWN)
+            self._schedule_countdown()
+            self.room.request_leaderboard_update()
 
     @asyncio.coroutine
     # Pause the race timer. 
     def pause(self):
         if self._status == RaceStatus['racing']:
             self._status = RaceStatus['paused']
-            self._pause_time = time.clock()
-            asyncio.ensure_future(self.room.update_leaderboard())
+            self.clock.pause()
+            self._record(racejournal.PAUSE)
+            self.room.request_leaderboard_update()
             return True
         return False
     
@@ -165,23 +219,38 @@ class Race(object):
     def unpause(self):
         if self._status == RaceStatus['paused']:
             self._status = RaceStatus['racing']
-            self._start_time += time.clock() - self._pause_time
-            asyncio.ensure_future(self.room.update_leaderboard())
+            self.clock.unpause()
+            self._record(racejournal.UNPAUSE)
+            self.room.request_leaderboard_update()
             return True
         return False
     
-    # Begins the race. Called by the countdown.
-    @asyncio.coroutine
+    # Begins the race. Called by the countdown, exactly when the countdown reaches zero. The GO! message is sent
+    # without waiting for it; once it's out, the race clock is anchored to its timestamp.
     def _begin_race(self):
+        self._countdown_handles = []
+        if self._status != RaceStatus['counting_down']:
+            return
+
         for r_id in self.racers:
             if not self.racers[r_id].begin_race():
-                print("{} isn't ready while calling race.begin_race -- unexpected error.".format(racer.name))
+                logger.error("%s isn't ready while calling race.begin_race -- unexpected error.", self.racers[r_id].name, extra=self._log_context())
 
-        self._start_time = time.clock()
-        self._start_datetime = datetime.datetime.utcnow()
-        yield from self.room.write('GO!')
+        self.clock.start()
         self._status = RaceStatus['racing']
-        asyncio.ensure_future(self.room.update_leaderboard())
+        self._record(racejournal.START, value=self.clock.start_epoch)
+        go_future = asyncio.ensure_future(self.room.write('GO!', priority=outbound.PRIORITY_RACE))
+        go_future.add_done_callback(self._on_go_sent)
+        self.room.request_leaderboard_update()
+
+    def _on_go_sent(self, go_future):
+        if go_future.cancelled():
+            return
+        if go_future.exception():
+            logger.error('Error sending GO! in channel %s: %r', self.room.channel.name, go_future.exception(), extra=self._log_context())
+        elif go_future.result():
+            self.clock.anchor(go_future.result().timestamp)
+            self._record(racejournal.ANCHOR, value=self.clock.start_epoch)
 
     # Checks to see if any racer has either finished or forfeited. If so, ends the race.
     # Return True if race was ended.
@@ -199,34 +268,37 @@ class Race(object):
     def _end_race(self):
         if self._status == RaceStatus['racing']:
             self._status = RaceStatus['completed']
+            self._record(racejournal.END)
             self._finalize_future = asyncio.ensure_future(self._finalization_countdown())
 
-    # Countdown coroutine to be wrapped in self._countdown_future.
-    # Warning: Do not call this -- use begin_countdown instead.
-    @asyncio.coroutine
-    def _race_countdown(self):
-        countdown_timer = config.COUNTDOWN_LENGTH
-        yield from asyncio.sleep(1) #Pause before countdown
-        
-        yield from self.room.write('The race will begin in {0} seconds.'.format(countdown_timer))
-        while countdown_timer > 0:
-            if countdown_timer <= config.INCREMENTAL_COUNTDOWN_START:
-                yield from self.room.write('{}'.format(countdown_timer))
-            yield from asyncio.sleep(1) #sleep for a second
-            countdown_timer -= 1
-
-        #Begin the race. At this point, ignore cancel() requests
-        try:
-            yield from self._begin_race()
-        except CancelledError:
-            if self._status != RaceStatus['racing']:
-                yield from self._begin_race()
+    # Schedules the countdown messages and the race start against fixed times on the loop's (monotonic) clock, so that
+    # slow message sends can't make the countdown drift. Warning: Do not call this -- use begin_race_countdown instead.
+    def _schedule_countdown(self):
+        loop = asyncio.get_event_loop()
+        countdown_start = loop.time() + 1                       #Pause before countdown
+        go_time = countdown_start + config.COUNTDOWN_LENGTH
+
+        self._countdown_handles = [loop.call_at(countdown_start, self._send_countdown_message, 'The race will begin in {0} seconds.'.format(config.COUNTDOWN_LENGTH))]
+        for seconds_left in range(min(config.INCREMENTAL_COUNTDOWN_START, config.COUNTDOWN_LENGTH), 0, -1):
+            self._countdown_handles.append(loop.call_at(go_time - seconds_left, self._send_countdown_message, '{}'.format(seconds_left)))
+        self._countdown_handles.append(loop.call_at(go_time, self._begin_race))
+
+    def _send_countdown_message(self, text):
+        # the handles fire in the order they were made, so this one is first in the list; it's done, so drop it
+        if self._countdown_handles:
+            self._countdown_handles.pop(0)
+        future = asyncio.ensure_future(self.room.write(text, priority=outbound.PRIORITY_RACE))
+        future.add_done_callback(self._on_countdown_message_sent)
+
+    def _on_countdown_message_sent(self, future):
+        if not future.cancelled() and future.exception():
+            logger.error('Error sending countdown in channel %s: %r', self.room.channel.name, future.exception(), extra=self._log_context())
 
     # Countdown coroutine to be wrapped in self._finalize_future.
     # Warning: Do not call this -- use end_race instead.
     @asyncio.coroutine
     def _finalization_countdown(self):
-        asyncio.ensure_future(self.room.update_leaderboard())
+        self.room.request_leaderboard_update()
 
         yield from asyncio.sleep(1) # Waiting for a short time feels good UI-wise
         yield from self.room.write('The race will end in {} seconds.'.format(config.FINALIZE_TIME_SEC))
@@ -237,6 +309,7 @@ class Race(object):
     @asyncio.coroutine
     def _finalize_race(self):
         self._status = RaceStatus['finalized'] if self.num_finished else RaceStatus['cancelled']
+        self._record(racejournal.FINALIZE if self._status == RaceStatus['finalized'] else racejournal.CANCEL)
         yield from self.room.record_race()
 
     # Attempt to cancel the race countdown -- transition race state from 'counting_down' to 'entry_open'
@@ -244,16 +317,15 @@ class Race(object):
     @asyncio.coroutine
     def cancel_countdown(self, display_msgs=True):
         if self._status == RaceStatus['counting_down']:
-            if self._countdown_future:
-                if self._countdown_future.cancel():
-                    self._countdown_future = None
-                    self._status = RaceStatus['entry_open']
-                    asyncio.ensure_future(self.room.update_leaderboard())
-                    if display_msgs:
-                        yield from self.room.write('Countdown cancelled.')
-                    return True
-                else:
-                    return False
+            # the race start runs synchronously on the loop, so if we're still counting down it can always be cancelled
+            for handle in self._countdown_handles:
+                handle.cancel()
+            self._countdown_handles = []
+            self._status = RaceStatus['entry_open']
+            self._record(racejournal.CANCEL_COUNTDOWN)
+            self.room.request_leaderboard_update()
+            if display_msgs:
+                yield from self.room.write('Countdown cancelled.')
         return True
 
     # Attempt to cancel finalization and restart race -- transition race state from 'completed' to 'racing'
@@ -265,7 +337,8 @@ class Race(object):
                 if self._finalize_future.cancel():
                     self._finalize_future = None
                     self._status = RaceStatus['racing']
-                    asyncio.ensure_future(self.room.update_leaderboard())
+                    self._record(racejournal.CANCEL_END)
+                    self.room.request_leaderboard_update()
                     if display_msgs:
                         yield from self.room.write('Race end cancelled -- unfinished racers may continue!')
                     return True
@@ -277,9 +350,9 @@ class Race(object):
     @asyncio.coroutine
     def enter_racer(self, racer_member):
         if self._status == RaceStatus['entry_open'] and not self.has_racer(racer_member):
-            racer = Racer(racer_member)
-            self.racers[racer_member.id] = racer
-            asyncio.ensure_future(self.room.update_leaderboard())
+            self._add_racer(racer_member)
+            self._record(racejournal.ENTER, racer_member.id)
+            self.room.request_leaderboard_update()
             return True
         else:
             return False
@@ -288,10 +361,11 @@ class Race(object):
     @asyncio.coroutine
     def unenter_racer(self, racer_member):
         if self.has_racer(racer_member):
-            del self.racers[racer_member.id]
-            asyncio.ensure_future(self.room.update_leaderboard())
+            self._remove_racer(racer_member.id)
+            self._record(racejournal.UNENTER, racer_member.id)
+            self.room.request_leaderboard_update()
             if not self.racers:
-                self.no_entrants_time = time.clock()
+                self.no_entrants_time = time.monotonic()
             if (len(self.racers) < 2 and config.REQUIRE_AT_LEAST_TWO_FOR_RACE) or len(self.racers) < 1:
                 yield from self.cancel_countdown() #TODO: implement correct behavior if this fails
             return True
@@ -302,7 +376,8 @@ class Race(object):
     @asyncio.coroutine
     def ready_racer(self, racer):
         if racer.ready():
-            asyncio.ensure_future(self.room.update_leaderboard())
+            self._record(racejournal.READY, racer.id)
+            self.room.request_leaderboard_update()
             return True
         else:
             return False
@@ -314,21 +389,24 @@ class Race(object):
         # then there is a countdown and we failed to cancel it, so racer cannot be made unready.
         success = yield from self.cancel_countdown()
         if success and racer.unready(): 
-            asyncio.ensure_future(self.room.update_leaderboard())
+            self._record(racejournal.UNREADY, racer.id)
+            self.room.request_leaderboard_update()
             return True
         else:
             return False
 
-    # Puts the given Racer in the 'finished' state and gets their time
+    # Puts the given Racer in the 'finished' state and gets their time.
+    # timestamp is the time of the racer's message (their time is measured up to then), if there is one.
     @asyncio.coroutine
-    def finish_racer(self, racer):
+    def finish_racer(self, racer, timestamp=None):
         if self.is_before_race:
             return False
         
-        finish_time = int(100*(time.clock() - self._start_time))
+        finish_time = self.clock.elapsed_at(timestamp)
         if racer and racer.finish(finish_time):
-            asyncio.ensure_future(self._check_for_race_end())
-            asyncio.ensure_future(self.room.update_leaderboard())
+            self._record(racejournal.FINISH, racer.id, finish_time)
+            yield from self._check_for_race_end()
+            self.room.request_leaderboard_update()
             return True
         return False
 
@@ -342,17 +420,19 @@ class Race(object):
         # then there is a finalization and we failed to cancel it, so racer cannot be made unready.
         success = yield from self.cancel_finalization()
         if success and racer and racer.unfinish():
-            asyncio.ensure_future(self.room.update_leaderboard())
+            self._record(racejournal.UNFINISH, racer.id)
+            self.room.request_leaderboard_update()
             return True
         return False
 
-    # Puts the given Racer in the 'forfeit' state
+    # Puts the given Racer in the 'forfeit' state (timestamp as in finish_racer)
     @asyncio.coroutine
-    def forfeit_racer(self, racer):
-        forfeit_time = int(100*(time.clock() - self._start_time))
+    def forfeit_racer(self, racer, timestamp=None):
+        forfeit_time = self.clock.elapsed_at(timestamp)
         if racer and racer.forfeit(forfeit_time):
-            asyncio.ensure_future(self._check_for_race_end())
-            asyncio.ensure_future(self.room.update_leaderboard())
+            self._record(racejournal.FORFEIT, racer.id, forfeit_time)
+            yield from self._check_for_race_end()
+            self.room.request_leaderboard_update()
             return True
         return False
 
@@ -366,31 +446,117 @@ class Race(object):
         # then there is a finalization and we failed to cancel it, so racer cannot be made unready.
         success = yield from self.cancel_finalization()
         if success and racer and racer.unforfeit():
-            asyncio.ensure_future(self.room.update_leaderboard())
+            self._record(racejournal.UNFORFEIT, racer.id)
+            self.room.request_leaderboard_update()
             return True
         return False
 
     # List the racers in order of finish time
     @property
     def racer_list(self):
-        r_list = []
-        max_time = 0
-        for r_id in self.racers:
-            racer = self.racers[r_id]
-            r_list.append(racer)
-            if racer.is_finished:
-                max_time = max(racer.time, max_time)
-        max_time += 1
-
-        r_list.sort(key=lambda r: r.time if r.is_finished else max_time)
+        r_list = self._finished_racers()
+        r_list.extend(racer for racer in self.racers.values() if not racer.is_finished)
         return r_list
 
+    # Rebuild the race from the events of its journal (see racejournal.py) after a restart. find_member is a function
+    # returning the discord Member with a given id (or None). Nothing is sent or recorded; call resume() afterwards.
+    def replay(self, events, find_member):
+        start_epoch = None
+        anchored = False
+        paused_total = 0.0
+        paused_since = None
+        for e in events:
+            racer = self.racers.get(str(e.racer_id)) if e.racer_id is not None else None
+            if e.event == racejournal.NEW_RACE:
+                if e.value is not None:
+                    self.race_info.seed = int(e.value)
+                self._status = RaceStatus['entry_open']
+            elif e.event == racejournal.ENTER:
+                member = find_member(e.racer_id)
+                if member:
+                    self._add_racer(member)
+            elif e.event == racejournal.UNENTER:
+                self._remove_racer(str(e.racer_id))
+            elif e.event == racejournal.READY and racer:
+                racer.ready()
+            elif e.event == racejournal.UNREADY and racer:
+                racer.unready()
+            elif e.event == racejournal.COUNTDOWN:
+                self._status = RaceStatus['counting_down']
+            elif e.event == racejournal.CANCEL_COUNTDOWN:
+                self._status = RaceStatus['entry_open']
+            elif e.event == racejournal.START:
+                for r in self.racers.values():
+                    r.begin_race()
+                start_epoch = e.value
+                self._status = RaceStatus['racing']
+            elif e.event == racejournal.ANCHOR:
+                start_epoch = e.value
+                anchored = True
+            elif e.event == racejournal.PAUSE:
+                paused_since = e.wall_time
+                self._status = RaceStatus['paused']
+            elif e.event == racejournal.UNPAUSE:
+                if paused_since is not None:
+                    paused_total += e.wall_time - paused_since
+                paused_since = None
+                self._status = RaceStatus['racing']
+            elif e.event == racejournal.FINISH and racer:
+                racer.finish(int(e.value))
+            elif e.event == racejournal.UNFINISH and racer:
+                racer.unfinish()
+            elif e.event == racejournal.FORFEIT and racer:
+                racer.forfeit(int(e.value))
+            elif e.event == racejournal.UNFORFEIT and racer:
+                racer.unforfeit()
+            elif e.event == racejournal.END:
+                self._status = RaceStatus['completed']
+            elif e.event == racejournal.CANCEL_END:
+                self._status = RaceStatus['racing']
+            elif e.event == racejournal.FINALIZE:
+                self._status = RaceStatus['finalized']
+            elif e.event == racejournal.CANCEL:
+                self._status = RaceStatus['cancelled']
+
+        if start_epoch is not None:
+            self.clock.restore(start_epoch, anchored, paused_total, paused_since)
+        self._leaderboard_text = None
+
+    # Carry on from where a replayed race was: restart a countdown or finalization that was under way, and record the
+    # race if it was over but not yet recorded
+    @asyncio.coroutine
+    def resume(self):
+        if self._status == RaceStatus['counting_down']:
+            self._schedule_countdown()
+        elif self._status == RaceStatus['completed']:
+            self._finalize_future = asyncio.ensure_future(self._finalization_countdown())
+        elif self._status == RaceStatus['finalized']:
+            yield from self.room.record_race()
+        elif self._status == RaceStatus['cancelled']:
+            yield from self.room.record_race(cancelled=True)
+
+    # Cancel the countdown and finalization timers without changing the race's state, e.g. because its room is
+    # being closed (the journal still has the race, should the room be reopened)
+    def stop(self):
+        for handle in self._countdown_handles:
+            handle.cancel()
+        self._countdown_handles = []
+        if self._finalize_future:
+            self._finalize_future.cancel()
+            self._finalize_future = None
+
+    # Number of countdown and finalization timers pending
+    @property
+    def num_timers(self):
+        return len(self._countdown_handles) + (1 if self._finalize_future and not self._finalize_future.done() else 0)
+
     # Cancel the race.
     @asyncio.coroutine
     def cancel(self):
         asyncio.ensure_future(self.cancel_countdown())
         yield from self.cancel_finalization()
         self._status = RaceStatus['cancelled']
+        self._record(racejournal.CANCEL)
 
 ##    # Reset the race.
 ##    @asyncio.coroutine
@@ -399,7 +565,7 @@ class Race(object):
 ##        success = yield from self.cancel_finalization()
 ##        self._status = RaceStatus['entry_open']
 ##        self.racers = []
-##        self.no_entrants_time = time.clock()
+##        self.no_entrants_time = time.monotonic()
 ##        yield from self.room.write('The race has been reset.')
 ##        asyncio.ensure_future(self.room.update_leaderboard())        
             
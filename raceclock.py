@@ -0,0 +1,88 @@
+## Times races.
+## Elapsed time is measured on the monotonic clock, from the moment the race is started. Once the GO! message has
+## been sent, the clock is also anchored to that message's timestamp, so that times for events that come with a
+## Discord message (e.g. `.done`) are measured between the two message timestamps: the time the racer typed the
+## command, rather than the time the bot got around to handling it.
+## All times are in hundredths of a second.
+
+import datetime
+import time
+
+from condortimestr import EPOCH
+from condortimestr import to_epoch
+
+class RaceClock(object):
+    def __init__(self):
+        self._start = None              #monotonic time the race started
+        self._start_epoch = None        #wall-clock time the race started (seconds since the epoch, from the GO! message if we have it)
+        self._anchored = False          #True once _start_epoch comes from the GO! message
+        self._paused_at = None          #monotonic time of the current pause, if paused
+        self._paused_total = 0.0        #seconds spent paused
+
+    @property
+    def started(self):
+        return self._start is not None
+
+    @property
+    def paused(self):
+        return self._paused_at is not None
+
+    # UTC datetime (naive) at which the race started, or None
+    @property
+    def start_datetime(self):
+        if self._start_epoch is None:
+            return None
+        return EPOCH + datetime.timedelta(seconds=self._start_epoch)
+
+    # Start the clock now
+    def start(self):
+        self._start = time.monotonic()
+        self._start_epoch = time.time()
+        self._anchored = False
+        self._paused_at = None
+        self._paused_total = 0.0
+
+    # Wall-clock time the race started (seconds since the epoch), or None
+    @property
+    def start_epoch(self):
+        return self._start_epoch
+
+    # Pick a race back up (after a restart) given its start time and pauses, all in seconds since the epoch;
+    # anchored is True if start_epoch is the time of the GO! message
+    def restore(self, start_epoch, anchored, paused_total=0.0, paused_since=None):
+        now = time.monotonic()
+        wall_now = time.time()
+        self._start = now - (wall_now - start_epoch)
+        self._start_epoch = start_epoch
+        self._anchored = anchored
+        self._paused_total = paused_total
+        self._paused_at = now - (wall_now - paused_since) if paused_since is not None else None
+
+    # Anchor the race start to the timestamp (naive UTC datetime) of the GO! message
+    def anchor(self, go_timestamp):
+        if self.started and go_timestamp:
+            self._start_epoch = to_epoch(go_timestamp)
+            self._anchored = True
+
+    def pause(self):
+        if self.started and not self.paused:
+            self._paused_at = time.monotonic()
+
+    def unpause(self):
+        if self.paused:
+            self._paused_total += time.monotonic() - self._paused_at
+            self._paused_at = None
+
+    # Elapsed race time now
+    def elapsed(self):
+        if not self.started:
+            return 0
+        now = self._paused_at if self.paused else time.monotonic()
+        return max(0, int(100*(now - self._start - self._paused_total)))
+
+    # Elapsed race time at the given Discord message timestamp (falls back to the time now if the clock isn't anchored,
+    # or if no timestamp is given)
+    def elapsed_at(self, timestamp):
+        if not timestamp or not self._anchored or self.paused:
+            return self.elapsed()
+        return max(0, int(100*(to_epoch(timestamp) - self._start_epoch - self._paused_total)))
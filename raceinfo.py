@@ -153,6 +153,7 @@ def parse_args_modify(args, race_info):
     return race_info    
 
 class RaceInfo(object):
+    __slots__ = ('seed', 'seed_fixed', 'seeded', 'character', 'descriptor', 'sudden_death', 'flagplant')
 
     def __init__(self):
         self.seed = int(0)                   #the seed for the race
@@ -0,0 +1,97 @@
+## Append-only journal of race events (entries, readies, the start, finishes, etc.), kept in the database so that a
+## race in progress can be rebuilt if the bot goes down in the middle of it.
+## Each race room's journal begins with a NEW_RACE event; replaying the events after the room's last NEW_RACE
+## (see Race.replay) brings a fresh Race back to the same state. The journal of a room is pruned once its race is
+## recorded, so the table only ever holds the races currently open.
+
+import collections
+import time
+
+# Events (racer_id is set for the per-racer ones; value is described where used)
+NEW_RACE = 'new_race'                       #value: the seed
+ENTER = 'enter'
+UNENTER = 'unenter'
+READY = 'ready'
+UNREADY = 'unready'
+COUNTDOWN = 'countdown'
+CANCEL_COUNTDOWN = 'cancel_countdown'
+START = 'start'                             #value: the race start (seconds since the epoch)
+ANCHOR = 'anchor'                           #value: the time of the GO! message (seconds since the epoch)
+PAUSE = 'pause'
+UNPAUSE = 'unpause'
+FINISH = 'finish'                           #value: the racer's time (hundredths of a second)
+UNFINISH = 'unfinish'
+FORFEIT = 'forfeit'                         #value: the racer's time (hundredths of a second)
+UNFORFEIT = 'unforfeit'
+END = 'end'                                 #the race is complete, and waiting to be finalized
+CANCEL_END = 'cancel_end'
+FINALIZE = 'finalize'
+CANCEL = 'cancel'
+
+JournalEvent = collections.namedtuple('JournalEvent', ['event', 'racer_id', 'value', 'wall_time'])
+
+class RaceJournal(object):
+    def __init__(self, db_connection):
+        self._db_conn = db_connection
+        RaceJournal.make_table(self._db_conn)
+
+    # Creates the journal table (also called from dbmake); safe to call on an existing database
+    @staticmethod
+    def make_table(db_conn):
+        db_conn.execute("""CREATE TABLE IF NOT EXISTS race_events
+                        (event_id integer PRIMARY KEY AUTOINCREMENT,
+                        channel_id int,
+                        event text,
+                        racer_id int,
+                        value real,
+                        wall_time real)""")
+        db_conn.execute("CREATE INDEX IF NOT EXISTS race_events_channel ON race_events (channel_id, event_id)")
+        db_conn.commit()
+
+    # Returns a ChannelJournal that records events for the given race room
+    def for_channel(self, channel_id):
+        return ChannelJournal(self, channel_id)
+
+    # Appends an event; it's committed before this returns
+    def record(self, channel_id, event, racer_id=None, value=None):
+        params = (int(channel_id), event, int(racer_id) if racer_id is not None else None, value, time.time(),)
+        self._db_conn.execute("INSERT INTO race_events (channel_id, event, racer_id, value, wall_time) VALUES (?,?,?,?,?)", params)
+        self._db_conn.commit()
+
+    # Returns the events of the channel's current race (since its last NEW_RACE), oldest first
+    def events_for(self, channel_id):
+        params = (int(channel_id), NEW_RACE,)
+        first_event_id = None
+        for row in self._db_conn.execute("SELECT MAX(event_id) FROM race_events WHERE channel_id=? AND event=?", params):
+            first_event_id = row[0]
+        if first_event_id is None:
+            return []
+
+        params = (int(channel_id), first_event_id,)
+        return [JournalEvent(row[0], int(row[1]) if row[1] is not None else None, row[2], row[3])
+                for row in self._db_conn.execute("SELECT event,racer_id,value,wall_time FROM race_events WHERE channel_id=? AND event_id>=? ORDER BY event_id ASC", params)]
+
+    # Returns the ids of the channels that have a race in the journal
+    def open_channel_ids(self):
+        params = (NEW_RACE,)
+        return [int(row[0]) for row in self._db_conn.execute("SELECT DISTINCT channel_id FROM race_events WHERE event=?", params)]
+
+    # Forgets the channel's races (once the race is recorded, or the room closed)
+    def prune(self, channel_id):
+        params = (int(channel_id),)
+        self._db_conn.execute("DELETE FROM race_events WHERE channel_id=?", params)
+        self._db_conn.commit()
+
+class ChannelJournal(object):
+    def __init__(self, journal, channel_id):
+        self._journal = journal
+        self.channel_id = channel_id
+
+    def record(self, event, racer_id=None, value=None):
+        self._journal.record(self.channel_id, event, racer_id, value)
+
+    def events(self):
+        return self._journal.events_for(self.channel_id)
+
+    def prune(self):
+        self._journal.prune(self.channel_id)
@@ -9,16 +9,24 @@ RacerStatusInv = {'1':'Not ready.', '2':'Ready!', '3':'Racing!', '4':'Forfeit',
 ##        ready    --> racing     (use begin_race())
 ##        racing  <--> forfeit    (use forfeit() and unforfeit())
 ##        racing  <--> finished   (use finish() and unfinish())
+## A Racer made with an on_change function calls it as on_change(racer, old_state) after each of these (and after
+## add_comment), so that its Race can keep its counts and standings up to date without rescanning its racers.
 
 class Racer(object):
-    
-    def __init__(self, member):
+    __slots__ = ('member', '_state', 'time', 'igt', 'level', 'comment', '_on_change')
+
+    def __init__(self, member, on_change=None):
         self.member = member    #the Discord member who is this racer
         self._state = 1         #see RacerState notes above
         self.time = int(-1)     #hundredths of a second
         self.igt = int(-1)      #hundredths of a second
         self.level = int(-1)    #level of death (set to 18 for a win, 0 for unknown death)
         self.comment = ''       #a comment added with .comment
+        self._on_change = on_change
+
+    def _changed(self, old_state):
+        if self._on_change:
+            self._on_change(self, old_state)
 
     @property
     def name(self):
@@ -54,6 +62,10 @@ class Racer(object):
     def time_str(self):
         return racetime.to_str(self.time)
 
+    @property
+    def state(self):
+        return self._state
+
     @property
     def is_ready(self):
         return self._state == RacerStatus['ready']
@@ -81,27 +93,32 @@ class Racer(object):
     def ready(self):
         if self._state == RacerStatus['unready']:
             self._state = RacerStatus['ready']
+            self._changed(RacerStatus['unready'])
             return True
         return False
 
     def unready(self):
         if self._state == RacerStatus['ready']:
             self._state = RacerStatus['unready']
+            self._changed(RacerStatus['ready'])
             return True
         return False
 
     def begin_race(self):
         if self._state == RacerStatus['ready']:
             self._state = RacerStatus['racing']
+            self._changed(RacerStatus['ready'])
             return True
         return False
 
     def forfeit(self, time):
         if self._state == RacerStatus['racing'] or self._state == RacerStatus['finished']:
+            old_state = self._state
             self._state = RacerStatus['forfeit']
             self.time = time
             self.level = 0
             self.igt = int(-1)
+            self._changed(old_state)
             return True
         return False
 
@@ -111,6 +128,7 @@ class Racer(object):
             self.time = int(-1)
             self.igt = int(-1)
             self.level = int(-1)
+            self._changed(RacerStatus['forfeit'])
             return True
         return False
 
@@ -119,6 +137,7 @@ class Racer(object):
             self._state = RacerStatus['finished']
             self.time = time
             self.level = 18
+            self._changed(RacerStatus['racing'])
             return True
         return False
             
@@ -128,9 +147,11 @@ class Racer(object):
             self.time = int(-1)
             self.igt = int(-1)
             self.level = int(-1)
+            self._changed(RacerStatus['finished'])
             return True
         return False
 
     def add_comment(self, comment):
         self.comment = comment
+        self._changed(self._state)
         
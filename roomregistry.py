@@ -0,0 +1,64 @@
+## The open race rooms, by channel id, so that finding the room for a message is a dict lookup rather than a scan.
+## Rooms are torn down when they're removed: their topic updates and race timers are cancelled (see RaceRoom.close),
+## so that nothing is left running for a channel that's gone. Rooms whose match is over are evicted once nobody has
+## used them for a while, so that a long-running bot doesn't hold on to every room of the season.
+
+import time
+
+class RoomRegistry(object):
+    # idle_sec: seconds without a command after which a room whose match is over is evicted
+    def __init__(self, idle_sec):
+        self._idle_sec = idle_sec
+        self._rooms = {}                    #channel id (as a str) -> RaceRoom
+        self._last_used = {}                #channel id -> time.monotonic() when the room was last used
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def __iter__(self):
+        return iter(list(self._rooms.values()))
+
+    def __contains__(self, channel_id):
+        return str(channel_id) in self._rooms
+
+    @property
+    def channel_ids(self):
+        return list(self._rooms.keys())
+
+    # Number of pending topic updates and race timers across all rooms
+    @property
+    def num_tasks(self):
+        return sum(room.num_tasks for room in self._rooms.values())
+
+    # Returns the room for the channel, or None
+    def get(self, channel_id):
+        return self._rooms.get(str(channel_id))
+
+    # Adds the room, replacing (and closing) any room already in its channel
+    def add(self, room):
+        key = str(room.channel.id)
+        old_room = self._rooms.get(key)
+        if old_room and old_room is not room:
+            old_room.close()
+        self._rooms[key] = room
+        self._last_used[key] = time.monotonic()
+
+    # Removes and closes the channel's room; returns it, or None if there wasn't one
+    def remove(self, channel_id):
+        key = str(channel_id)
+        room = self._rooms.pop(key, None)
+        self._last_used.pop(key, None)
+        if room:
+            room.close()
+        return room
+
+    # Note that the channel's room was just used (so it isn't evicted)
+    def touch(self, channel_id):
+        key = str(channel_id)
+        if key in self._rooms:
+            self._last_used[key] = time.monotonic()
+
+    # The channels whose rooms have a finished match and haven't been used for idle_sec
+    def idle_channel_ids(self):
+        cutoff = time.monotonic() - self._idle_sec
+        return [key for key, room in self._rooms.items() if self._last_used[key] <= cutoff and room.is_finished]
@@ -0,0 +1,141 @@
+## The list of upcoming matches posted in the schedule channel.
+## The board is made of one or more messages (MATCHES_PER_MESSAGE matches each), whose ids are kept in the database
+## so they can be edited in place across restarts. Each refresh renders from a single query, and only the messages
+## whose text actually changed are edited.
+
+import asyncio
+import datetime
+import discord
+import pytz
+
+import condortimestr
+import outbound
+
+MATCHES_PER_MESSAGE = 20
+
+class ScheduleBoard(object):
+    def __init__(self, necrobot, condordb, max_matches):
+        self._necrobot = necrobot
+        self._db = condordb
+        self._max_matches = max_matches
+        self._lock = asyncio.Lock()
+        self._messages = []                     #the Message for each page, once known
+        self._texts = []                        #the text last posted on each page
+
+    @property
+    def client(self):
+        return self._necrobot.client
+
+    # Re-render the board, editing only the pages that changed
+    @asyncio.coroutine
+    def update(self):
+        channel = self._necrobot.schedule_channel
+        if not channel:
+            return
+
+        utcnow = pytz.utc.localize(datetime.datetime.utcnow())
+        pages = ScheduleBoard.render(self._db.get_upcoming_matches(utcnow, limit=self._max_matches), utcnow)
+
+        yield from self._lock.acquire()
+        try:
+            yield from self._update_pages(channel, pages)
+        finally:
+            self._lock.release()
+
+    @asyncio.coroutine
+    def _update_pages(self, channel, pages):
+        if not self._messages:
+            yield from self._load_messages(channel)
+
+        for page, text in enumerate(pages):
+            if page < len(self._texts) and self._texts[page] == text:
+                continue
+            if page < len(self._messages):
+                try:
+                    self._messages[page] = yield from self.client.edit_message(self._messages[page], text, priority=outbound.PRIORITY_BACKGROUND)
+                    self._texts[page] = text
+                    continue
+                except discord.NotFound:
+                    # someone deleted our message; remove everything after it too, and post anew, so the pages stay in order
+                    yield from self._delete_from(channel, page + 1)
+                    self._forget_from(channel, page)
+            message = yield from self.client.send_message(channel, text, priority=outbound.PRIORITY_BACKGROUND)
+            self._db.set_schedule_message_id(channel.id, page, message.id)
+            self._messages.append(message)
+            self._texts.append(text)
+
+        # the board got shorter: remove the pages we no longer need
+        yield from self._delete_from(channel, len(pages))
+
+    # Returns a list of the text of each page of the board
+    @staticmethod
+    def render(matches, utcnow):
+        max_r1_len = 0
+        max_r2_len = 0
+        for match in matches:
+            max_r1_len = max(max_r1_len, len(match.racer_1.twitch_name))
+            max_r2_len = max(max_r2_len, len(match.racer_2.twitch_name))
+
+        pages = []
+        for first in range(0, max(len(matches), 1), MATCHES_PER_MESSAGE):
+            text = '``` \nUpcoming matches: \n' if first == 0 else '``` \n'
+            for match in matches[first:first + MATCHES_PER_MESSAGE]:
+                text += '{r1:>{w1}} v {r2:<{w2}} : '.format(r1=match.racer_1.twitch_name, w1=max_r1_len, r2=match.racer_2.twitch_name, w2=max_r2_len)
+                if match.time - utcnow < datetime.timedelta(minutes=0):
+                    text += 'Right now!'
+                else:
+                    text += condortimestr.get_24h_time_str(match.time)
+                text += '\n'
+            text += '```'
+            pages.append(text)
+        return pages
+
+    # Find the board's messages from their stored ids (on the first update after a restart)
+    @asyncio.coroutine
+    def _load_messages(self, channel):
+        message_ids = self._db.get_schedule_message_ids(channel.id)
+        if not message_ids:
+            message = yield from self._find_old_board(channel)
+            if message:
+                self._db.set_schedule_message_id(channel.id, 0, message.id)
+                message_ids = [int(message.id)]
+
+        for page, message_id in enumerate(message_ids):
+            try:
+                message = yield from self.client.get_message(channel, str(message_id))
+            except discord.NotFound:
+                # a page is missing; remove the pages after it, since the board is reposted from here on
+                for later_id in message_ids[page + 1:]:
+                    try:
+                        later_message = yield from self.client.get_message(channel, str(later_id))
+                        yield from self.client.delete_message(later_message, priority=outbound.PRIORITY_BACKGROUND)
+                    except discord.NotFound:
+                        pass
+                self._db.delete_schedule_messages(channel.id, page)
+                break
+            self._messages.append(message)
+            self._texts.append(message.content)
+
+    # Boards posted before their ids were stored have to be found by looking through the channel (this is only done once)
+    @asyncio.coroutine
+    def _find_old_board(self, channel):
+        logs = yield from self.client.logs_from(channel, priority=outbound.PRIORITY_BACKGROUND)
+        for message in logs:
+            if message.author.id == self.client.user.id and message.content.startswith('```'):
+                return message
+        return None
+
+    # Delete the board's messages from the given page on (those still there), and forget them
+    @asyncio.coroutine
+    def _delete_from(self, channel, page):
+        for message in self._messages[page:]:
+            try:
+                yield from self.client.delete_message(message, priority=outbound.PRIORITY_BACKGROUND)
+            except discord.NotFound:
+                pass
+        self._forget_from(channel, page)
+
+    def _forget_from(self, channel, page):
+        del self._messages[page:]
+        del self._texts[page:]
+        self._db.delete_schedule_messages(channel.id, page)
@@ -0,0 +1,179 @@
+## Runs timed jobs (match alerts, pre-race warnings, race start, etc.) from a single background task.
+## A job is identified by its type and the channel it belongs to. Scheduling a job that already exists moves it,
+## so rescheduling a match replaces its timers instead of adding new ones.
+## Jobs are kept in a heap ordered by fire time; a moved or cancelled job leaves a stale heap entry behind, which
+## is skipped when it comes up (so scheduling is O(log n) and cancelling is O(1)).
+## If given a JobStore, jobs are also saved to the database. Only the jobs due within LOAD_HORIZON_SEC are kept in
+## memory; later ones are read back as their time approaches. Jobs whose time passed while the bot was down fire as
+## soon as it starts again.
+
+import asyncio
+import botlog
+import condortimestr
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_SLEEP_SEC = 60              # wake up at least this often, in case the system clock jumps
+LOAD_HORIZON_SEC = 6*60*60      # stored jobs due within this many seconds are loaded into memory
+
+class Scheduler(object):
+    def __init__(self, supervisor, job_store=None):
+        self._supervisor = supervisor
+        self._store = job_store
+        self._handlers = {}                         # job type -> coroutine function taking a channel id
+        self._persistent = set()                    # job types that are saved to the job store
+        self._kept = set()                          # job types that stay in the job store after firing, until complete() is called
+        self._loaded_until = None                   # stored jobs due up to this time have been loaded into memory
+        self._jobs = {}                             # (job type, channel id) -> (fire time, sequence number)
+        self._heap = []                             # (fire time, sequence number, (job type, channel id))
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @property
+    def num_jobs(self):
+        return len(self._jobs)
+
+    # True if the job store was just created (so there are no saved jobs to go on)
+    @property
+    def job_store_is_new(self):
+        return self._store is None or self._store.is_new
+
+    # Register the coroutine function to call (with the channel id) when a job of the given type fires.
+    # Jobs are saved to the job store unless persistent is False. If keep_until_complete is True, a job stays
+    # saved after it fires, until complete() is called for it; so if the bot restarts in between, it fires again.
+    def register(self, job_type, handler, persistent=True, keep_until_complete=False):
+        self._handlers[job_type] = handler
+        self._persistent.discard(job_type)
+        self._kept.discard(job_type)
+        if persistent:
+            self._persistent.add(job_type)
+            if keep_until_complete:
+                self._kept.add(job_type)
+
+    # Start the background task that fires jobs. Safe to call more than once.
+    # The first call loads the stored jobs that are due (or overdue), so register handlers before calling this.
+    def start(self):
+        if self._store and self._loaded_until is None:
+            self._load_stored_jobs()
+        if not self._task or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    # Schedule (or reschedule) the job of the given type for the channel to fire at fire_time (an aware datetime).
+    # Jobs whose time has already passed fire right away.
+    def schedule(self, job_type, channel_id, fire_time):
+        self.schedule_at(job_type, channel_id, condortimestr.to_epoch(fire_time))
+
+    # As schedule(), but fire_epoch is in seconds since the epoch
+    def schedule_at(self, job_type, channel_id, fire_epoch):
+        if job_type not in self._handlers:
+            logger.error('Error: tried to schedule a job of unknown type <%s>.', job_type, extra=botlog.context(channel=channel_id))
+            return
+
+        key = (job_type, int(channel_id))
+        if self._is_stored(job_type):
+            self._store.save(job_type, key[1], fire_epoch)
+            if self._loaded_until is not None and fire_epoch > self._loaded_until:
+                self._jobs.pop(key, None)           # it will be loaded when its time gets close
+                return
+
+        seq = next(self._sequence)
+        self._jobs[key] = (fire_epoch, seq)
+        heapq.heappush(self._heap, (fire_epoch, seq, key))
+        if self._heap[0][1] == seq:
+            self._wakeup.set()
+        self._compact()
+
+    def cancel(self, job_type, channel_id):
+        self._jobs.pop((job_type, int(channel_id)), None)
+        if self._is_stored(job_type):
+            self._store.delete(job_type, channel_id)
+
+    # Cancel every job belonging to the channel
+    def cancel_channel(self, channel_id):
+        for job_type in self._handlers:
+            self._jobs.pop((job_type, int(channel_id)), None)
+        if self._store:
+            self._store.delete_channel(channel_id)
+
+    # Forget a job registered with keep_until_complete, once the work it starts is done
+    def complete(self, job_type, channel_id):
+        if not self.is_scheduled(job_type, channel_id) and self._is_stored(job_type):
+            self._store.delete(job_type, channel_id)
+
+    def is_scheduled(self, job_type, channel_id):
+        return (job_type, int(channel_id)) in self._jobs
+
+    # Returns the fire time (seconds since the epoch) of the job, or None if there is no such job
+    def fire_time(self, job_type, channel_id):
+        job = self._jobs.get((job_type, int(channel_id)))
+        return job[0] if job else None
+
+    @asyncio.coroutine
+    def run(self):
+        while True:
+            self._wakeup.clear()
+            if self._store and time.time() + LOAD_HORIZON_SEC/2 > self._loaded_until:
+                self._load_stored_jobs()
+            self._fire_due_jobs()
+            delay = MAX_SLEEP_SEC
+            if self._heap:
+                delay = min(delay, max(0.0, self._heap[0][0] - time.time()))
+            try:
+                yield from asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _fire_due_jobs(self):
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            fire_epoch, seq, key = heapq.heappop(self._heap)
+            job = self._jobs.get(key)
+            if not job or job[1] != seq:
+                continue                            # stale entry: the job was moved or cancelled
+            del self._jobs[key]
+            self._fire(key[0], key[1], fire_epoch)
+
+    def _fire(self, job_type, channel_id, fire_epoch):
+        self._supervisor.spawn(self._run_job(job_type, channel_id, fire_epoch), name='{0} ({1})'.format(job_type, channel_id))
+
+    @asyncio.coroutine
+    def _run_job(self, job_type, channel_id, fire_epoch):
+        try:
+            yield from self._handlers[job_type](channel_id)
+        finally:
+            # Only forget the stored job once it has run, so that a restart in the middle of it runs it again.
+            # (If the handler rescheduled the job, the stored fire time has changed, and it's left alone.)
+            if self._is_stored(job_type) and job_type not in self._kept:
+                self._store.delete(job_type, channel_id, fire_epoch)
+
+    def _is_stored(self, job_type):
+        return self._store is not None and job_type in self._persistent
+
+    # Read the stored jobs due before the end of the next horizon into memory
+    def _load_stored_jobs(self):
+        until = time.time() + LOAD_HORIZON_SEC
+        for job_type, channel_id, fire_epoch in self._store.load(until, after=self._loaded_until):
+            key = (job_type, channel_id)
+            if job_type not in self._handlers or key in self._jobs:
+                continue
+            seq = next(self._sequence)
+            self._jobs[key] = (fire_epoch, seq)
+            heapq.heappush(self._heap, (fire_epoch, seq, key))
+        self._loaded_until = until
+        self._compact()
+
+    # Throw away stale heap entries once they make up most of the heap
+    def _compact(self):
+        if len(self._heap) > 64 and len(self._heap) > 2*len(self._jobs):
+            self._heap = [(fire_epoch, seq, key) for key, (fire_epoch, seq) in self._jobs.items()]
+            heapq.heapify(self._heap)
@@ -0,0 +1,43 @@
+## Times the phases of the bot's startup, for the report printed once it's all done.
+## The main phases (imports, login, connecting, loading modules) run one after another, and are ended with mark().
+## The work the bot does in the background once it's ready (opening the GSheet, rebuilding alerts, the schedule
+## channel) runs alongside everything else, and each piece is timed with time().
+
+import asyncio
+import time
+
+class StartupTimer(object):
+    # start is the time.perf_counter() at which the process started, if known
+    def __init__(self, start=None):
+        self._start = start if start is not None else time.perf_counter()
+        self._last_mark = self._start
+        self.phases = []                    #(name, seconds taken, seconds since the start when it finished)
+        self.ready_at = None                #seconds since the start when the bot could take commands
+
+    # End the current main phase
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last_mark, now - self._start))
+        self._last_mark = now
+
+    # The bot is ready for commands; the phases after this are background ones
+    def mark_ready(self, name):
+        self.mark(name)
+        self.ready_at = self.phases[-1][2]
+
+    # Run the coroutine, timing it as a phase of its own
+    @asyncio.coroutine
+    def time(self, name, coro):
+        start = time.perf_counter()
+        try:
+            return (yield from coro)
+        finally:
+            now = time.perf_counter()
+            self.phases.append((name, now - start, now - self._start))
+
+    @property
+    def report_str(self):
+        phases = ', '.join('{0} {1:.2f}s'.format(name, seconds) for name, seconds, finished_at in self.phases)
+        done_at = max(finished_at for name, seconds, finished_at in self.phases) if self.phases else 0.0
+        ready_at = '; ready for commands at {0:.2f}s'.format(self.ready_at) if self.ready_at is not None else ''
+        return 'Startup: {0}{1}; all done at {2:.2f}s.'.format(phases, ready_at, done_at)
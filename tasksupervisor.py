@@ -0,0 +1,157 @@
+## Runs the bot's background work: commands are queued per channel (so that, e.g., `.ready` and `.done` in a
+## race room are handled in the order they were typed), and every task shares a global concurrency limit.
+## Pending, running and failed tasks are tracked so that a backlog can be seen rather than guessed at.
+
+import asyncio
+import botlog
+import collections
+import datetime
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+
+class FailedTask(object):
+    def __init__(self, name, exception, key=None):
+        self.name = name
+        self.key = key                                      #the channel key the task was queued under, if any
+        self.exception = exception
+        self.time = datetime.datetime.utcnow()
+        self.traceback = traceback.format_exc()
+
+    def __str__(self):
+        return '{0} ({1}): {2}'.format(self.name, self.time.strftime("%m/%d %H:%M:%S"), repr(self.exception))
+
+class TaskSupervisor(object):
+    MAX_FAILURES_KEPT = 50
+
+    def __init__(self, max_concurrent, channel_queue_size):
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._channel_queue_size = channel_queue_size
+        self._queues = {}                                   #channel key -> asyncio.Queue of (name, coroutine, future), or None to wake its worker
+        self._workers = {}                                  #channel key -> the Task draining that channel's queue
+        self._num_submitting = collections.Counter()        #channel key -> submits still waiting to put into its queue
+        self._spawned = set()                               #fire-and-forget tasks that have not yet finished
+
+        self._num_pending = 0                               #tasks accepted but not yet started
+        self._num_running = 0
+        self._num_completed = 0
+        self._num_failed = 0
+        self.failures = collections.deque(maxlen=TaskSupervisor.MAX_FAILURES_KEPT)
+
+    @property
+    def num_pending(self):
+        return self._num_pending
+
+    @property
+    def num_running(self):
+        return self._num_running
+
+    @property
+    def num_completed(self):
+        return self._num_completed
+
+    @property
+    def num_failed(self):
+        return self._num_failed
+
+    @property
+    def num_channel_queues(self):
+        return len(self._queues)
+
+    @property
+    def status_str(self):
+        return 'Tasks: {0} running, {1} pending ({2} channel queues), {3} completed, {4} failed.'.format(
+            self._num_running, self._num_pending, len(self._queues), self._num_completed, self._num_failed)
+
+    # Queue the coroutine coro to run after all earlier work submitted for the same channel key.
+    # If that channel's queue is full, waits until there is room (this is the back-pressure on incoming messages).
+    # Returns a Future that is resolved when the coroutine has finished.
+    @asyncio.coroutine
+    def submit(self, key, coro, name=None):
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self._channel_queue_size)
+            self._queues[key] = queue
+            self._workers[key] = asyncio.ensure_future(self._drain(key, queue))
+
+        done_future = asyncio.Future()
+        self._num_pending += 1
+        self._num_submitting[key] += 1
+        try:
+            yield from queue.put((name if name else str(key), coro, done_future))
+        except:
+            self._num_pending -= 1
+            coro.close()
+            if queue.empty():
+                queue.put_nowait(None)                      # the worker may be waiting for this submit's work; wake it
+            raise
+        finally:
+            self._num_submitting[key] -= 1
+            if not self._num_submitting[key]:
+                del self._num_submitting[key]
+        return done_future
+
+    # Run the coroutine coro as soon as the concurrency limit allows, without ordering it against anything else.
+    # Use this for internal work (not for user commands). Returns the Task.
+    def spawn(self, coro, name=None):
+        self._num_pending += 1
+        task = asyncio.ensure_future(self._run(name if name else 'task', coro))
+        self._spawned.add(task)
+        task.add_done_callback(self._spawned.discard)
+        return task
+
+    # Cancel everything still queued or running. Used on shutdown.
+    def cancel_all(self):
+        for worker in list(self._workers.values()):
+            worker.cancel()
+        for task in list(self._spawned):
+            task.cancel()
+
+    @asyncio.coroutine
+    def _drain(self, key, queue):
+        try:
+            # A submit that was waiting for room in the full queue is woken by a get, but only puts its work in on a
+            # later turn of the loop; so the worker keeps going (waiting on the queue) while any submit is in progress.
+            while not queue.empty() or self._num_submitting[key]:
+                item = yield from queue.get()
+                if item is None:
+                    continue
+                name, coro, done_future = item
+                try:
+                    yield from self._run(name, coro, key)
+                finally:
+                    if not done_future.done():
+                        done_future.set_result(None)
+        finally:
+            # Nothing else can run between the checks above and here, so no work can be lost.
+            if self._queues.get(key) is queue:
+                del self._queues[key]
+                del self._workers[key]
+
+    # key is the channel key the task was queued under (None for spawned tasks)
+    @asyncio.coroutine
+    def _run(self, name, coro, key=None):
+        try:
+            yield from self._semaphore.acquire()
+        except asyncio.CancelledError:
+            self._num_pending -= 1
+            coro.close()
+            raise
+
+        self._num_pending -= 1
+        self._num_running += 1
+        try:
+            yield from coro
+            self._num_completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._num_failed += 1
+            failure = FailedTask(name, e, key)
+            self.failures.append(failure)
+            logger.error('Error in task %s.\n%s', failure, failure.traceback,
+                         extra=botlog.context(channel=key, command=name) if key is not None else botlog.context(task=name))
+        finally:
+            self._num_running -= 1
+            self._semaphore.release()
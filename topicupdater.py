@@ -0,0 +1,85 @@
+## Keeps a channel's topic up to date without spamming the Discord API.
+## Calls to request() only mark the topic as stale; the topic is rendered and sent a short time later, so a burst
+## of requests costs a single render and a single edit. Edits that wouldn't change the topic are skipped, and edits
+## are spaced out so as to stay under the channel-edit rate limit.
+
+import asyncio
+import botlog
+import logging
+
+from outbound import ROUTE_LIMITS
+
+logger = logging.getLogger(__name__)
+
+UPDATE_DELAY = 1.0                                                          # seconds to wait for more requests before rendering
+MIN_EDIT_INTERVAL = ROUTE_LIMITS['edit_channel'][1] / ROUTE_LIMITS['edit_channel'][0]
+
+class TopicUpdater(object):
+    # get_channel is a function taking no arguments and returning the channel (looked up on each edit, since the
+    # channel object is replaced when the bot reconnects); render is a function taking no arguments and returning the topic text
+    def __init__(self, client, get_channel, render):
+        self._loop = asyncio.get_event_loop()
+        self._client = client
+        self._get_channel = get_channel
+        self._render = render
+        self._stale = False
+        self._last_topic = None                 # the last topic we sent
+        self._last_edit_time = None             # loop time of the last edit
+        self._flush_handle = None               # TimerHandle for the scheduled flush
+        self._flush_future = None               # the running flush, if any
+
+    @property
+    def last_topic(self):
+        return self._last_topic
+
+    # True if an update is scheduled or being sent
+    @property
+    def pending(self):
+        return bool(self._flush_handle or self._flush_future)
+
+    # Mark the topic as needing an update
+    def request(self):
+        self._stale = True
+        if self._flush_handle or self._flush_future:
+            return
+
+        delay = UPDATE_DELAY
+        if self._last_edit_time is not None:
+            delay = max(delay, self._last_edit_time + MIN_EDIT_INTERVAL - self._loop.time())
+        self._flush_handle = self._loop.call_later(delay, self._begin_flush)
+
+    # Stop any pending update (e.g., because the channel is being closed)
+    def cancel(self):
+        self._stale = False
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_future:
+            self._flush_future.cancel()
+            self._flush_future = None
+
+    def _begin_flush(self):
+        self._flush_handle = None
+        self._flush_future = asyncio.ensure_future(self._flush())
+        self._flush_future.add_done_callback(self._end_flush)
+
+    def _end_flush(self, future):
+        if future is not self._flush_future:
+            return
+        self._flush_future = None
+        if not future.cancelled() and future.exception():
+            channel = self._get_channel()
+            logger.error('Error updating the topic for channel %s: %r', channel.name, future.exception(), extra=botlog.context(channel=channel))
+        if self._stale:
+            self.request()
+
+    @asyncio.coroutine
+    def _flush(self):
+        self._stale = False
+        topic = self._render()
+        if topic == self._last_topic:
+            return
+
+        self._last_edit_time = self._loop.time()
+        yield from self._client.edit_channel(self._get_channel(), topic=topic)
+        self._last_topic = topic
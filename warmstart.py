@@ -0,0 +1,55 @@
+## A snapshot of the state the bot works out at login: the server and channel ids it resolved, the race rooms it had
+## open, and how many timers were pending. It's saved to a small JSON file whenever that state changes, so that on a
+## restart the bot can pick its channels up by id and reopen its rooms at once, and check them against Discord in
+## the background afterwards, instead of rebuilding everything before it takes commands.
+## (On a reconnect within the same process, nothing needs reloading: see Necrobot.reconnect.)
+## A snapshot that's too old, from another version, or unreadable is ignored, and the bot starts cold.
+
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+MAX_AGE_SEC = 24*60*60
+
+class WarmStart(object):
+    def __init__(self, filename):
+        self._filename = filename
+
+    # Returns the saved snapshot (a dict), or None if there isn't a usable one
+    def load(self):
+        try:
+            with open(self._filename, 'r') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning('Couldn\'t read the warm-start snapshot %s: %r', self._filename, e)
+            return None
+
+        if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+            return None
+        if time.time() - snapshot.get('saved_at', 0) > MAX_AGE_SEC:
+            return None
+        return snapshot
+
+    # Saves the snapshot (a dict, which this stamps with the version and time). The file is replaced in one step, so
+    # that a crash while writing doesn't leave half a snapshot behind.
+    def save(self, snapshot):
+        snapshot = dict(snapshot, version=SNAPSHOT_VERSION, saved_at=time.time())
+        temp_filename = self._filename + '.tmp'
+        try:
+            with open(temp_filename, 'w') as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+            os.replace(temp_filename, self._filename)
+        except OSError as e:
+            logger.warning('Couldn\'t save the warm-start snapshot %s: %r', self._filename, e)
+
+    def clear(self):
+        try:
+            os.remove(self._filename)
+        except FileNotFoundError:
+            pass